@@ -1,25 +1,152 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
-import sqlite3
+from fastapi.responses import FileResponse, JSONResponse
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import math
 import os
+import time
 
-from ml_pipeline import DB_PATH, get_model, get_collection, search_similar, search_raw_text
+from catalog import CatalogStore
+from database import get_read_connection
+from ml_pipeline import check_index_source, snapshot_required, get_model, get_collection, get_neighbor_table, get_lexical_index, get_note_index, get_reranker, get_embedding_cache, search_similar, search_raw_text, search_raw_text_many, search_similar_many, search_multi_seed
 
 from contextlib import asynccontextmanager
 
+def _available_cpus():
+    # CPUs this process may actually use: its affinity mask (a container's
+    # cpuset), further capped by a cgroup v2 CPU quota when one is set
+    try:
+        count = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        count = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            count = min(count, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return count
+
+def _physical_cores():
+    # Hyperthreads don't help a CPU-bound encoder, so count unique (socket, core) pairs.
+    # /proc/cpuinfo lists the whole host, so the count is capped at the CPUs this process can use
+    available = _available_cpus()
+    try:
+        cores = set()
+        physical_id = None
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("physical id"):
+                    physical_id = line.split(":")[1].strip()
+                elif line.startswith("core id"):
+                    cores.add((physical_id, line.split(":")[1].strip()))
+        if cores:
+            return min(len(cores), available)
+    except OSError:
+        pass
+    return available
+
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", _physical_cores()))
+DB_WORKERS = int(os.environ.get("DB_WORKERS", "1"))
+# Requests waiting on or running inference beyond this are rejected with 503
+MAX_PENDING_REQUESTS = int(os.environ.get("MAX_PENDING_REQUESTS", "64"))
+MAX_BATCH_QUERIES = int(os.environ.get("MAX_BATCH_QUERIES", "5000"))
+# Largest top_k any endpoint accepts; anything outside 1..MAX_TOP_K is rejected with 422
+MAX_TOP_K = int(os.environ.get("MAX_TOP_K", "100"))
+# How often to check whether the SQLite file changed and the catalog needs reloading
+CATALOG_RELOAD_SECONDS = float(os.environ.get("CATALOG_RELOAD_SECONDS", "30"))
+# "background" binds the port first and loads the model and index in a task,
+# reporting progress on /ready; "blocking" loads everything before serving
+STARTUP_MODE = os.environ.get("STARTUP_MODE", "background").lower()
+
+_inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+_db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="sqlite")
+_pending_requests = 0
+catalog = CatalogStore()
+startup = {"mode": STARTUP_MODE, "ready": False, "started_at": time.time(), "phases": {}, "total_seconds": None}
+
+def _load_index():
+    get_collection()
+    get_neighbor_table()
+
+def _load_model():
+    # The first forward pass is much slower than the rest, so pay for it here
+    get_model().encode(["warm up"])
+
+# (name, loader, required), where required may be a callable checked at load
+# time. A failed optional phase is reported on /ready but doesn't hold
+# readiness back: the embedding cache only warms up query encoding, and quiz
+# searches fall back to semantic-only without the lexical index. The snapshot
+# phases are only required when there is a snapshot or the numpy backend needs
+# one; a Chroma-only deploy serves without note filters.
+STARTUP_PHASES = [
+    ("catalog", catalog.load, True),
+    # Fails startup when the index snapshot wasn't built from this database
+    ("index_source", check_index_source, snapshot_required),
+    ("embedding_cache", lambda: get_embedding_cache().load(), False),
+    ("index", _load_index, True),
+    ("lexical_index", get_lexical_index, False),
+    ("note_index", get_note_index, snapshot_required),
+    ("reranker", get_reranker, True),
+    ("model", _load_model, True),
+]
+
+async def load_components():
+    loop = asyncio.get_running_loop()
+    failed = False
+    for name, load, required in STARTUP_PHASES:
+        required = required() if callable(required) else required
+        phase_start = time.perf_counter()
+        try:
+            await loop.run_in_executor(None, load)
+            startup["phases"][name] = {"seconds": round(time.perf_counter() - phase_start, 3)}
+            print(f"startup: {name} loaded in {startup['phases'][name]['seconds']}s")
+        except Exception as e:
+            failed = failed or required
+            startup["phases"][name] = {"seconds": round(time.perf_counter() - phase_start, 3), "error": str(e), "required": required}
+            if required:
+                print(f"startup: couldn't load {name} (index or database might need building): {e}")
+            else:
+                print(f"startup: couldn't load {name}, carrying on without it: {e}")
+    startup["total_seconds"] = round(time.time() - startup["started_at"], 3)
+    startup["ready"] = not failed
+    if startup["ready"]:
+        print(f"api is up and running ({startup['total_seconds']}s)")
+
+async def watch_catalog():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(CATALOG_RELOAD_SECONDS)
+        try:
+            await loop.run_in_executor(_db_executor, catalog.reload_if_changed)
+        except Exception as e:
+            print(f"couldn't reload catalog: {e}")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("loading up models and index...")
-    try:
-        get_model()
-        get_collection()
-        print("api is up and running")
-    except Exception as e:
-        print(f"Error loading models or Chroma (index might need building): {e}")
+    print(f"loading up models and index ({STARTUP_MODE} startup)...")
+    if STARTUP_MODE == "blocking":
+        await load_components()
+        loader = None
+    else:
+        loader = asyncio.create_task(load_components())
+    watcher = asyncio.create_task(watch_catalog())
     yield
     print("shutting down...")
+    watcher.cancel()
+    if loader:
+        loader.cancel()
+    try:
+        get_embedding_cache().save()
+    except Exception as e:
+        print(f"couldn't persist embedding cache: {e}")
+    _inference_executor.shutdown(wait=False)
+    _db_executor.shutdown(wait=False)
 
 app = FastAPI(lifespan=lifespan, title="Cologne Recommender API")
 
@@ -31,64 +158,75 @@ def read_root():
 
 class QuizRequest(BaseModel):
     preferences: str
-    top_k: int = 5
+    top_k: int = Field(5, ge=1, le=MAX_TOP_K)
+    gender: str = "All"
+    min_popularity: float = 0.0
+    # Results must have every include note and none of the exclude notes
+    include_notes: List[str] = []
+    exclude_notes: List[str] = []
+    # Re-ranking weights for log-popularity and review sentiment; None uses the server defaults
+    popularity_weight: Optional[float] = None
+    review_weight: Optional[float] = None
+    # MMR trade-off (0 = pure relevance, 1 = pure novelty) and a per-brand result cap (0 = no cap)
+    diversity: float = 0.0
+    max_per_brand: int = 0
+
+class BatchRequest(BaseModel):
+    preferences: List[str] = []
+    cologne_ids: List[int] = []
+    top_k: int = Field(5, ge=1, le=MAX_TOP_K)
+    gender: str = "All"
+    min_popularity: float = 0.0
+
+class MultiSeedRequest(BaseModel):
+    liked_ids: List[int]
+    disliked_ids: List[int] = []
+    top_k: int = Field(5, ge=1, le=MAX_TOP_K)
     gender: str = "All"
+    min_popularity: float = 0.0
+    # "centroid" averages the seed embeddings; "rrf" fuses each seed's ranking
+    method: str = "centroid"
+    include_notes: List[str] = []
+    exclude_notes: List[str] = []
+    popularity_weight: Optional[float] = None
+    review_weight: Optional[float] = None
+    diversity: float = 0.0
+    max_per_brand: int = 0
+
+def build_quiz_query(preferences, gender):
+    # Format the query to seamlessly match the structure of the document vectors to eliminate hubness
+    gender_phrase = f"{gender.lower()} " if gender != "All" else ""
+    return f"Name: Ideal {gender if gender != 'All' else ''} Fragrance. Brand: Any. Notes: {preferences}. Reviews: I love this {gender_phrase}fragrance because it is {preferences}."
 
 def get_cologne_details(db_ids):
-    if not db_ids:
-        return []
-        
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    placeholders = ','.join('?' * len(db_ids))
-    query = f'''
-    SELECT c.id, c.name, c.brand, c.url, c.gender, GROUP_CONCAT(n.name, ', ')
-    FROM colognes c
-    LEFT JOIN cologne_notes cn ON c.id = cn.cologne_id
-    LEFT JOIN notes n ON cn.note_id = n.id
-    WHERE c.id IN ({placeholders})
-    GROUP BY c.id
-    '''
-    
-    cursor.execute(query, db_ids)
-    results = cursor.fetchall()
-    conn.close()
-    
-    colognes = {}
-    for row in results:
-        notes = row[5].split(', ') if row[5] else []
-        colognes[row[0]] = {
-            "id": row[0],
-            "name": row[1],
-            "brand": row[2],
-            "url": row[3],
-            "gender": row[4],
-            "notes": notes
-        }
-        
-    return [colognes[db_id] for db_id in db_ids if db_id in colognes]
+    return catalog.get_details(db_ids)
 
-@app.get("/colognes")
-def list_colognes(limit: int = 50):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, brand FROM colognes LIMIT ?", (limit,))
-    results = [{"id": r[0], "name": r[1], "brand": r[2]} for r in cursor.fetchall()]
-    conn.close()
-    return results
+async def run_inference(fn, *args, **kwargs):
+    # Handlers only touch the counter from the event loop thread, so no lock is needed
+    global _pending_requests
+    if not startup["ready"]:
+        raise HTTPException(status_code=503, detail="Recommendation engine is still starting up", headers={"Retry-After": "5"})
+    if _pending_requests >= MAX_PENDING_REQUESTS:
+        raise HTTPException(status_code=503, detail="Recommendation engine is busy, try again shortly", headers={"Retry-After": "1"})
+    _pending_requests += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_inference_executor, functools.partial(fn, *args, **kwargs))
+    finally:
+        _pending_requests -= 1
 
-@app.get("/recommend/similar/{cologne_id}")
-def recommend_similar(cologne_id: int, top_k: int = 5, gender: str = "All"):
-    matched_db_ids, match_distances = search_similar(cologne_id, top_k, gender)
-    if not matched_db_ids:
-        raise HTTPException(status_code=404, detail="Cologne ID not found in embedding index")
-        
-    colognes_data = get_cologne_details(matched_db_ids)
-    
+def check_diversity(diversity, max_per_brand):
+    if not 0.0 <= diversity <= 1.0:
+        raise HTTPException(status_code=400, detail="diversity must be between 0 and 1")
+    if max_per_brand < 0:
+        raise HTTPException(status_code=400, detail="max_per_brand must not be negative")
+
+def check_note_filters(include_notes, exclude_notes):
+    if (include_notes or exclude_notes) and "error" in startup["phases"].get("note_index", {}):
+        raise HTTPException(status_code=503, detail="Note filters need the index snapshot, build it with python src/ml_pipeline.py")
+
+def build_results(matched_db_ids, match_distances, db_to_data):
     results = []
-    db_to_data = {c["id"]: c for c in colognes_data}
-    
     for db_id, dist in zip(matched_db_ids, match_distances):
         col = db_to_data.get(db_id)
         if col:
@@ -98,29 +236,124 @@ def recommend_similar(cologne_id: int, top_k: int = 5, gender: str = "All"):
             
     return results
 
+@app.get("/colognes")
+def list_colognes(limit: int = 50):
+    cursor = get_read_connection().cursor()
+    cursor.execute("SELECT id, name, brand FROM colognes LIMIT ?", (limit,))
+    return [{"id": r[0], "name": r[1], "brand": r[2]} for r in cursor.fetchall()]
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
+
+@app.get("/ready")
+def ready():
+    if not startup["ready"]:
+        return JSONResponse(status_code=503, content=startup)
+    return startup
+
+@app.get("/stats")
+def stats():
+    return {
+        "embedding_cache": get_embedding_cache().stats(),
+        "pending_requests": _pending_requests,
+        "max_pending_requests": MAX_PENDING_REQUESTS,
+        "inference_workers": INFERENCE_WORKERS,
+        "catalog": catalog.memory_report(),
+        "startup": startup
+    }
+
+@app.get("/recommend/similar/{cologne_id}")
+async def recommend_similar(cologne_id: int, top_k: int = Query(5, ge=1, le=MAX_TOP_K), gender: str = "All", min_popularity: float = 0.0,
+                            include_notes: List[str] = Query([]), exclude_notes: List[str] = Query([]),
+                            popularity_weight: Optional[float] = None, review_weight: Optional[float] = None,
+                            diversity: float = 0.0, max_per_brand: int = 0):
+    check_diversity(diversity, max_per_brand)
+    check_note_filters(include_notes, exclude_notes)
+    matched_db_ids, match_distances = await run_inference(
+        search_similar, cologne_id, top_k, gender, min_popularity,
+        include_notes=include_notes, exclude_notes=exclude_notes,
+        popularity_weight=popularity_weight, review_weight=review_weight,
+        diversity=diversity, max_per_brand=max_per_brand
+    )
+    if matched_db_ids is None:
+        raise HTTPException(status_code=404, detail="Cologne ID not found in embedding index")
+    if not matched_db_ids:
+        return []
+        
+    colognes_data = get_cologne_details(matched_db_ids)
+    return build_results(matched_db_ids, match_distances, {c["id"]: c for c in colognes_data})
+
+@app.post("/recommend/similar")
+async def recommend_similar_to_many(request: MultiSeedRequest):
+    if not request.liked_ids:
+        raise HTTPException(status_code=400, detail="liked_ids must contain at least one cologne id")
+    if request.method not in ("centroid", "rrf"):
+        raise HTTPException(status_code=400, detail="method must be 'centroid' or 'rrf'")
+    check_diversity(request.diversity, request.max_per_brand)
+    check_note_filters(request.include_notes, request.exclude_notes)
+    
+    matched_db_ids, match_distances = await run_inference(
+        search_multi_seed, request.liked_ids, request.disliked_ids, request.top_k,
+        request.gender, request.min_popularity, request.method,
+        include_notes=request.include_notes, exclude_notes=request.exclude_notes,
+        popularity_weight=request.popularity_weight, review_weight=request.review_weight,
+        diversity=request.diversity, max_per_brand=request.max_per_brand
+    )
+    if matched_db_ids is None:
+        raise HTTPException(status_code=404, detail="None of the liked cologne IDs are in the embedding index")
+    if not matched_db_ids:
+        return []
+    
+    colognes_data = get_cologne_details(matched_db_ids)
+    return build_results(matched_db_ids, match_distances, {c["id"]: c for c in colognes_data})
+
 @app.post("/recommend/quiz")
-def recommend_quiz(request: QuizRequest):
-    # Format the query to seamlessly match the structure of the document vectors to eliminate hubness
-    gender_phrase = f"{request.gender.lower()} " if request.gender != "All" else ""
-    text_query = f"Name: Ideal {request.gender if request.gender != 'All' else ''} Fragrance. Brand: Any. Notes: {request.preferences}. Reviews: I love this {gender_phrase}fragrance because it is {request.preferences}."
-    matched_db_ids, match_distances = search_raw_text(text_query, request.top_k, request.gender)
+async def recommend_quiz(request: QuizRequest):
+    check_diversity(request.diversity, request.max_per_brand)
+    check_note_filters(request.include_notes, request.exclude_notes)
+    text_query = build_quiz_query(request.preferences, request.gender)
+    matched_db_ids, match_distances = await run_inference(
+        search_raw_text, text_query, request.top_k, request.gender, request.min_popularity, request.preferences,
+        include_notes=request.include_notes, exclude_notes=request.exclude_notes,
+        popularity_weight=request.popularity_weight, review_weight=request.review_weight,
+        diversity=request.diversity, max_per_brand=request.max_per_brand
+    )
     
     if not matched_db_ids:
         return []
         
     colognes_data = get_cologne_details(matched_db_ids)
+    return build_results(matched_db_ids, match_distances, {c["id"]: c for c in colognes_data})
+
+def _run_batch(request: BatchRequest):
+    text_queries = [build_quiz_query(p, request.gender) for p in request.preferences]
+    # The raw preferences are the lexical queries, as on /recommend/quiz
+    quiz_matches = search_raw_text_many(text_queries, request.top_k, request.gender, request.min_popularity, request.preferences)
+    similar_matches = search_similar_many(request.cologne_ids, request.top_k, request.gender, request.min_popularity) if request.cologne_ids else []
+    return quiz_matches, similar_matches
+
+@app.post("/recommend/batch")
+async def recommend_batch(request: BatchRequest):
+    if len(request.preferences) + len(request.cologne_ids) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=413, detail=f"Batch is limited to {MAX_BATCH_QUERIES} queries")
     
-    results = []
-    db_to_data = {c["id"]: c for c in colognes_data}
+    quiz_matches, similar_matches = await run_inference(_run_batch, request)
     
-    for db_id, dist in zip(matched_db_ids, match_distances):
-        col = db_to_data.get(db_id)
-        if col:
-            # Cosine similarity ranges from -1 to 1. Map this to 0-100%
-            match_pct = min(100, max(0, round(((dist + 1.0) / 2.0) * 100)))
-            results.append({"cologne": col, "match": match_pct})
-            
-    return results
+    # Hydrate the union of every result id in one pass
+    all_ids = list({db_id for ids, _ in quiz_matches + similar_matches for db_id in ids})
+    db_to_data = {c["id"]: c for c in get_cologne_details(all_ids)}
+    
+    return {
+        "quiz": [
+            {"preferences": p, "results": build_results(ids, dists, db_to_data)}
+            for p, (ids, dists) in zip(request.preferences, quiz_matches)
+        ],
+        "similar": [
+            {"cologne_id": cid, "results": build_results(ids, dists, db_to_data)}
+            for cid, (ids, dists) in zip(request.cologne_ids, similar_matches)
+        ]
+    }
 
 if __name__ == "__main__":
     import uvicorn
@@ -2,17 +2,35 @@ import asyncio
 import json
 import random
 import os
+import time
+from urllib.parse import urlparse
 from bs4 import BeautifulSoup
-import nodriver as uc
 import database
+import page_cache
+from page_parser import parse_details_html
 import sys
 
+# nodriver is imported where a browser gets started: the crawl scheduler
+# itself only needs an object with nodriver's browser/tab methods
+
+# Point at a local fixture server to exercise the crawler without touching basenotes.com
+BASE_URL = os.environ.get("BASENOTES_BASE_URL", "https://basenotes.com").rstrip("/")
+URLS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'basenotes_urls.json')
+# Detail pages are fetched by this many browser tabs at once
+CRAWL_TABS = int(os.environ.get("CRAWL_TABS", "4"))
+# Shared by all tabs: each host gets a request at most every this many seconds (jittered up to 1.5x)
+HOST_MIN_INTERVAL = float(os.environ.get("CRAWL_HOST_MIN_INTERVAL", "1.5"))
+CRAWL_MAX_ATTEMPTS = int(os.environ.get("CRAWL_MAX_ATTEMPTS", "3"))
+# First retry waits this long, doubling with each further attempt
+CRAWL_RETRY_BACKOFF = float(os.environ.get("CRAWL_RETRY_BACKOFF", "60"))
+# A tab is closed and reopened after this many pages to keep its memory in check
+TAB_RECYCLE_EVERY = 20
+PAGE_TIMEOUT = 30.0
 
 
 async def scrape_directory_pages(start_page=1, end_page=100):
     urls = []
-    
-    urls_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'basenotes_urls.json')
+    urls_path = URLS_PATH
 
     if os.path.exists(urls_path):
         with open(urls_path, "r") as f:
@@ -20,12 +38,13 @@ async def scrape_directory_pages(start_page=1, end_page=100):
             
     print(f"found {len(urls)} urls to start with")
             
+    import nodriver as uc
     browser = await uc.start(headless=False)
     page = await browser.get('about:blank')
     
     try:
         for i in range(start_page, end_page + 1):
-            url = f"https://basenotes.com/directory/?search=&type=all&page={i}"
+            url = f"{BASE_URL}/directory/?search=&type=all&page={i}"
             print(f"grabbing details from page {i}")
             
             await page.get(url)
@@ -42,7 +61,7 @@ async def scrape_directory_pages(start_page=1, end_page=100):
                 href = card.get('href')
                 if href and href.startswith('/fragrances/'):
                     has_fragrance_cards = True
-                    full_link = 'https://basenotes.com' + href
+                    full_link = BASE_URL + href
                     if full_link not in urls:
                         page_links.append(full_link)
             
@@ -73,150 +92,214 @@ async def scrape_directory_pages(start_page=1, end_page=100):
         
     return urls
 
-async def scrape_cologne_details(page, url):
+async def scrape_cologne_details(page, url, limiter=None):
+    # Served from the page cache when a recent copy parses to a fragrance;
+    # otherwise fetched (after the rate limiter, if given) and cached before
+    # parsing, so parser fixes can be applied later with `python page_cache.py reparse`
     data = {"url": url, "brand": "Unknown", "name": "Unknown", "notes": [], "gender": "Unisex", "reviews": {"positive": 0, "neutral": 0, "negative": 0, "texts": []}}
     
     try:
-        await page.get(url)
+        cached = page_cache.cached_record(url)
+        if cached is not None:
+            return cached
+        if limiter:
+            await limiter.wait(url)
+        await asyncio.wait_for(page.get(url), timeout=PAGE_TIMEOUT)
         await page.sleep(random.uniform(3, 6))
-        
         html = await page.get_content()
-        soup = BeautifulSoup(html, 'html.parser')
+        page_cache.store_page(url, html)
+        data = parse_details_html(html, url)
+        
+    except Exception as e:
+        print(f"couldn't grab {url}: {e}")
         
+    return data
 
-        name_elem = soup.find('span', class_='h1_fragname')
-        if name_elem:
-            data['name'] = name_elem.text.strip()
-            
+class HostRateLimiter:
+    # Spaces out requests to each host across every tab: a tab waits its turn
+    # under the host's lock, then pushes the host's next slot out by a
+    # jittered interval
 
-        gender_icon = soup.find('i', class_='fa-genderless')
-        if gender_icon:
-            data['gender'] = 'Unisex'
-        elif soup.find('i', class_='fa-mars'):
-             data['gender'] = 'Male'
-        elif soup.find('i', class_='fa-venus'):
-             data['gender'] = 'Female'
-             
-
-        brand_elem = soup.find('span', class_='h1_house')
-        if brand_elem:
-            data['brand'] = brand_elem.text.strip()
-            
+    def __init__(self, min_interval=HOST_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._locks = {}
+        self._next_slot = {}
 
-        notes_container = soup.find('ul', class_='fragrancenotes')
-        if notes_container:
-            inner_uls = notes_container.find_all('ul')
-            if inner_uls:
-                for ul in inner_uls:
-                    for li in ul.find_all('li'):
-                        text = li.text.strip()
-                        items = [x.strip() for x in text.split(',')]
-                        data['notes'].extend(items)
-            else:
-                for li in notes_container.find_all('li'):
-                    text = li.text.strip()
-                    items = [x.strip() for x in text.split(',')]
-                    data['notes'].extend(items)
-                    
+    async def wait(self, url):
+        host = urlparse(url).netloc
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            delay = self._next_slot.get(host, 0.0) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_slot[host] = time.monotonic() + self.min_interval * random.uniform(1.0, 1.5)
 
-        data['notes'] = [n for n in data['notes'] if n]
-        
 
-        pos_reviews, neu_reviews, neg_reviews = 0, 0, 0
-        review_links = soup.find_all('a')
-        for link in review_links:
-            href = link.get('href', '')
-            text_parts = link.text.strip().split()
-            if not text_parts:
-                continue
-                
-            if 'reviews/positive/' in href and "Positive" in link.text:
-                if text_parts[0].isdigit(): pos_reviews = int(text_parts[0])
-            elif 'reviews/neutral/' in href and "Neutral" in link.text:
-                if text_parts[0].isdigit(): neu_reviews = int(text_parts[0])
-            elif 'reviews/negative/' in href and "Negative" in link.text:
-                if text_parts[0].isdigit(): neg_reviews = int(text_parts[0])
-                
-        review_texts = []
-        for div in soup.find_all('div', class_='fragreview'):
-            text = div.get_text(separator=' ', strip=True)
-            if text:
-                review_texts.append(text)
-                
-        data['reviews'] = {"positive": pos_reviews, "neutral": neu_reviews, "negative": neg_reviews, "texts": review_texts[:3]}
-        
+class CrawlMetrics:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.done = 0
+        self.failed = 0
+        self.page_seconds = 0.0
+
+    def record(self, ok, seconds):
+        if ok:
+            self.done += 1
+        else:
+            self.failed += 1
+        self.page_seconds += seconds
+
+    def report(self, remaining):
+        elapsed = time.monotonic() - self.started
+        pages = self.done + self.failed
+        rate = pages / elapsed * 60 if elapsed else 0.0
+        avg = self.page_seconds / pages if pages else 0.0
+        eta = f", ~{remaining / rate:.0f} min to go" if rate and remaining else ""
+        print(f"{self.done} saved, {self.failed} failed in {elapsed:.0f}s: {rate:.1f} pages/min, {avg:.1f}s per page, {remaining} queued{eta}")
+
+
+def _record_failure(url, error, max_attempts, backoff):
+    try:
+        return database.mark_crawl_failed(url, error, max_attempts, backoff)
     except Exception as e:
-        print(f"couldn't grab {url}: {e}")
+        print(f"couldn't record the failure of {url}: {e}")
+        return None
+
+
+async def crawl_worker(browser, queue, limiter, metrics, max_attempts, backoff):
+    # Never lets an error end the task: one that happens while opening the
+    # tab, crawling a url or saving it counts as a failed attempt at that url,
+    # and the worker moves on to the next one
+    page = None
+    handled = 0
+    while True:
+        url = await queue.get()
+        started = time.monotonic()
+        ok = False
+        try:
+            if page is None:
+                page = await browser.get('about:blank', new_tab=True)
+            data = await scrape_cologne_details(page, url, limiter)
+            if data and data.get("name") != "Unknown":
+                # Unlike save_cologne_data this raises, so a failed write is retried
+                database.save_cologne_batch([data])
+                database.mark_crawl_done(url)
+                ok = True
+                print(f"saved {data['name']} by {data['brand']}")
+            else:
+                status = _record_failure(url, "no fragrance data on page", max_attempts, backoff)
+                print(f"got bad data from {url} ({'giving up' if status == 'failed' else 'will retry'})")
+        except Exception as e:
+            _record_failure(url, e, max_attempts, backoff)
+            print(f"couldn't crawl {url}: {e}")
+        finally:
+            metrics.record(ok, time.monotonic() - started)
+            queue.task_done()
         
-    return data
+        handled += 1
+        if (metrics.done + metrics.failed) % 10 == 0:
+            metrics.report(queue.qsize())
+        if page is not None and handled % TAB_RECYCLE_EVERY == 0:
+            try:
+                fresh = await browser.get('about:blank', new_tab=True)
+                page, stale = fresh, page
+                await stale.close()
+            except Exception as e:
+                print(f"couldn't recycle tab: {e}")
+
+
+async def _drain(queue, workers):
+    # Waits for the queue to empty. Workers don't normally exit, but if every
+    # one of them has, nothing would ever empty it, so stop waiting then too.
+    joined = asyncio.ensure_future(queue.join())
+    pending = {joined, *workers}
+    while not joined.done() and not all(worker.done() for worker in workers):
+        _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    if not joined.done():
+        joined.cancel()
+        errors = {str(worker.exception()) for worker in workers if not worker.cancelled() and worker.exception()}
+        raise RuntimeError(f"every crawl worker stopped: {', '.join(sorted(errors)) or 'no error'}")
+
+
+async def crawl_pending(browser, tabs=CRAWL_TABS, max_attempts=CRAWL_MAX_ATTEMPTS, backoff=CRAWL_RETRY_BACKOFF,
+                        min_interval=HOST_MIN_INTERVAL):
+    # Crawls every pending url in crawl_state with `tabs` tabs of browser.
+    # Retries come back round once their backoff expires; returns the run's
+    # metrics once nothing is left pending.
+    queue = asyncio.Queue()
+    limiter = HostRateLimiter(min_interval)
+    metrics = CrawlMetrics()
+    workers = [
+        asyncio.create_task(crawl_worker(browser, queue, limiter, metrics, max_attempts, backoff))
+        for _ in range(tabs)
+    ]
+    try:
+        while True:
+            due = database.get_due_urls()
+            if not due:
+                next_at = database.next_crawl_retry_at()
+                if next_at is None:
+                    break
+                wait = max(1.0, next_at - time.time())
+                print(f"waiting {wait:.0f}s for retries to come due...")
+                await asyncio.sleep(wait)
+                continue
+            
+            print(f"{len(due)} left to do with {tabs} tabs")
+            for url in due:
+                queue.put_nowait(url)
+            await _drain(queue, workers)
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    return metrics
 
-async def run_details_scraper(chunk_size=20):
+
+async def run_details_scraper(tabs=CRAWL_TABS, max_attempts=CRAWL_MAX_ATTEMPTS, backoff=CRAWL_RETRY_BACKOFF, retry_failed=False):
+    # Resumable: progress lives in the crawl_state table, so rerunning picks up
+    # whatever is still pending
     database.init_db()
     
-    urls_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'basenotes_urls.json')
-    if not os.path.exists(urls_path):
+    if not os.path.exists(URLS_PATH):
         print("missing urls file, grab the directory first")
         return
         
-    with open(urls_path, "r") as f:
+    with open(URLS_PATH, "r") as f:
         urls = json.load(f)
-        
-
-    pending_urls = [u for u in urls if not database.get_cologne_by_url(u)]
-    print(f"{len(pending_urls)} left to do")
     
-    for i in range(0, len(pending_urls), chunk_size):
-        chunk = pending_urls[i:i+chunk_size]
-        print(f"batch {(i//chunk_size) + 1}")
-        
-        browser = None
-        try:
-            browser = await uc.start(headless=False)
-            page = await browser.get('about:blank')
-            
-            for url in chunk:
-                if database.get_cologne_by_url(url):
-                    continue
-                    
-                print(f"checking {url}")
-                data = await scrape_cologne_details(page, url)
-                
-                if data and data.get("name") != "Unknown":
-
-                    database.save_cologne_data(
-                        name=data['name'],
-                        brand=data['brand'],
-                        url=data['url'],
-                        notes_list=data['notes'],
-                        gender=data['gender'],
-                        pos_reviews=data['reviews']['positive'],
-                        neu_reviews=data['reviews']['neutral'],
-                        neg_reviews=data['reviews']['negative'],
-                        review_texts=data['reviews']['texts']
-                    )
-                    print(f"saved {data['name']} by {data['brand']}")
-                else:
-                    print(f"got bad data from {url}")
-                    
-        except Exception as e:
-            print(f"batch error: {e}")
-        finally:
-            if browser:
-                try:
-                    browser.stop()
-                except Exception:
-                    pass
-                    
-        print("cooling down...")
-        await asyncio.sleep(10)
+    database.seed_crawl_state(urls)
+    if retry_failed:
+        print(f"retrying {database.reset_failed_crawls()} previously failed urls")
+    print(f"crawl state: {database.crawl_state_counts()}")
+    
+    import nodriver as uc
+    browser = None
+    metrics = None
+    try:
+        browser = await uc.start(headless=False)
+        metrics = await crawl_pending(browser, tabs, max_attempts, backoff)
+    except Exception as e:
+        print(f"crawl error: {e}")
+    finally:
+        if browser:
+            try:
+                browser.stop()
+            except Exception:
+                pass
+    
+    if metrics:
+        metrics.report(0)
+    print(f"crawl state: {database.crawl_state_counts()}")
 
 if __name__ == "__main__":
+    import nodriver as uc
 
     if len(sys.argv) > 1 and sys.argv[1] == "dir":
         print("Starting directory scraper...")
         uc.loop().run_until_complete(scrape_directory_pages(start_page=1, end_page=100))
     elif len(sys.argv) > 1 and sys.argv[1] == "details":
         print("Starting details scraper...")
-        uc.loop().run_until_complete(run_details_scraper())
+        uc.loop().run_until_complete(run_details_scraper(retry_failed="--retry-failed" in sys.argv))
     else:
         print("Please specify 'dir' or 'details'. Example: python basenotes_crawler.py dir")
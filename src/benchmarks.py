@@ -0,0 +1,324 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import chromadb
+import numpy as np
+
+from ml_pipeline import (
+    CHROMA_DB_PATH, NUMPY_INDEX_PATH, BatchingEncoder, get_model,
+    iter_colognes_from_db, build_document, start_encode_pool, stop_encode_pool, encode_documents,
+    load_encoder, search_many, get_reranker, RERANK_POOL_SIZE
+)
+import database
+from reranker import mmr_select
+from numpy_index import NumpyIndex, ChunkedIndex, QUANTIZATIONS, gender_where, save_index
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def _latency_summary(timings):
+    timings = np.asarray(timings)
+    return f"p50 {np.percentile(timings, 50):.3f} ms, p95 {np.percentile(timings, 95):.3f} ms"
+
+
+def bench_search_backends(n_queries=200, top_k=10):
+    # Recall of Chroma's HNSW against exact numpy search, plus latency of both
+    numpy_index = NumpyIndex(NUMPY_INDEX_PATH)
+    chroma = chromadb.PersistentClient(path=CHROMA_DB_PATH).get_collection(name="colognes")
+
+    sample_ids = random.sample(numpy_index.ids, min(n_queries, numpy_index.count()))
+    queries = numpy_index.get(sample_ids)["embeddings"]
+
+    recalls = []
+    numpy_times = []
+    chroma_times = []
+    for q in queries:
+        exact, t_np = _timed(numpy_index.query, [q], n_results=top_k)
+        approx, t_ch = _timed(chroma.query, query_embeddings=[q.tolist()], n_results=top_k)
+        numpy_times.append(t_np)
+        chroma_times.append(t_ch)
+        recalls.append(len(set(exact["ids"][0]) & set(approx["ids"][0])) / top_k)
+
+    print(f"{len(queries)} queries, top_k={top_k}")
+    print(f"numpy  {_latency_summary(numpy_times)}")
+    print(f"chroma {_latency_summary(chroma_times)}")
+    print(f"chroma recall@{top_k} vs exact: {np.mean(recalls):.4f}")
+
+
+def bench_quantized(n_queries=200, top_k=10, rescore_factor=4):
+    # recall@k and latency of NumpyIndex.query on float16/int8 copies of the snapshot against
+    # the exact float32 index, unfiltered, on a gender partition and under a note-style row mask
+    exact_index = NumpyIndex(NUMPY_INDEX_PATH, use_quantized=False)
+    embeddings = exact_index.embeddings
+    rows = random.sample(range(exact_index.count()), min(n_queries, exact_index.count()))
+    # Perturbed catalog vectors, so queries aren't exact copies of an indexed row
+    queries = np.asarray(embeddings[rows]) + np.random.normal(0, 0.02, (len(rows), embeddings.shape[1])).astype(np.float32)
+    cases = {
+        "all": {},
+        "male": {"where": gender_where("Male")},
+        "masked": {"row_mask": np.random.random(exact_index.count()) < 0.5},
+    }
+
+    def run(index, filters):
+        results, timings = [], []
+        for q in queries:
+            found, elapsed = _timed(index.query, [q], n_results=top_k, **filters)
+            results.append(found["ids"][0])
+            timings.append(elapsed)
+        return results, timings
+
+    exact = {}
+    print(f"{len(queries)} queries, top_k={top_k}, rescore x{rescore_factor}")
+    print(f"float32   {embeddings.nbytes / 1e6:7.2f} MB")
+    for case, filters in cases.items():
+        exact[case], timings = run(exact_index, filters)
+        print(f"  {case:<7} {_latency_summary(timings)}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for quantization in QUANTIZATIONS:
+            path = os.path.join(tmp, quantization)
+            save_index(path, exact_index.ids, embeddings, exact_index.metadatas, quantization=quantization)
+            index = NumpyIndex(path, use_quantized=True, rescore_factor=rescore_factor)
+            print(f"{quantization:<8}  {index.quantized.nbytes / 1e6:7.2f} MB")
+            for case, filters in cases.items():
+                found, timings = run(index, filters)
+                recall = np.mean([len(set(a) & set(b)) / max(len(a), 1) for a, b in zip(exact[case], found)])
+                print(f"  {case:<7} {_latency_summary(timings)}, recall@{top_k} {recall:.4f}")
+            del index
+
+
+def bench_rerank(n_queries=200, top_k=10, pool_size=RERANK_POOL_SIZE, weights=(0.05, 0.05)):
+    # Latency of plain top-k retrieval versus retrieving a larger pool and re-ranking it
+    index = NumpyIndex(NUMPY_INDEX_PATH)
+    reranker = get_reranker()
+    sample_ids = random.sample(index.ids, min(n_queries, index.count()))
+    queries = index.get(sample_ids)["embeddings"]
+
+    plain_times = []
+    retrieve_times = []
+    rerank_times = []
+    changed = 0
+    for q in queries:
+        (plain,), t_plain = _timed(search_many, [q], top_k)
+        (pooled,), t_retrieve = _timed(search_many, [q], pool_size)
+        reranked, t_rerank = _timed(reranker.rerank, pooled[0], pooled[1], top_k, *weights)
+        plain_times.append(t_plain)
+        retrieve_times.append(t_retrieve)
+        rerank_times.append(t_rerank)
+        changed += reranked[0] != plain[0]
+
+    print(f"{len(queries)} queries, top_k={top_k}, pool={pool_size}, weights={weights}")
+    print(f"top-k only        {_latency_summary(plain_times)}")
+    print(f"pool retrieval    {_latency_summary(retrieve_times)}")
+    print(f"re-rank pass      {_latency_summary(rerank_times)}")
+    print(f"re-ranking changed the top-{top_k} of {changed / len(queries):.1%} of queries")
+
+
+def bench_diversify(n_queries=200, top_k=10, pool_size=200, diversity=0.3, max_per_brand=2):
+    # Cost of MMR / brand-cap selection of top_k from a retrieved pool, on top of the retrieval itself
+    index = NumpyIndex(NUMPY_INDEX_PATH)
+    pool_size = min(pool_size, index.count())
+    sample_ids = random.sample(index.ids, min(n_queries, index.count()))
+    queries = index.get(sample_ids)["embeddings"]
+
+    retrieve_times = []
+    select_times = []
+    brands_before = []
+    brands_after = []
+    for q in queries:
+        results, t_retrieve = _timed(index.query, [q], n_results=pool_size)
+        found = index.get(results["ids"][0])
+        relevance = 1.0 - np.asarray(results["distances"][0])
+        brands = [m.get("brand") for m in found["metadatas"]]
+        picks, t_select = _timed(mmr_select, relevance, found["embeddings"], top_k, diversity, brands, max_per_brand)
+        retrieve_times.append(t_retrieve)
+        select_times.append(t_select)
+        brands_before.append(len(set(brands[:top_k])))
+        brands_after.append(len({brands[p] for p in picks}))
+
+    print(f"{len(queries)} queries, top_k={top_k} from {pool_size}, diversity={diversity}, max_per_brand={max_per_brand}")
+    print(f"pool retrieval    {_latency_summary(retrieve_times)}")
+    print(f"MMR selection     {_latency_summary(select_times)}")
+    print(f"distinct brands in top-{top_k}: {np.mean(brands_before):.2f} -> {np.mean(brands_after):.2f}")
+
+
+def bench_chunked(n_queries=200, top_k=10, top_m=3):
+    # Query latency of whole-document search versus chunked review search (max and top-m mean)
+    index = NumpyIndex(NUMPY_INDEX_PATH, use_quantized=False)
+    sample_ids = random.sample(index.ids, min(n_queries, index.count()))
+    queries = index.get(sample_ids)["embeddings"]
+    queries = queries + np.random.normal(0, 0.05, queries.shape).astype(np.float32)
+
+    print(f"{len(queries)} queries, top_k={top_k}")
+    timings = [_timed(index.query, [q], n_results=top_k)[1] for q in queries]
+    print(f"document     {index.count():>8} vectors  {_latency_summary(timings)}")
+    for aggregation in ("max", "mean"):
+        chunked = ChunkedIndex(NUMPY_INDEX_PATH, aggregation, top_m)
+        timings = [_timed(chunked.query, [q], n_results=top_k)[1] for q in queries]
+        label = aggregation if aggregation == "max" else f"top-{top_m} mean"
+        print(f"{label:<12} {chunked.chunk_count():>8} vectors  {_latency_summary(timings)}")
+
+
+def _synthetic_records(n, n_notes=800, notes_per_record=10):
+    vocabulary = [f"Note {i}" for i in range(n_notes)]
+    return [{
+        "name": f"Cologne {i}",
+        "brand": f"House {i % 500}",
+        "url": f"https://example.invalid/fragrances/{i}.html",
+        "gender": random.choice(["Male", "Female", "Unisex"]),
+        "notes": random.sample(vocabulary, notes_per_record),
+        "reviews": {"positive": random.randint(0, 200), "neutral": random.randint(0, 50),
+                    "negative": random.randint(0, 50), "texts": ["A warm, woody scent with a citrus opening."] * 3}
+    } for i in range(n)]
+
+
+def _save_per_record(data):
+    # The crawler's save before save_cologne_batch, kept here as the baseline: a
+    # connection and commit per record, and a SELECT after every INSERT
+    conn = sqlite3.connect(database.DB_PATH)
+    cursor = conn.cursor()
+    try:
+        reviews = data["reviews"]
+        cursor.execute('''
+        INSERT OR IGNORE INTO colognes (name, brand, url, gender, positive_reviews, neutral_reviews, negative_reviews, review_texts)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (data["name"], data["brand"], data["url"], data["gender"], reviews["positive"], reviews["neutral"],
+              reviews["negative"], json.dumps(reviews["texts"])))
+        cologne_id = cursor.execute("SELECT id FROM colognes WHERE url = ?", (data["url"],)).fetchone()[0]
+        for note in data["notes"]:
+            cursor.execute("INSERT OR IGNORE INTO notes (name) VALUES (?)", (note,))
+            note_id = cursor.execute("SELECT id FROM notes WHERE name = ?", (note,)).fetchone()[0]
+            cursor.execute("INSERT OR IGNORE INTO cologne_notes (cologne_id, note_id) VALUES (?, ?)", (cologne_id, note_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def bench_ingest(n_records=10000, batch_sizes=(100, 1000, 10000)):
+    # Inserts/sec of the previous one-record-per-call save versus
+    # save_cologne_batch, each into a fresh WAL database
+    records = _synthetic_records(n_records)
+    original_path = database.DB_PATH
+    try:
+        for label, batch_size in [("per record", None)] + [(f"batch {b}", b) for b in batch_sizes]:
+            with tempfile.TemporaryDirectory() as tmp:
+                database.DB_PATH = os.path.join(tmp, "bench.db")
+                database.init_db()
+                start = time.perf_counter()
+                if batch_size is None:
+                    for data in records:
+                        _save_per_record(data)
+                else:
+                    for offset in range(0, n_records, batch_size):
+                        database.save_cologne_batch(records[offset:offset + batch_size])
+                elapsed = time.perf_counter() - start
+                print(f"{label:<12} {n_records / elapsed:10.0f} records/s ({elapsed:.2f}s for {n_records})")
+    finally:
+        database.DB_PATH = original_path
+
+
+def _sample_queries(n):
+    notes = ["vetiver", "oud", "bergamot", "leather", "vanilla", "iris", "tobacco", "neroli", "amber", "lavender"]
+    moods = ["fresh", "dark", "sweet", "smoky", "clean", "powdery", "warm", "green"]
+    # Unique strings so nothing is deduplicated or cached between clients
+    return [f"{random.choice(moods)} {random.choice(notes)} and {random.choice(notes)} #{i}" for i in range(n)]
+
+
+def bench_encoder(clients=(1, 8, 64), queries_per_client=32):
+    # Throughput of per-request encode calls versus the coalescing BatchingEncoder
+    model = get_model()
+    batching = BatchingEncoder(model)
+    model.encode(["warm up"])
+
+    for n_clients in clients:
+        texts = _sample_queries(n_clients * queries_per_client)
+        for label, encode in [("direct", lambda t: model.encode([t])[0]), ("batched", batching.encode)]:
+            with ThreadPoolExecutor(max_workers=n_clients) as pool:
+                start = time.perf_counter()
+                list(pool.map(encode, texts))
+                elapsed = time.perf_counter() - start
+            print(f"{n_clients:>3} clients {label:<8} {len(texts) / elapsed:8.1f} queries/s")
+    print(f"batched encoder ran {batching.batches} forward passes for {batching.encoded} texts")
+
+
+def bench_build_encode(worker_counts=(2, 4, 8, 16), n_docs=2000):
+    # docs/sec for index-build encoding, single process versus worker pools
+    docs = []
+    for item in iter_colognes_from_db():
+        docs.append(build_document(item))
+        if len(docs) >= n_docs:
+            break
+
+    encode_documents(docs[:64])
+    start = time.perf_counter()
+    baseline = encode_documents(docs)
+    elapsed = time.perf_counter() - start
+    print(f"single process  {len(docs) / elapsed:8.1f} docs/s")
+
+    for workers in worker_counts:
+        pool = start_encode_pool(workers)
+        try:
+            encode_documents(docs[:64 * workers], pool)
+            start = time.perf_counter()
+            pooled = encode_documents(docs, pool)
+            elapsed = time.perf_counter() - start
+        finally:
+            stop_encode_pool(pool)
+        same_order = np.allclose(baseline, pooled, atol=1e-4)
+        print(f"{workers:>2} workers      {len(docs) / elapsed:8.1f} docs/s (matches single process: {same_order})")
+
+
+def bench_encoder_backends(backends=("onnx", "onnx-int8"), batch_sizes=(1, 8, 32, 64), rounds=20):
+    # Embedding parity against the PyTorch encoder plus latency/throughput per batch size
+    texts = _sample_queries(max(batch_sizes) * 4)
+    torch_model = load_encoder("torch")
+    reference = torch_model.encode(texts, normalize_embeddings=True)
+
+    for backend in ("torch",) + tuple(backends):
+        model = torch_model if backend == "torch" else load_encoder(backend)
+        embeddings = model.encode(texts, normalize_embeddings=True)
+        cosines = np.sum(embeddings * reference, axis=1)
+        verdict = "ok" if cosines.min() > 0.99 else "FAIL"
+        print(f"{backend:<10} cosine vs torch: min {cosines.min():.4f}, mean {cosines.mean():.4f} [{verdict}]")
+
+        for batch_size in batch_sizes:
+            batch = texts[:batch_size]
+            model.encode(batch)
+            timings = []
+            for _ in range(rounds):
+                _, elapsed = _timed(model.encode, batch, batch_size=batch_size)
+                timings.append(elapsed)
+            throughput = batch_size / (np.median(timings) / 1000)
+            print(f"{'':<10} batch {batch_size:>2}: {_latency_summary(timings)}, {throughput:8.1f} texts/s")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "search":
+        bench_search_backends()
+    elif len(sys.argv) > 1 and sys.argv[1] == "encoder":
+        bench_encoder()
+    elif len(sys.argv) > 1 and sys.argv[1] == "onnx":
+        bench_encoder_backends()
+    elif len(sys.argv) > 1 and sys.argv[1] == "quantized":
+        bench_quantized()
+    elif len(sys.argv) > 1 and sys.argv[1] == "build-encode":
+        bench_build_encode()
+    elif len(sys.argv) > 1 and sys.argv[1] == "rerank":
+        bench_rerank()
+    elif len(sys.argv) > 1 and sys.argv[1] == "diversify":
+        bench_diversify()
+    elif len(sys.argv) > 1 and sys.argv[1] == "chunked":
+        bench_chunked()
+    elif len(sys.argv) > 1 and sys.argv[1] == "ingest":
+        bench_ingest()
+    else:
+        print("Please specify a benchmark. Example: python benchmarks.py search")
@@ -0,0 +1,131 @@
+import os
+import sys
+import threading
+import time
+from contextlib import closing
+
+from database import DB_PATH, open_read_connection
+
+
+class CatalogStore:
+    # Every cologne's display fields held in parallel lists, indexed through
+    # id_to_row. Note names and genders are interned so each distinct string
+    # exists once no matter how many colognes share it.
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self.loaded_at = None
+        self.load_seconds = 0.0
+        self._signature = None
+        self._lock = threading.Lock()
+        self._set_columns({}, [], [], [], [], [], [])
+
+    def _set_columns(self, id_to_row, ids, names, brands, urls, genders, notes):
+        # Swapped in one assignment so readers never see a half-built catalog
+        self._columns = (id_to_row, ids, names, brands, urls, genders, notes)
+
+    def _file_signature(self):
+        signature = []
+        for path in (self.db_path, self.db_path + "-wal"):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stat = None
+            # Opening a reader creates an empty -wal file, which isn't a change
+            signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size) if stat and stat.st_size else None)
+        return tuple(signature)
+
+    def __len__(self):
+        return len(self._columns[1])
+
+    def load(self):
+        # A connection of its own, opened per load: a cached one would keep
+        # reading the old file after the database is replaced
+        with closing(open_read_connection(self.db_path)) as conn:
+            return self._load(conn)
+
+    def _load(self, conn):
+        start = time.perf_counter()
+        cursor = conn.cursor()
+        signature = self._file_signature()
+
+        id_to_row, ids, names, brands, urls, genders, notes = {}, [], [], [], [], [], []
+        cursor.execute("SELECT id, name, brand, url, gender FROM colognes ORDER BY id")
+        for cid, name, brand, url, gender in cursor:
+            id_to_row[cid] = len(ids)
+            ids.append(cid)
+            names.append(name)
+            brands.append(brand)
+            urls.append(url)
+            genders.append(sys.intern(gender) if gender else gender)
+            notes.append([])
+
+        cursor.execute('''
+        SELECT cn.cologne_id, n.name
+        FROM cologne_notes cn
+        JOIN notes n ON cn.note_id = n.id
+        ORDER BY cn.rowid
+        ''')
+        for cid, note in cursor:
+            row = id_to_row.get(cid)
+            if row is not None:
+                notes[row].append(sys.intern(note))
+        notes = [tuple(n) for n in notes]
+
+        with self._lock:
+            self._set_columns(id_to_row, ids, names, brands, urls, genders, notes)
+            self._signature = signature
+            self.loaded_at = time.time()
+            self.load_seconds = time.perf_counter() - start
+        return len(ids)
+
+    def reload_if_changed(self):
+        if self._file_signature() == self._signature:
+            return False
+        print("catalog database changed, reloading...")
+        self.load()
+        return True
+
+    def get_details(self, db_ids):
+        id_to_row, ids, names, brands, urls, genders, notes = self._columns
+        results = []
+        for db_id in db_ids:
+            row = id_to_row.get(db_id)
+            if row is None:
+                continue
+            results.append({
+                "id": ids[row],
+                "name": names[row],
+                "brand": brands[row],
+                "url": urls[row],
+                "gender": genders[row],
+                "notes": list(notes[row])
+            })
+        return results
+
+    def memory_report(self):
+        # Approximate: containers plus each distinct string counted once
+        id_to_row, ids, names, brands, urls, genders, notes = self._columns
+        seen = set()
+        total = sys.getsizeof(id_to_row)
+        for column in (ids, names, brands, urls, genders, notes):
+            total += sys.getsizeof(column)
+        for column in (ids, names, brands, urls, genders):
+            for value in column:
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    total += sys.getsizeof(value)
+        distinct_notes = set()
+        for note_tuple in notes:
+            total += sys.getsizeof(note_tuple)
+            for note in note_tuple:
+                if id(note) not in distinct_notes:
+                    distinct_notes.add(id(note))
+                    total += sys.getsizeof(note)
+        return {
+            "colognes": len(ids),
+            "distinct_notes": len(distinct_notes),
+            "approx_bytes": total,
+            "loaded_at": self.loaded_at,
+            "load_seconds": round(self.load_seconds, 4)
+        }
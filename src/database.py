@@ -1,14 +1,55 @@
 import sqlite3
 import os
 import json
+import random
+import threading
+import time
+from urllib.parse import quote
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DB_PATH = os.path.join(BASE_DIR, "data", "colognes_basenotes.db")
 
+READ_MMAP_SIZE = 256 * 1024 * 1024
+READ_CACHE_KIB = 64 * 1024
+
+_read_local = threading.local()
+
+def open_read_connection(path=None):
+    conn = sqlite3.connect(f"file:{quote(path or DB_PATH)}?mode=ro", uri=True)
+    conn.execute(f"PRAGMA mmap_size = {READ_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{READ_CACHE_KIB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+def _file_identity(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return (path, None, None)
+    return (path, stat.st_dev, stat.st_ino)
+
+def get_read_connection():
+    # One read-only connection per thread, reused across calls. WAL (set by
+    # init_db) lets these read while the crawler is writing. An open
+    # connection keeps reading the file it opened, so once the database is
+    # replaced (a new inode at DB_PATH) it is closed and reopened.
+    identity = _file_identity(DB_PATH)
+    conn = getattr(_read_local, "conn", None)
+    if conn is not None and getattr(_read_local, "identity", None) != identity:
+        conn.close()
+        conn = None
+    if conn is None:
+        conn = open_read_connection()
+        _read_local.conn = conn
+        _read_local.identity = identity
+    return conn
+
 def init_db():
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     
+    # Persistent for the file, so readers opened with mode=ro get WAL too
+    cursor.execute("PRAGMA journal_mode=WAL")
 
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS colognes (
@@ -43,56 +84,258 @@ def init_db():
     )
     ''')
     
+    # Lookups by cologne_id and notes.name are already served by the indexes
+    # SQLite builds for the UNIQUE constraints above. Note-first lookups
+    # (every cologne with a given note) are not, so index that direction.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cologne_notes_note_id ON cologne_notes (note_id, cologne_id)")
+    
+    # Crawl progress per detail page, so an interrupted crawl resumes where it
+    # stopped. status is pending (including retries waiting out a backoff),
+    # done, or failed once a url has used up its attempts.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS crawl_state (
+        url TEXT PRIMARY KEY,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        next_attempt_at REAL DEFAULT 0,
+        last_error TEXT,
+        updated_at REAL
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_crawl_state_due ON crawl_state (status, next_attempt_at)")
+    
+    # One row per fetch of a page; the HTML itself lives gzipped in the page
+    # cache directory under its sha256, so identical fetches share one file
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS page_fetches (
+        url TEXT NOT NULL,
+        fetched_at REAL NOT NULL,
+        sha256 TEXT NOT NULL,
+        PRIMARY KEY (url, fetched_at)
+    )
+    ''')
+    
     conn.commit()
     conn.close()
     print("database ready")
 
 def get_cologne_by_url(url: str):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    cursor = get_read_connection().cursor()
     cursor.execute("SELECT id, name, brand FROM colognes WHERE url = ?", (url,))
     result = cursor.fetchone()
-    conn.close()
     if result:
         return {"id": result[0], "name": result[1], "brand": result[2], "url": url}
     return None
 
-def save_cologne_data(name, brand, url, notes_list, gender="Unisex", pos_reviews=0, neu_reviews=0, neg_reviews=0, review_texts=None):
-    if review_texts is None:
-        review_texts = []
-        
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    try:
+# Bound parameters per IN (...) lookup, under SQLite's default variable limit
+_LOOKUP_CHUNK = 500
 
-        cursor.execute('''
-        INSERT OR IGNORE INTO colognes (name, brand, url, gender, positive_reviews, neutral_reviews, negative_reviews, review_texts) 
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (name, brand, url, gender, pos_reviews, neu_reviews, neg_reviews, json.dumps(review_texts)))
-        
+# notes.name -> id, shared by every batch written to DB_PATH. Notes are never
+# deleted, so an entry stays valid once its transaction has committed.
+_note_ids = {}
+_note_ids_path = None
 
-        cursor.execute("SELECT id FROM colognes WHERE url = ?", (url,))
-        result = cursor.fetchone()
-        if not result:
-             return
-        cologne_id = result[0]
-        for note in notes_list:
+def _lookup_ids(cursor, table, column, values):
+    found = {}
+    values = list(values)
+    for start in range(0, len(values), _LOOKUP_CHUNK):
+        chunk = values[start:start + _LOOKUP_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        found.update((value, row_id) for row_id, value in cursor.execute(
+            f"SELECT id, {column} FROM {table} WHERE {column} IN ({placeholders})", chunk
+        ))
+    return found
 
-            cursor.execute("INSERT OR IGNORE INTO notes (name) VALUES (?)", (note,))
-            
+def _resolve_note_ids(cursor, names):
+    # Ids for every note name, inserting unknown ones. New ids are returned
+    # separately and only enter the shared cache once the caller commits.
+    global _note_ids, _note_ids_path
+    if _note_ids_path != DB_PATH:
+        _note_ids, _note_ids_path = {}, DB_PATH
+    missing = [name for name in dict.fromkeys(names) if name not in _note_ids]
+    if not missing:
+        return _note_ids, {}
+    cursor.executemany("INSERT OR IGNORE INTO notes (name) VALUES (?)", [(name,) for name in missing])
+    new_ids = _lookup_ids(cursor, "notes", "name", missing)
+    return {**_note_ids, **new_ids}, new_ids
 
-            cursor.execute("SELECT id FROM notes WHERE name = ?", (note,))
-            res = cursor.fetchone()
-            if res:
-                note_id = res[0]
+def _write_notes(cursor, notes_by_cologne, replace=False):
+    note_ids, new_ids = _resolve_note_ids(cursor, [n for notes in notes_by_cologne.values() for n in notes])
+    if replace:
+        cursor.executemany("DELETE FROM cologne_notes WHERE cologne_id = ?", [(cid,) for cid in notes_by_cologne])
+    cursor.executemany(
+        "INSERT OR IGNORE INTO cologne_notes (cologne_id, note_id) VALUES (?, ?)",
+        [(cid, note_ids[note]) for cid, notes in notes_by_cologne.items() for note in notes]
+    )
+    return new_ids
 
-                cursor.execute("INSERT OR IGNORE INTO cologne_notes (cologne_id, note_id) VALUES (?, ?)", (cologne_id, note_id))
+def _open_batch_connection():
+    conn = sqlite3.connect(DB_PATH)
+    # Safe under WAL: a crash can lose the last commits but never corrupts the file
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+def save_cologne_batch(records, replace=False):
+    # Writes a batch of scraped records (parse_details_html dicts) in one
+    # transaction: colognes via executemany, ids fetched back with one IN
+    # query per 500 urls, note ids from the shared name cache. By default an
+    # existing url keeps its row and only gains new notes, like a re-crawl
+    # always has; replace=True overwrites its fields and notes (keeping its id).
+    if not records:
+        return 0
+    rows = [(
+        data['name'], data['brand'], data['url'], data.get('gender', 'Unisex'),
+        data['reviews']['positive'], data['reviews']['neutral'], data['reviews']['negative'],
+        json.dumps(data['reviews']['texts'])
+    ) for data in records]
+    
+    conn = _open_batch_connection()
+    cursor = conn.cursor()
+    try:
+        if replace:
+            cursor.executemany('''
+            INSERT INTO colognes (name, brand, url, gender, positive_reviews, neutral_reviews, negative_reviews, review_texts)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(url) DO UPDATE SET
+                name = excluded.name, brand = excluded.brand, gender = excluded.gender,
+                positive_reviews = excluded.positive_reviews, neutral_reviews = excluded.neutral_reviews,
+                negative_reviews = excluded.negative_reviews, review_texts = excluded.review_texts
+            ''', rows)
+        else:
+            cursor.executemany('''
+            INSERT OR IGNORE INTO colognes (name, brand, url, gender, positive_reviews, neutral_reviews, negative_reviews, review_texts)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
         
+        cologne_ids = _lookup_ids(cursor, "colognes", "url", [data['url'] for data in records])
+        notes_by_cologne = {}
+        for data in records:
+            # A row OR IGNORE dropped (e.g. a NULL name) has no id; skip it rather than fail the batch
+            if data['url'] in cologne_ids:
+                notes_by_cologne.setdefault(cologne_ids[data['url']], []).extend(data['notes'])
+        new_note_ids = _write_notes(cursor, notes_by_cologne, replace)
         conn.commit()
+        _note_ids.update(new_note_ids)
+        return len(records)
     except Exception as e:
-        print(f"couldn't save {name}: {e}")
+        print(f"couldn't save a batch of {len(records)} colognes: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def add_cologne_notes(notes_by_cologne):
+    # {cologne_id: [note names]} added to existing colognes in one transaction
+    conn = _open_batch_connection()
+    try:
+        new_note_ids = _write_notes(conn.cursor(), notes_by_cologne)
+        conn.commit()
+        _note_ids.update(new_note_ids)
+    except Exception:
         conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def save_cologne_data(name, brand, url, notes_list, gender="Unisex", pos_reviews=0, neu_reviews=0, neg_reviews=0, review_texts=None):
+    try:
+        save_cologne_batch([{
+            "name": name,
+            "brand": brand,
+            "url": url,
+            "notes": notes_list,
+            "gender": gender,
+            "reviews": {"positive": pos_reviews, "neutral": neu_reviews, "negative": neg_reviews, "texts": review_texts or []}
+        }])
+    except Exception as e:
+        print(f"couldn't save {name}: {e}")
+
+def seed_crawl_state(urls):
+    # New urls start pending; urls already saved to colognes (by an older crawl) count as done
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        now = time.time()
+        conn.executemany(
+            "INSERT OR IGNORE INTO crawl_state (url, updated_at) VALUES (?, ?)",
+            [(url, now) for url in urls]
+        )
+        conn.execute('''
+        UPDATE crawl_state SET status = 'done', updated_at = ?
+        WHERE status != 'done' AND url IN (SELECT url FROM colognes)
+        ''', (now,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def get_due_urls(now=None):
+    # Pending urls whose backoff (if any) has passed, first attempts first
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        rows = conn.execute('''
+        SELECT url FROM crawl_state
+        WHERE status = 'pending' AND next_attempt_at <= ?
+        ORDER BY attempts, rowid
+        ''', (time.time() if now is None else now,)).fetchall()
+        return [r[0] for r in rows]
+    finally:
+        conn.close()
+
+def next_crawl_retry_at():
+    # When the earliest backed-off url becomes due, or None once nothing is pending
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        return conn.execute("SELECT MIN(next_attempt_at) FROM crawl_state WHERE status = 'pending'").fetchone()[0]
+    finally:
+        conn.close()
+
+def mark_crawl_done(url):
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        conn.execute(
+            "UPDATE crawl_state SET status = 'done', attempts = attempts + 1, last_error = NULL, updated_at = ? WHERE url = ?",
+            (time.time(), url)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def mark_crawl_failed(url, error, max_attempts=3, backoff_seconds=60.0):
+    # Exponential backoff with jitter between attempts; after max_attempts the url is failed for good
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        row = conn.execute("SELECT attempts FROM crawl_state WHERE url = ?", (url,)).fetchone()
+        attempts = (row[0] if row else 0) + 1
+        now = time.time()
+        status = "failed" if attempts >= max_attempts else "pending"
+        next_attempt_at = now + backoff_seconds * 2 ** (attempts - 1) * random.uniform(1.0, 1.5)
+        conn.execute('''
+        INSERT INTO crawl_state (url, status, attempts, next_attempt_at, last_error, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(url) DO UPDATE SET
+            status = excluded.status, attempts = excluded.attempts, next_attempt_at = excluded.next_attempt_at,
+            last_error = excluded.last_error, updated_at = excluded.updated_at
+        ''', (url, status, attempts, next_attempt_at, str(error)[:500], now))
+        conn.commit()
+        return status
+    finally:
+        conn.close()
+
+def reset_failed_crawls():
+    # Gives urls that used up their attempts another round
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        count = conn.execute(
+            "UPDATE crawl_state SET status = 'pending', attempts = 0, next_attempt_at = 0 WHERE status = 'failed'"
+        ).rowcount
+        conn.commit()
+        return count
+    finally:
+        conn.close()
+
+def crawl_state_counts():
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        return dict(conn.execute("SELECT status, COUNT(*) FROM crawl_state GROUP BY status").fetchall())
     finally:
         conn.close()
 
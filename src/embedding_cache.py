@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+def normalize_query(text):
+    # all-MiniLM-L6-v2 is uncased, so case and whitespace don't change the embedding
+    return " ".join(text.lower().split())
+
+
+class EmbeddingCache:
+    # Bounded LRU of query text -> embedding with optional TTL and on-disk persistence
+
+    def __init__(self, max_size=4096, ttl=None, path=None, model_name=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, stored_at, now):
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry[1], now):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, embedding, stored_at=None):
+        with self._lock:
+            self._entries[key] = (np.asarray(embedding, dtype=np.float32), stored_at or time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, text, compute):
+        key = normalize_query(text)
+        embedding = self.get(key)
+        if embedding is None:
+            # Encoding runs outside the lock; two threads racing on one key both encode, which is harmless
+            embedding = compute(key)
+            self.put(key, embedding)
+        return embedding
+
+    def get_or_compute_many(self, texts, compute_many):
+        # Misses across the whole list are encoded together in one call
+        keys = [normalize_query(t) for t in texts]
+        found = {}
+        for key in dict.fromkeys(keys):
+            embedding = self.get(key)
+            if embedding is not None:
+                found[key] = embedding
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing:
+            for key, embedding in zip(missing, compute_many(missing)):
+                self.put(key, embedding)
+                found[key] = embedding
+        return [found[key] for key in keys]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            items = list(self._entries.items())
+        if not items:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            keys=np.array([k for k, _ in items]),
+            embeddings=np.stack([v[0] for _, v in items]),
+            stored_at=np.array([v[1] for _, v in items]),
+            model_name=np.array(self.model_name or ""),
+        )
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        # An unreadable file is only a lost warm-up, so it is ignored (and replaced on the next save)
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        try:
+            with np.load(self.path) as data:
+                if str(data["model_name"]) != (self.model_name or ""):
+                    print("embedding cache was built with a different model, ignoring it")
+                    return 0
+                now = time.time()
+                entries = [
+                    (str(key), embedding, float(stored_at))
+                    for key, embedding, stored_at in zip(data["keys"], data["embeddings"], data["stored_at"])
+                    if not self._expired(float(stored_at), now)
+                ]
+        except Exception as e:
+            print(f"couldn't read embedding cache {self.path}, starting empty: {e}")
+            return 0
+        for key, embedding, stored_at in entries:
+            self.put(key, embedding, stored_at=stored_at)
+        return len(entries)
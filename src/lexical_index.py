@@ -0,0 +1,135 @@
+import json
+import re
+import unicodedata
+import numpy as np
+
+# Spellings basenotes uses interchangeably for the same material
+NOTE_ALIASES = {
+    "agarwood": "oud",
+    "aoud": "oud",
+    "oudh": "oud",
+    "olibanum": "frankincense",
+    "incense": "frankincense",
+    "orris": "iris",
+    "vetyver": "vetiver",
+    "ambergris": "amber",
+}
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i in is it its like love me my "
+    "not of on or smell smells so that the this to very was with".split()
+)
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def tokenize(text):
+    # Lowercase, fold accents (Néroli -> neroli), split on anything non-alphanumeric
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii").lower()
+    tokens = []
+    for word in _NON_WORD.split(text):
+        if word and word not in STOPWORDS:
+            tokens.append(NOTE_ALIASES.get(word, word))
+    return tokens
+
+
+def normalize_note(name):
+    # "Tonka Bean" -> "tonkabean", which a query matches through its adjacent-word pairs
+    return "".join(tokenize(name))
+
+
+class LexicalIndex:
+    # BM25 over each cologne's notes and review text. Postings are stored CSR
+    # style: the rows for term t are docs[offsets[t]:offsets[t + 1]], with the
+    # matching weighted term frequencies in tfs.
+
+    def __init__(self, cologne_ids, documents, k1=1.2, b=0.75):
+        # documents: one {term: weighted term frequency} dict per cologne
+        self.k1 = k1
+        self.b = b
+        self.cologne_ids = np.asarray(cologne_ids, dtype=np.int64)
+        self.vocabulary = {}
+
+        term_ids, doc_rows, tfs = [], [], []
+        doc_lengths = np.zeros(len(documents), dtype=np.float32)
+        for row, counts in enumerate(documents):
+            for term, tf in counts.items():
+                term_ids.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                doc_rows.append(row)
+                tfs.append(tf)
+                doc_lengths[row] += tf
+
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        order = np.argsort(term_ids, kind="stable")
+        self.docs = np.asarray(doc_rows, dtype=np.int32)[order]
+        self.tfs = np.asarray(tfs, dtype=np.float32)[order]
+        self.offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(self.vocabulary)), out=self.offsets[1:])
+
+        self.doc_lengths = doc_lengths
+        self.avg_doc_length = float(doc_lengths.mean()) if len(doc_lengths) and doc_lengths.any() else 1.0
+
+    @classmethod
+    def from_db(cls, conn, notes_weight=3.0):
+        # Note names count notes_weight times as much as a word from a review
+        documents = {}
+        ids = []
+        for cid, review_texts in conn.execute("SELECT id, review_texts FROM colognes ORDER BY id"):
+            counts = {}
+            try:
+                reviews = json.loads(review_texts) if review_texts else []
+            except ValueError:
+                reviews = [review_texts]
+            for review in reviews:
+                for token in tokenize(review):
+                    counts[token] = counts.get(token, 0.0) + 1.0
+            documents[cid] = counts
+            ids.append(cid)
+
+        query = '''
+        SELECT cn.cologne_id, n.name
+        FROM cologne_notes cn
+        JOIN notes n ON cn.note_id = n.id
+        '''
+        for cid, note in conn.execute(query):
+            counts = documents.get(cid)
+            if counts is None:
+                continue
+            terms = set(tokenize(note))
+            terms.add(normalize_note(note))
+            for term in terms:
+                if term:
+                    counts[term] = counts.get(term, 0.0) + notes_weight
+
+        return cls(ids, [documents[cid] for cid in ids])
+
+    def __len__(self):
+        return len(self.cologne_ids)
+
+    def _query_terms(self, query):
+        tokens = tokenize(query)
+        terms = set(tokens)
+        # Adjacent words can name one note ("tonka bean" -> "tonkabean")
+        terms.update(a + b for a, b in zip(tokens, tokens[1:]))
+        return [self.vocabulary[t] for t in terms if t in self.vocabulary]
+
+    def scores(self, query):
+        scores = np.zeros(len(self.cologne_ids), dtype=np.float32)
+        n_docs = len(self.cologne_ids)
+        for term_id in self._query_terms(query):
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.docs[start:end]
+            tf = self.tfs[start:end]
+            idf = np.log(1.0 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_lengths[docs] / self.avg_doc_length)
+            # A term appears once per document in its postings, so a fancy-indexed add is safe
+            scores[docs] += idf * tf * (self.k1 + 1.0) / (tf + norm)
+        return scores
+
+    def search(self, query, top_k=50):
+        scores = self.scores(query)
+        matched = np.flatnonzero(scores > 0)
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [int(i) for i in self.cologne_ids[matched]], [float(s) for s in scores[matched]]
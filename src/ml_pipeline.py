@@ -1,133 +1,716 @@
-import csv
 import sys
 import os
-import chromadb
-from sentence_transformers import SentenceTransformer
-
-csv.field_size_limit(sys.maxsize)
+import json
+import hashlib
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from datetime import datetime, timezone
+import numpy as np
+from database import get_read_connection
+from embedding_cache import EmbeddingCache
+from lexical_index import LexicalIndex
+from note_index import NoteBitsetIndex
+from reranker import PopularityReranker, mmr_select
+from numpy_index import (
+    NumpyIndex, ChunkedIndex, NeighborTable, save_index, build_neighbor_table, gender_where, index_exists,
+    load_index_meta, check_index_version, load_index_notes, chunk_index_exists, load_chunk_meta, save_chunk_layout,
+    normalize_rows, QUANTIZATIONS, GENDER_GROUPS, CHUNK_EMBEDDINGS_FILE, INDEX_FORMAT_VERSION
+)
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-CSV_PATH = os.path.join(BASE_DIR, "src", "cleaned_data.csv")
 CHROMA_DB_PATH = os.path.join(BASE_DIR, "data", "chroma_db")
-DB_PATH = os.path.join(BASE_DIR, "data", "colognes_basenotes.db")
+NUMPY_INDEX_PATH = os.path.join(BASE_DIR, "data", "numpy_index")
+# Optional compact scoring copy of the snapshot: "float16" or "int8" (rescored in float32)
+INDEX_QUANTIZATION = os.environ.get("INDEX_QUANTIZATION") or None
+# Rows read, encoded and written per step of the streaming build
+BUILD_CHUNK_SIZE = int(os.environ.get("BUILD_CHUNK_SIZE", "256"))
+# Encoder processes for index builds; 1 keeps encoding in this process
+BUILD_WORKERS = int(os.environ.get("BUILD_WORKERS", "1"))
+# Upper bound on documents handed to a worker process at a time
+BUILD_WORKER_CHUNK_SIZE = int(os.environ.get("BUILD_WORKER_CHUNK_SIZE", "64"))
+# Also embed review text in chunks of REVIEW_CHUNK_WORDS words (up to MAX_REVIEW_CHUNKS per cologne)
+# and, with the numpy backend, score each cologne by its best chunks: "max" or the "mean" of the top CHUNK_TOP_M
+CHUNKED_REVIEWS = os.environ.get("CHUNKED_REVIEWS", "0") == "1"
+REVIEW_CHUNK_WORDS = int(os.environ.get("REVIEW_CHUNK_WORDS", "120"))
+MAX_REVIEW_CHUNKS = int(os.environ.get("MAX_REVIEW_CHUNKS", "8"))
+CHUNK_AGGREGATION = os.environ.get("CHUNK_AGGREGATION", "max")
+CHUNK_TOP_M = int(os.environ.get("CHUNK_TOP_M", "3"))
+# Refuse to serve an index snapshot whose source checksum doesn't match the database
+CHECK_INDEX_SOURCE = os.environ.get("CHECK_INDEX_SOURCE", "1") == "1"
+# Model name and per-document content hashes from the last build, for incremental rebuilds
+MANIFEST_PATH = os.path.join(BASE_DIR, "data", "index_manifest.json")
 MODEL_NAME = 'all-MiniLM-L6-v2'
+# "torch", "onnx" or "onnx-int8" (ONNX Runtime on CPU; needs sentence-transformers[onnx])
+ENCODER_BACKEND = os.environ.get("ENCODER_BACKEND", "torch").lower()
+ONNX_MODEL_DIR = os.path.join(BASE_DIR, "data", "onnx_model")
+# Instruction set targeted by dynamic int8 quantization: avx512_vnni, avx512, avx2 or arm64
+ONNX_QUANTIZATION_CONFIG = os.environ.get("ONNX_QUANTIZATION_CONFIG", "avx2")
+# "chroma" (HNSW via PersistentClient) or "numpy" (exact search over a memory-mapped matrix)
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "chroma").lower()
+# Neighbors precomputed per cologne for /recommend/similar; larger top_k falls back to live search
+NEIGHBOR_TABLE_SIZE = 50
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_CACHE_TTL = float(os.environ.get("EMBEDDING_CACHE_TTL", "86400"))
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", os.path.join(BASE_DIR, "data", "embedding_cache.npz"))
+# Concurrent query encodes are coalesced into one forward pass of up to this many texts
+ENCODER_MAX_BATCH = int(os.environ.get("ENCODER_MAX_BATCH", "32"))
+ENCODER_MAX_WAIT_MS = float(os.environ.get("ENCODER_MAX_WAIT_MS", "2"))
+# Standard reciprocal-rank-fusion damping constant
+RRF_K = 60
+# Fuse BM25 over notes and reviews into quiz searches; the weight scales its RRF contribution
+HYBRID_SEARCH = os.environ.get("HYBRID_SEARCH", "1") == "1"
+LEXICAL_WEIGHT = float(os.environ.get("LEXICAL_WEIGHT", "1.0"))
+# Minimum candidates taken from each retriever before fusion (top_k if larger)
+HYBRID_POOL_SIZE = 50
+# Retrieved candidates are re-scored as similarity + weight * log-popularity + weight * review
+# sentiment; both weights default to 0 (pure similarity) and can be overridden per request
+RERANK_POPULARITY_WEIGHT = float(os.environ.get("RERANK_POPULARITY_WEIGHT", "0.0"))
+RERANK_REVIEW_WEIGHT = float(os.environ.get("RERANK_REVIEW_WEIGHT", "0.0"))
+# Candidates re-scored per query when re-ranking or diversification is on
+RERANK_POOL_SIZE = int(os.environ.get("RERANK_POOL_SIZE", "50"))
 
 _model = None
 _chroma_client = None
 _collection = None
+_neighbor_table = None
+_batching_encoder = None
+_lexical_index = None
+_note_index = None
+_reranker = None
+_embedding_cache = EmbeddingCache(
+    max_size=EMBEDDING_CACHE_SIZE,
+    ttl=EMBEDDING_CACHE_TTL,
+    path=EMBEDDING_CACHE_PATH,
+    # Backends embed slightly differently, so persisted entries are only reused by the same one
+    model_name=f"{MODEL_NAME}:{ENCODER_BACKEND}"
+)
+
+def _onnx_file_name(quantized):
+    if not quantized:
+        return "onnx/model.onnx"
+    # optimum names avx2 output quint8 and every other config qint8
+    prefix = "quint8" if ONNX_QUANTIZATION_CONFIG == "avx2" else "qint8"
+    return f"onnx/model_{prefix}_{ONNX_QUANTIZATION_CONFIG}.onnx"
+
+# torch, sentence-transformers and chromadb take seconds to import, so they are
+# imported where first used rather than when the API imports this module
+
+def export_onnx_model(quantized: bool = False):
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+    
+    print(f"Exporting {MODEL_NAME} to ONNX at {ONNX_MODEL_DIR}...")
+    model = SentenceTransformer(MODEL_NAME, backend="onnx", device="cpu")
+    model.save(ONNX_MODEL_DIR)
+    if quantized:
+        print(f"Quantizing to int8 for {ONNX_QUANTIZATION_CONFIG}...")
+        export_dynamic_quantized_onnx_model(model, ONNX_QUANTIZATION_CONFIG, ONNX_MODEL_DIR)
+
+def load_encoder(backend: str = ENCODER_BACKEND):
+    from sentence_transformers import SentenceTransformer
+    
+    if backend == "torch":
+        return SentenceTransformer(MODEL_NAME)
+    if backend not in ("onnx", "onnx-int8"):
+        raise ValueError(f"unknown encoder backend {backend}")
+    
+    quantized = backend == "onnx-int8"
+    file_name = _onnx_file_name(quantized)
+    if not os.path.exists(os.path.join(ONNX_MODEL_DIR, file_name)):
+        export_onnx_model(quantized)
+    return SentenceTransformer(ONNX_MODEL_DIR, backend="onnx", device="cpu", model_kwargs={"file_name": file_name})
 
 def get_model():
     global _model
     if _model is None:
-        _model = SentenceTransformer(MODEL_NAME)
+        _model = load_encoder()
     return _model
 
 def get_collection():
     global _chroma_client, _collection
+    if SEARCH_BACKEND == "numpy":
+        if _collection is None:
+            if CHUNKED_REVIEWS and chunk_index_exists(NUMPY_INDEX_PATH):
+                try:
+                    _collection = ChunkedIndex(NUMPY_INDEX_PATH, CHUNK_AGGREGATION, CHUNK_TOP_M)
+                except ValueError as e:
+                    print(f"not using review chunks: {e}")
+            if _collection is None:
+                _collection = NumpyIndex(NUMPY_INDEX_PATH)
+        return _collection
     if _chroma_client is None:
+        import chromadb
         _chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
     if _collection is None:
         _collection = _chroma_client.get_collection(name="colognes")
     return _collection
 
-def load_data_from_csv():
-    colognes = []
-    with open(CSV_PATH, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
+def snapshot_required():
+    # The chroma backend can serve from chroma_db alone, as deploys built before the
+    # snapshot existed do; then only the source check and note filters go without it
+    return SEARCH_BACKEND == "numpy" or index_exists(NUMPY_INDEX_PATH)
+
+def get_neighbor_table():
+    global _neighbor_table
+    if isinstance(get_collection(), ChunkedIndex):
+        # The table ranks by whole-document vectors only; chunked scoring has to run live
+        return None
+    if _neighbor_table is None and index_exists(NUMPY_INDEX_PATH):
+        _neighbor_table = NeighborTable(NUMPY_INDEX_PATH)
+    return _neighbor_table
+
+class BatchingEncoder:
+    # Collects texts submitted from many threads and encodes them together.
+    # The worker blocks for the first request, then keeps gathering for up to
+    # max_wait seconds or max_batch texts before running one batched encode.
+
+    def __init__(self, model, max_batch=32, max_wait=0.002):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.encoded = 0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="batching-encoder", daemon=True)
+        self._worker.start()
+
+    def submit(self, text):
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def encode(self, text):
+        return self.submit(text).result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
             try:
-                popularity = float(row['popularity']) if row['popularity'] else 0.0
-            except:
-                popularity = 0.0
-            
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Identical texts in one window share a single slot in the forward pass
+            unique_texts = list(dict.fromkeys(text for text, _ in batch))
             try:
-                positive_reviews = float(row.get('positive_reviews', 0.0)) if row.get('positive_reviews') else 0.0
-            except:
-                positive_reviews = 0.0
-
-            colognes.append({
-                "id": str(row['id']),
-                "name": row['name'],
-                "brand": row['brand'],
-                "gender": row['gender'],
-                "popularity": popularity,
-                "positive_reviews": positive_reviews,
-                "review_texts": row.get('review_texts', ''),
-                "notes": row.get('cleaned_notes', '')
-            })
-    return colognes
-
-def build_index():
-    print("Pulling data from CSV...")
-    if not os.path.exists(CSV_PATH):
-        print(f"CSV not found at {CSV_PATH}")
-        return
-        
-    colognes = load_data_from_csv()
-    if not colognes:
-        print("Data is empty, stopping.")
+                embeddings = self.model.encode(unique_texts, batch_size=len(unique_texts))
+                by_text = dict(zip(unique_texts, embeddings))
+                for text, future in batch:
+                    self._resolve(future, by_text[text])
+            except Exception as e:
+                for _, future in batch:
+                    self._resolve(future, error=e)
+            self.batches += 1
+            self.encoded += len(unique_texts)
+
+    @staticmethod
+    def _resolve(future, result=None, error=None):
+        # A caller may have cancelled its future while it waited; that must not
+        # kill the worker, or every later encode() would block forever
+        if future.done():
+            return
+        try:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+        except InvalidStateError:
+            pass
+
+def get_batching_encoder():
+    global _batching_encoder
+    if _batching_encoder is None:
+        _batching_encoder = BatchingEncoder(get_model(), ENCODER_MAX_BATCH, ENCODER_MAX_WAIT_MS / 1000)
+    return _batching_encoder
+
+def get_lexical_index():
+    global _lexical_index
+    if _lexical_index is None:
+        _lexical_index = LexicalIndex.from_db(get_read_connection())
+    return _lexical_index
+
+def get_note_index():
+    global _note_index
+    if _note_index is None:
+        # Read from the index snapshot, in the matrix's row order, so a note mask is a row mask as-is
+        _note_index = NoteBitsetIndex.from_snapshot(*load_index_notes(NUMPY_INDEX_PATH))
+    return _note_index
+
+def get_reranker():
+    global _reranker
+    if _reranker is None:
+        _reranker = PopularityReranker.from_db(get_read_connection())
+    return _reranker
+
+def rerank_weights(popularity_weight=None, review_weight=None):
+    return (
+        RERANK_POPULARITY_WEIGHT if popularity_weight is None else popularity_weight,
+        RERANK_REVIEW_WEIGHT if review_weight is None else review_weight
+    )
+
+def _pool_size(top_k, weights, diversify=(0.0, 0)):
+    # Re-ranking and diversification can promote candidates from below the top_k cut, so retrieve a larger pool
+    return max(top_k, RERANK_POOL_SIZE) if any(weights) or any(diversify) else top_k
+
+def _rerank(ids, sims, top_k, weights, relevance=None):
+    if not any(weights):
+        return ids[:top_k], sims[:top_k]
+    return get_reranker().rerank(ids, sims, top_k, *weights, relevance=relevance)
+
+def _diversify(ids, sims, relevance, top_k, diversity=0.0, max_per_brand=0):
+    # MMR / brand-cap selection of top_k from the pool, using the pool's own embedding rows
+    if not ids:
+        return [], []
+    found = get_collection().get(ids=[str(i) for i in ids], include=["embeddings", "metadatas"])
+    by_id = {int(cid): (embedding, meta) for cid, embedding, meta in zip(found['ids'], found['embeddings'], found['metadatas'])}
+    pool = [k for k, cid in enumerate(ids) if cid in by_id]
+    picks = mmr_select(
+        [relevance[k] for k in pool],
+        np.asarray([by_id[ids[k]][0] for k in pool], dtype=np.float32),
+        top_k,
+        diversity,
+        [by_id[ids[k]][1].get('brand') for k in pool],
+        max_per_brand
+    )
+    return [ids[pool[p]] for p in picks], [sims[pool[p]] for p in picks]
+
+def _rescale(scores, sims):
+    # Maps scores linearly onto the span of sims, keeping their order. Fused rank
+    # scores are around 1/RRF_K, so blended as they are the re-rank weights would swamp them
+    scores = np.asarray(scores, dtype=np.float32)
+    if not len(scores):
+        return scores
+    low, high = float(min(sims)), float(max(sims))
+    spread = float(scores.max() - scores.min())
+    if not spread:
+        return np.full(len(scores), high, dtype=np.float32)
+    return low + (scores - scores.min()) / spread * (high - low)
+
+def _select(ids, sims, top_k, weights, diversify=(0.0, 0), relevance=None):
+    # Re-ranking (if weighted) then diversification (if asked for) over a retrieved pool.
+    # relevance stands in for sims as the base score when the pool wasn't ranked by similarity
+    if not any(diversify):
+        return _rerank(ids, sims, top_k, weights, relevance)
+    if relevance is None:
+        relevance = sims
+    if any(weights):
+        relevance = get_reranker().scores(ids, relevance, *weights)
+    return _diversify(ids, sims, relevance, top_k, *diversify)
+
+def note_mask(include_notes=None, exclude_notes=None):
+    if not include_notes and not exclude_notes:
+        return None
+    return get_note_index().mask(include_notes or (), exclude_notes or ())
+
+def get_embedding_cache():
+    return _embedding_cache
+
+def encode_query(query: str):
+    return _embedding_cache.get_or_compute(query, get_batching_encoder().encode)
+
+def encode_queries(queries):
+    # Callers with many texts already have a batch, so skip the coalescing encoder
+    return _embedding_cache.get_or_compute_many(queries, lambda texts: get_model().encode(texts, batch_size=64))
+
+# Colognes the index covers: ones with review text and at least one note.
+# popularity is total reviews min-max scaled over that set, and
+# positive_reviews the positive share of a cologne's reviews. One statement,
+# so the scaling and the rows come from the same snapshot of the database.
+INDEX_SOURCE_QUERY = '''
+WITH indexed AS (
+    SELECT id, name, brand, gender, review_texts, positive_reviews AS positive,
+           positive_reviews + neutral_reviews + negative_reviews AS total
+    FROM colognes c
+    WHERE review_texts IS NOT NULL AND review_texts != '[]'
+      AND EXISTS (SELECT 1 FROM cologne_notes cn WHERE cn.cologne_id = c.id)
+)
+SELECT id, name, brand, gender, review_texts, positive, total,
+       (SELECT MIN(total) FROM indexed), (SELECT MAX(total) FROM indexed),
+       (SELECT GROUP_CONCAT(n.name, char(10)) FROM cologne_notes cn JOIN notes n ON cn.note_id = n.id
+        WHERE cn.cologne_id = indexed.id)
+FROM indexed
+ORDER BY id
+'''
+
+def iter_colognes_from_db(conn=None):
+    # Streams rows off the cursor, so the catalog is never held in memory at once
+    conn = conn or get_read_connection()
+    for cid, name, brand, gender, review_texts, positive, total, min_total, max_total, notes in conn.execute(INDEX_SOURCE_QUERY):
+        try:
+            reviews = json.loads(review_texts)
+        except ValueError:
+            reviews = [review_texts]
+        # GROUP_CONCAT order follows the query plan, so sort: the notes feed the document text and checksum
+        note_list = sorted(notes.split("\n")) if notes else []
+        spread = (max_total or 0) - (min_total or 0)
+        yield {
+            "id": str(cid),
+            "name": name,
+            "brand": brand,
+            "gender": gender,
+            "popularity": float((total or 0) - (min_total or 0)) / spread if spread else 0.0,
+            "positive_reviews": float(positive or 0) / total if total else 0.0,
+            "review_texts": " ".join(r for r in reviews if isinstance(r, str)),
+            "notes": ", ".join(note_list),
+            "note_list": note_list
+        }
+
+def iter_chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def build_document(item):
+    notes_text = item['notes']
+    words = item['review_texts'].split()
+    truncated_reviews = " ".join(words[:150]) # Truncate to ~150 words
+    return f"Name: {item['name']}. Brand: {item['brand']}. Notes: {notes_text}. Reviews: {truncated_reviews}"
+
+def build_review_chunks(item):
+    # Review text split into REVIEW_CHUNK_WORDS-word windows, each prefixed with
+    # the name and brand so a chunk still says which fragrance it describes
+    words = item['review_texts'].split()
+    chunks = []
+    for start in range(0, len(words), REVIEW_CHUNK_WORDS):
+        if len(chunks) >= MAX_REVIEW_CHUNKS:
+            break
+        chunks.append(f"Name: {item['name']}. Brand: {item['brand']}. Reviews: {' '.join(words[start:start + REVIEW_CHUNK_WORDS])}")
+    return chunks
+
+def build_metadata(item):
+    # Store metadata for hard-filtering
+    return {
+        "name": item['name'],
+        "brand": item['brand'],
+        "gender": item['gender'],
+        "popularity": item['popularity'],
+        "positive_reviews": item['positive_reviews']
+    }
+
+def _content_hash(value):
+    if not isinstance(value, str):
+        value = json.dumps(value, sort_keys=True)
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+def _item_hashes(item):
+    # [hash of the embedded text, hash of the metadata]
+    return [_content_hash(build_document(item)), _content_hash(build_metadata(item))]
+
+def source_checksum(hashes):
+    # Digest of every indexed row's id and content hashes, in id order
+    digest = hashlib.sha256()
+    for cid, (doc_hash, meta_hash) in hashes.items():
+        digest.update(f"{cid}:{doc_hash}:{meta_hash}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def check_index_source():
+    # Refuses an index snapshot built from a different database (or model,
+    # or snapshot format) than the one being served; everything that feeds
+    # the embeddings and filter metadata goes into the checksum
+    meta = load_index_meta(NUMPY_INDEX_PATH)
+    if meta is None:
+        raise RuntimeError(f"no index snapshot at {NUMPY_INDEX_PATH}, build one with python src/ml_pipeline.py")
+    check_index_version(meta)
+    if meta.get("model_name") != MODEL_NAME:
+        raise RuntimeError(f"index was built with {meta.get('model_name')}, not {MODEL_NAME}; rebuild it")
+    if not CHECK_INDEX_SOURCE:
+        return meta.get("source_checksum")
+    checksum = source_checksum({item['id']: _item_hashes(item) for item in iter_colognes_from_db()})
+    if checksum != meta.get("source_checksum"):
+        raise RuntimeError("index was built from a different version of the database; rebuild it with python src/ml_pipeline.py")
+    return checksum
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return None
+    with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(hashes):
+    with open(MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        json.dump({
+            "model_name": MODEL_NAME,
+            "encoder_backend": ENCODER_BACKEND,
+            "built_at": datetime.now(timezone.utc).isoformat(),
+            "count": len(hashes),
+            "hashes": hashes
+        }, f)
+
+def start_encode_pool(workers):
+    # sentence-transformers spawns one model copy per process and returns
+    # results in input order, so multi-process output matches single-process
+    if workers <= 1:
+        return None
+    return get_model().start_multi_process_pool(target_devices=["cpu"] * workers)
+
+def stop_encode_pool(pool):
+    if pool is not None:
+        get_model().stop_multi_process_pool(pool)
+
+def encode_documents(docs, pool=None):
+    model = get_model()
+    if pool is None:
+        return model.encode(docs, batch_size=64)
+    workers = len(pool['processes'])
+    chunk_size = max(1, min(BUILD_WORKER_CHUNK_SIZE, -(-len(docs) // workers)))
+    return model.encode_multi_process(docs, pool, batch_size=64, chunk_size=chunk_size)
+
+def _open_build_collection(client, full):
+    if full:
+        try:
+            client.delete_collection(name="colognes")
+        except:
+            pass
+    return client.get_or_create_collection(
+        name="colognes",
+        metadata={"hnsw:space": "cosine"}
+    )
+
+def build_index(full: bool = False):
+    # Streams the database in chunks of BUILD_CHUNK_SIZE: each chunk is
+    # encoded, written to Chroma and appended to an on-disk staging matrix
+    # before the next is read, so only ids, hashes, note lists and the small
+    # filter metadata are held for the whole catalog
+    start_time = time.time()
+    if INDEX_QUANTIZATION not in (None,) + QUANTIZATIONS:
+        print(f"Unknown INDEX_QUANTIZATION {INDEX_QUANTIZATION}, expected one of {QUANTIZATIONS}")
         return
-        
-    print(f"Found {len(colognes)} items, prepping texts and metadata...")
+    print("Streaming data from the database...")
+    
+    # Incremental builds reuse vectors from the previous snapshot, so they need a manifest
+    # from the same model and encoder backend (backends embed slightly differently, and
+    # mixing them in one index goes unnoticed) and a snapshot of this format to copy unchanged rows from
+    manifest = load_manifest()
+    previous_meta = load_index_meta(NUMPY_INDEX_PATH) if index_exists(NUMPY_INDEX_PATH) else None
+    if not full and (manifest is None or manifest.get("model_name") != MODEL_NAME
+                     or manifest.get("encoder_backend", "torch") != ENCODER_BACKEND or previous_meta is None
+                     or previous_meta.get("version", 1) != INDEX_FORMAT_VERSION):
+        print("No usable manifest or snapshot from a previous build, doing a full build.")
+        full = True
+    
+    import chromadb
+    client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+    collection = _open_build_collection(client, full)
+    if not full and collection.count() != len(manifest["hashes"]):
+        print("ChromaDB collection doesn't match the manifest, doing a full build.")
+        full = True
+        collection = _open_build_collection(client, full)
+    previous = {} if full else manifest["hashes"]
+    reused = None if full else NumpyIndex(NUMPY_INDEX_PATH)
     
-    docs = []
-    metadatas = []
     ids = []
+    metadatas = []
+    notes = []
+    # Per id: [hash of the embedded text, hash of the metadata]
+    hashes = {}
+    encoded_count = 0
+    meta_updates = 0
+    dim = None
     
-    for item in colognes:
-        notes_text = item['notes']
-        words = item['review_texts'].split()
-        truncated_reviews = " ".join(words[:150]) # Truncate to ~150 words
-        text = f"Name: {item['name']}. Brand: {item['brand']}. Notes: {notes_text}. Reviews: {truncated_reviews}"
-        docs.append(text)
-        # Store metadata for hard-filtering
-        metadatas.append({
-            "name": item['name'],
-            "brand": item['brand'],
-            "gender": item['gender'],
-            "popularity": item['popularity'],
-            "positive_reviews": item['positive_reviews']
-        })
-        ids.append(item['id'])
-        
-    print(f"Firing up model {MODEL_NAME}...")
-    model = get_model()
+    os.makedirs(NUMPY_INDEX_PATH, exist_ok=True)
+    staging_path = os.path.join(NUMPY_INDEX_PATH, "staging.f32")
+    # Started on first use, so a rebuild with nothing to encode never spawns workers
+    pool = None
+    try:
+        with open(staging_path, 'wb') as staging:
+            for chunk in iter_chunks(iter_colognes_from_db(), BUILD_CHUNK_SIZE):
+                chunk_ids = [item['id'] for item in chunk]
+                docs = [build_document(item) for item in chunk]
+                chunk_metas = [build_metadata(item) for item in chunk]
+                notes.extend(item['note_list'] for item in chunk)
+                chunk_hashes = [[_content_hash(doc), _content_hash(meta)] for doc, meta in zip(docs, chunk_metas)]
+                del chunk
+                
+                to_encode = [r for r, cid in enumerate(chunk_ids) if previous.get(cid, [None])[0] != chunk_hashes[r][0]]
+                encode_set = set(to_encode)
+                meta_changed = [r for r, cid in enumerate(chunk_ids) if r not in encode_set and previous[cid][1] != chunk_hashes[r][1]]
+                
+                chunk_embeddings = {}
+                if to_encode:
+                    if pool is None and BUILD_WORKERS > 1:
+                        print(f"Encoding with {BUILD_WORKERS} worker processes")
+                        pool = start_encode_pool(BUILD_WORKERS)
+                    encoded = encode_documents([docs[r] for r in to_encode], pool)
+                    chunk_embeddings = dict(zip(to_encode, encoded))
+                    collection.upsert(
+                        ids=[chunk_ids[r] for r in to_encode],
+                        embeddings=[chunk_embeddings[r].tolist() for r in to_encode],
+                        metadatas=[chunk_metas[r] for r in to_encode],
+                        documents=[docs[r] for r in to_encode]
+                    )
+                if meta_changed:
+                    collection.update(ids=[chunk_ids[r] for r in meta_changed], metadatas=[chunk_metas[r] for r in meta_changed])
+                
+                rows = np.asarray([
+                    chunk_embeddings[r] if r in chunk_embeddings else reused.embeddings[reused.id_to_row[cid]]
+                    for r, cid in enumerate(chunk_ids)
+                ], dtype=np.float32)
+                dim = rows.shape[1]
+                staging.write(rows.tobytes())
+                
+                ids.extend(chunk_ids)
+                metadatas.extend(chunk_metas)
+                hashes.update(zip(chunk_ids, chunk_hashes))
+                encoded_count += len(to_encode)
+                meta_updates += len(meta_changed)
+                
+                elapsed = time.time() - start_time
+                print(f"{len(ids)} rows streamed, {encoded_count} encoded ({len(ids) / max(elapsed, 1e-9):.0f} rows/s)")
+    finally:
+        stop_encode_pool(pool)
     
-    print("Crunching text into vectors... This might take a while.")
-    embeddings = model.encode(docs, show_progress_bar=True)
+    removed = [cid for cid in previous if cid not in hashes]
+    if removed:
+        collection.delete(ids=removed)
+    print(f"{encoded_count} new or changed documents, {meta_updates} metadata-only updates, {len(removed)} removed.")
     
-    print(f"Storing into ChromaDB at {CHROMA_DB_PATH}...")
-    client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+    if not ids:
+        os.remove(staging_path)
+        print("Data is empty, stopping.")
+        return
+    checksum = source_checksum(hashes)
+    # Unchanged rows still need a new snapshot when the quantized scoring copy is turned on, off or changed
+    if (not full and not encoded_count and not meta_updates and not removed and previous_meta.get("source_checksum") == checksum
+            and previous_meta.get("quantization") == INDEX_QUANTIZATION):
+        os.remove(staging_path)
+        if CHUNKED_REVIEWS and not chunk_index_current():
+            build_chunk_index()
+        print(f"Index is already up to date ({time.time() - start_time:.1f}s).")
+        return
+    
+    print(f"Writing numpy snapshot to {NUMPY_INDEX_PATH}...")
+    staged = np.memmap(staging_path, dtype=np.float32, mode='r', shape=(len(ids), dim))
+    save_index(
+        NUMPY_INDEX_PATH, ids, staged, metadatas, quantization=INDEX_QUANTIZATION, notes=notes,
+        info={
+            "model_name": MODEL_NAME, "encoder_backend": ENCODER_BACKEND,
+            "built_at": datetime.now(timezone.utc).isoformat(), "source_checksum": checksum
+        }
+    )
+    del staged, reused
+    os.remove(staging_path)
+    
+    print(f"Precomputing top-{NEIGHBOR_TABLE_SIZE} neighbor tables...")
+    build_neighbor_table(NUMPY_INDEX_PATH, n_neighbors=NEIGHBOR_TABLE_SIZE)
     
+    if CHUNKED_REVIEWS:
+        build_chunk_index(full)
+    
+    save_manifest(hashes)
+    elapsed = time.time() - start_time
+    print(f"All done building the index: {len(ids)} rows, {encoded_count} encoded in {elapsed:.1f}s ({len(ids) / elapsed:.0f} rows/s)!")
+    print(f"Source checksum {checksum}")
+
+def chunk_index_current():
+    # Chunk vectors exist and were cut with the current REVIEW_CHUNK_WORDS and MAX_REVIEW_CHUNKS
+    meta = load_chunk_meta(NUMPY_INDEX_PATH) if chunk_index_exists(NUMPY_INDEX_PATH) else None
+    return bool(meta) and meta.get("chunk_words") == REVIEW_CHUNK_WORDS and meta.get("max_chunks") == MAX_REVIEW_CHUNKS
+
+def build_chunk_index(full: bool = False):
+    # Child vectors for ChunkedIndex, laid out in the snapshot's row order: each
+    # row's document vector (copied from the snapshot) followed by its review
+    # chunks. Two passes over the database, inside one read transaction so
+    # both see the same rows: the first sizes every row's run so the output
+    # can be preallocated, the second encodes chunks into place. Rows whose
+    # chunk texts hash the same as last time copy their old vectors.
+    print("Building review chunk vectors...")
+    conn = get_read_connection()
+    conn.execute("BEGIN")
     try:
-        client.delete_collection(name="colognes")
-    except:
-        pass
-        
-    collection = client.create_collection(
-        name="colognes",
-        metadata={"hnsw:space": "cosine"}
+        _build_chunk_vectors(conn, full)
+    finally:
+        conn.commit()
+
+def _build_chunk_vectors(conn, full):
+    index = NumpyIndex(NUMPY_INDEX_PATH, use_quantized=False)
+    n_rows = index.count()
+    counts = np.ones(n_rows, dtype=np.int64)
+    hashes = [None] * n_rows
+    for item in iter_colognes_from_db(conn):
+        row = index.id_to_row.get(item['id'])
+        if row is not None:
+            chunks = build_review_chunks(item)
+            counts[row] += len(chunks)
+            hashes[row] = _content_hash(chunks)
+    offsets = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    
+    previous_meta = None if full else load_chunk_meta(NUMPY_INDEX_PATH)
+    previous = {}
+    if previous_meta and previous_meta.get("chunk_words") == REVIEW_CHUNK_WORDS and chunk_index_exists(NUMPY_INDEX_PATH):
+        old_embeddings = np.load(os.path.join(NUMPY_INDEX_PATH, CHUNK_EMBEDDINGS_FILE), mmap_mode="r")
+        old_offsets = np.zeros(len(previous_meta["ids"]) + 1, dtype=np.int64)
+        np.cumsum(previous_meta["counts"], out=old_offsets[1:])
+        previous = {
+            cid: (chunk_hash, old_offsets[r], old_offsets[r + 1])
+            for r, (cid, chunk_hash) in enumerate(zip(previous_meta["ids"], previous_meta["hashes"]))
+        }
+    
+    embeddings_path = os.path.join(NUMPY_INDEX_PATH, CHUNK_EMBEDDINGS_FILE)
+    out = np.lib.format.open_memmap(
+        embeddings_path + ".tmp.npy", mode="w+", dtype=np.float32, shape=(int(offsets[-1]), index.embeddings.shape[1])
     )
+    for start in range(0, n_rows, BUILD_CHUNK_SIZE):
+        rows = np.arange(start, min(start + BUILD_CHUNK_SIZE, n_rows))
+        out[offsets[rows]] = index.embeddings[start:start + len(rows)]
     
-    batch_size = 1000
-    for i in range(0, len(ids), batch_size):
-        end = min(i + batch_size, len(ids))
-        collection.add(
-            ids=ids[i:end],
-            embeddings=embeddings[i:end].tolist(),
-            metadatas=metadatas[i:end],
-            documents=docs[i:end]
-        )
-        print(f"Added batch {i} to {end}...")
-        
-    print("All done building ChromaDB index!")
+    encoded = 0
+    pool = None
+    try:
+        for batch in iter_chunks(iter_colognes_from_db(conn), BUILD_CHUNK_SIZE):
+            texts = []
+            targets = []
+            for item in batch:
+                row = index.id_to_row.get(item['id'])
+                if row is None or counts[row] == 1:
+                    continue
+                first, last = offsets[row] + 1, offsets[row + 1]
+                old = previous.get(item['id'])
+                if old and old[0] == hashes[row] and old[2] - old[1] == last - first + 1:
+                    out[first:last] = old_embeddings[old[1] + 1:old[2]]
+                    continue
+                texts.extend(build_review_chunks(item))
+                targets.extend(range(first, last))
+            if texts:
+                if pool is None and BUILD_WORKERS > 1:
+                    pool = start_encode_pool(BUILD_WORKERS)
+                out[np.asarray(targets)] = normalize_rows(encode_documents(texts, pool))
+                encoded += len(texts)
+    finally:
+        stop_encode_pool(pool)
+    
+    out.flush()
+    del out
+    previous = old_embeddings = None
+    os.replace(embeddings_path + ".tmp.npy", embeddings_path)
+    parents = np.repeat(np.arange(n_rows, dtype=np.int32), counts)
+    save_chunk_layout(NUMPY_INDEX_PATH, parents, {
+        "ids": index.ids,
+        "counts": counts.tolist(),
+        "hashes": hashes,
+        "chunk_words": REVIEW_CHUNK_WORDS,
+        "max_chunks": MAX_REVIEW_CHUNKS,
+    })
+    print(f"{len(parents)} chunk vectors for {n_rows} colognes ({encoded} encoded)")
 
-def _format_results(search_results, exclude_id, top_k):
-    if not search_results['ids'] or not search_results['ids'][0]:
+def _format_results(search_results, exclude_id, top_k, query_index=0):
+    if len(search_results['ids']) <= query_index or not search_results['ids'][query_index]:
         return [], []
         
-    ids = search_results['ids'][0]
-    distances = search_results['distances'][0]
+    ids = search_results['ids'][query_index]
+    distances = search_results['distances'][query_index]
     
     matched_db_ids = []
     match_distances = []
@@ -149,7 +732,60 @@ def _format_results(search_results, exclude_id, top_k):
             
     return matched_db_ids, match_distances
 
-def search_similar(cologne_id: int, top_k: int = 5, gender: str = "All"):
+def build_where(gender: str = "All", min_popularity: float = 0.0):
+    # Metadata pre-filter in Chroma's where syntax; NumpyIndex understands the same shape
+    clauses = []
+    gender_clause = gender_where(gender)
+    if gender_clause:
+        clauses.append(gender_clause)
+    if min_popularity and min_popularity > 0:
+        clauses.append({"popularity": {"$gte": float(min_popularity)}})
+
+    if not clauses:
+        return None
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+def query_collection(collection, query_embeddings, n_results, where=None, mask=None):
+    if mask is None:
+        return collection.query(query_embeddings=query_embeddings, n_results=n_results, where=where)
+    if SEARCH_BACKEND == "numpy":
+        return collection.query(query_embeddings=query_embeddings, n_results=n_results, where=where, row_mask=mask)
+    
+    # Chroma can't take a row mask, so widen the search until enough rows pass it
+    note_index = get_note_index()
+    allowed = int(mask.sum())
+    fetch = n_results * 4
+    while True:
+        results = collection.query(query_embeddings=query_embeddings, n_results=min(fetch, collection.count()), where=where)
+        filtered = {"ids": [], "distances": []}
+        for ids, distances in zip(results['ids'], results['distances']):
+            keep = [k for k, cid in enumerate(ids) if note_index.allows(cid, mask)][:n_results]
+            filtered['ids'].append([ids[k] for k in keep])
+            filtered['distances'].append([distances[k] for k in keep])
+        satisfied = all(len(ids) >= min(n_results, allowed) for ids in filtered['ids'])
+        if satisfied or fetch >= collection.count():
+            return filtered
+        fetch *= 4
+
+def search_similar(cologne_id: int, top_k: int = 5, gender: str = "All", min_popularity: float = 0.0,
+                   include_notes=None, exclude_notes=None, popularity_weight=None, review_weight=None,
+                   diversity=0.0, max_per_brand=0):
+    # (ids, similarities); (None, None) when the seed isn't in the index, so
+    # callers can tell a missing seed from filters that matched nothing
+    mask = note_mask(include_notes, exclude_notes)
+    weights = rerank_weights(popularity_weight, review_weight)
+    diversify = (diversity, max_per_brand)
+    pool = _pool_size(top_k, weights, diversify)
+    
+    # The catalog is static between rebuilds, so unfiltered lookups come straight from the table
+    neighbor_table = get_neighbor_table()
+    if neighbor_table and not min_popularity and mask is None:
+        precomputed = neighbor_table.lookup(cologne_id, pool, gender)
+        if precomputed is not None:
+            return _select(*precomputed, top_k, weights, diversify)
+
     collection = get_collection()
     
     # Get the embedding for this specific ID
@@ -161,36 +797,210 @@ def search_similar(cologne_id: int, top_k: int = 5, gender: str = "All"):
     embeddings_result = result.get('embeddings')
     if embeddings_result is None or len(embeddings_result) == 0 or embeddings_result[0] is None:
         print(f"ID {cologne_id} missing from the index")
-        return [], []
+        return None, None
         
     query_embedding = embeddings_result[0]
     
-    search_results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=top_k + 1
+    # One extra result in case the seed itself passes the filter
+    search_results = query_collection(
+        collection, [query_embedding], pool + 1, build_where(gender, min_popularity), mask
     )
     
-    return _format_results(search_results, exclude_id=str(cologne_id), top_k=top_k)
+    ids, sims = _format_results(search_results, exclude_id=str(cologne_id), top_k=pool)
+    return _select(ids, sims, top_k, weights, diversify)
 
-def search_raw_text(query: str, top_k: int = 5, gender: str = "All"):
-    model = get_model()
+def search_raw_text(query: str, top_k: int = 5, gender: str = "All", min_popularity: float = 0.0, lexical_query: str = None,
+                    include_notes=None, exclude_notes=None, popularity_weight=None, review_weight=None,
+                    diversity=0.0, max_per_brand=0):
     collection = get_collection()
     
-    query_embedding = model.encode([query])[0]
+    query_embedding = encode_query(query)
+    where = build_where(gender, min_popularity)
+    mask = note_mask(include_notes, exclude_notes)
+    weights = rerank_weights(popularity_weight, review_weight)
+    diversify = (diversity, max_per_brand)
+    hybrid = HYBRID_SEARCH and lexical_query and _lexical_index is not None
+    # Each retriever contributes at least top_k candidates, so fusion can fill any top_k
+    hybrid_pool = max(top_k, HYBRID_POOL_SIZE)
+    pool = _pool_size(hybrid_pool if hybrid else top_k, weights, diversify)
+    
+    search_results = query_collection(collection, [query_embedding.tolist()], pool, where, mask)
     
-    search_results = collection.query(
-        query_embeddings=[query_embedding.tolist()],
-        n_results=top_k
+    # In hybrid mode it's the semantic ranking that gets re-ranked, ahead of fusion
+    semantic_ids, semantic_sims = _format_results(search_results, exclude_id=None, top_k=pool)
+    if not hybrid:
+        return _select(semantic_ids, semantic_sims, top_k, weights, diversify)
+    semantic_ids, semantic_sims = _rerank(semantic_ids, semantic_sims, hybrid_pool, weights)
+    
+    lexical_ids, _ = _lexical_index.search(lexical_query, hybrid_pool)
+    return _fuse_hybrid(collection, query_embedding, semantic_ids, semantic_sims, lexical_ids, top_k, gender, min_popularity, mask, diversify)
+
+def _fuse_hybrid(collection, query_embedding, semantic_ids, semantic_sims, lexical_ids, top_k, gender, min_popularity, mask=None,
+                 diversify=(0.0, 0)):
+    sims = dict(zip(semantic_ids, semantic_sims))
+    
+    # Lexical hits the semantic pool didn't reach still have to pass the filters,
+    # and need a cosine similarity for the match score shown to users
+    lexical_only = [i for i in lexical_ids if i not in sims]
+    if mask is not None:
+        note_index = get_note_index()
+        lexical_only = [i for i in lexical_only if note_index.allows(i, mask)]
+    if lexical_only:
+        found = collection.get(ids=[str(i) for i in lexical_only], include=["embeddings", "metadatas"])
+        accepted = set(GENDER_GROUPS.get(gender, ()))
+        query_vec = np.asarray(query_embedding, dtype=np.float32)
+        query_vec = query_vec / (np.linalg.norm(query_vec) or 1.0)
+        for cid, embedding, meta in zip(found['ids'], found['embeddings'], found['metadatas']):
+            if accepted and meta.get('gender') not in accepted:
+                continue
+            if min_popularity and meta.get('popularity', 0.0) < min_popularity:
+                continue
+            embedding = np.asarray(embedding, dtype=np.float32)
+            sims[int(cid)] = float(embedding @ query_vec / (np.linalg.norm(embedding) or 1.0))
+    
+    fused = {}
+    for rank, cid in enumerate(semantic_ids):
+        fused[cid] = fused.get(cid, 0.0) + 1.0 / (RRF_K + rank + 1)
+    for rank, cid in enumerate(i for i in lexical_ids if i in sims):
+        fused[cid] = fused.get(cid, 0.0) + LEXICAL_WEIGHT / (RRF_K + rank + 1)
+    
+    ranked = sorted(fused, key=lambda cid: fused[cid], reverse=True)
+    if any(diversify):
+        # Fused scores are the relevance here, so diversification keeps the lexical signal
+        ranked = ranked[:_pool_size(top_k, (0.0, 0.0), diversify)]
+        return _diversify(ranked, [sims[cid] for cid in ranked], [fused[cid] for cid in ranked], top_k, *diversify)
+    ranked = ranked[:top_k]
+    return ranked, [sims[cid] for cid in ranked]
+
+def search_many(query_embeddings, top_k: int = 5, gender: str = "All", min_popularity: float = 0.0, exclude_ids=None, mask=None):
+    # All queries go to the backend in a single call; for the numpy backend that is one matrix multiply
+    if len(query_embeddings) == 0:
+        return []
+    collection = get_collection()
+    embeddings = np.asarray(query_embeddings, dtype=np.float32)
+    
+    search_results = query_collection(
+        collection,
+        embeddings if SEARCH_BACKEND == "numpy" else embeddings.tolist(),
+        top_k + (1 if exclude_ids else 0),
+        build_where(gender, min_popularity),
+        mask
     )
     
-    return _format_results(search_results, exclude_id=None, top_k=top_k)
+    return [
+        _format_results(search_results, exclude_id=str(exclude_ids[q]) if exclude_ids else None, top_k=top_k, query_index=q)
+        for q in range(len(query_embeddings))
+    ]
+
+def search_raw_text_many(queries, top_k: int = 5, gender: str = "All", min_popularity: float = 0.0, lexical_queries=None):
+    # search_raw_text for many queries: one encode and one backend call for all of
+    # them, then each query's re-ranking and lexical fusion, so batch results match
+    # single quiz searches (without note filters or diversification)
+    if not queries:
+        return []
+    collection = get_collection()
+    embeddings = encode_queries(queries)
+    weights = rerank_weights()
+    hybrid = HYBRID_SEARCH and lexical_queries is not None and _lexical_index is not None
+    hybrid_pool = max(top_k, HYBRID_POOL_SIZE)
+    pool = _pool_size(hybrid_pool if hybrid else top_k, weights)
+    
+    results = []
+    semantic = search_many(embeddings, pool, gender, min_popularity)
+    for q, (semantic_ids, semantic_sims) in enumerate(semantic):
+        if not (hybrid and lexical_queries[q]):
+            results.append(_select(semantic_ids, semantic_sims, top_k, weights))
+            continue
+        semantic_ids, semantic_sims = _rerank(semantic_ids, semantic_sims, hybrid_pool, weights)
+        lexical_ids, _ = _lexical_index.search(lexical_queries[q], hybrid_pool)
+        results.append(_fuse_hybrid(collection, embeddings[q], semantic_ids, semantic_sims, lexical_ids, top_k, gender, min_popularity))
+    return results
+
+def search_similar_many(cologne_ids, top_k: int = 5, gender: str = "All", min_popularity: float = 0.0):
+    # search_similar for many seeds, re-ranked the same way so batch results match single lookups
+    results = {}
+    weights = rerank_weights()
+    pool = _pool_size(top_k, weights)
+    neighbor_table = get_neighbor_table()
+    remaining = []
+    for cologne_id in dict.fromkeys(cologne_ids):
+        precomputed = neighbor_table.lookup(cologne_id, pool, gender) if neighbor_table and not min_popularity else None
+        if precomputed is not None:
+            results[cologne_id] = _select(*precomputed, top_k, weights)
+        else:
+            remaining.append(cologne_id)
+    
+    if remaining:
+        found = get_collection().get(ids=[str(i) for i in remaining], include=["embeddings"])
+        seeds = [int(i) for i in found['ids']]
+        for seed, matches in zip(seeds, search_many(found['embeddings'], pool, gender, min_popularity, exclude_ids=seeds)):
+            results[seed] = _select(*matches, top_k, weights)
+    
+    return [results.get(cologne_id, ([], [])) for cologne_id in cologne_ids]
+
+def search_multi_seed(liked_ids, disliked_ids=(), top_k: int = 5, gender: str = "All", min_popularity: float = 0.0, method: str = "centroid", dislike_weight: float = 0.5,
+                      include_notes=None, exclude_notes=None, popularity_weight=None, review_weight=None,
+                      diversity=0.0, max_per_brand=0):
+    # (ids, similarities); (None, None) when none of the liked seeds are in the index, as in search_similar
+    collection = get_collection()
+    mask = note_mask(include_notes, exclude_notes)
+    weights = rerank_weights(popularity_weight, review_weight)
+    diversify = (diversity, max_per_brand)
+    seed_ids = [str(i) for i in dict.fromkeys(list(liked_ids) + list(disliked_ids))]
+    found = collection.get(ids=seed_ids, include=["embeddings"])
+    by_id = dict(zip(found['ids'], found['embeddings']))
+    
+    liked = [by_id[str(i)] for i in liked_ids if str(i) in by_id]
+    disliked = [by_id[str(i)] for i in disliked_ids if str(i) in by_id]
+    if not liked:
+        return None, None
+    
+    liked = np.asarray(liked, dtype=np.float32)
+    liked /= np.linalg.norm(liked, axis=1, keepdims=True)
+    disliked = np.asarray(disliked, dtype=np.float32).reshape(-1, liked.shape[1])
+    if len(disliked):
+        disliked /= np.linalg.norm(disliked, axis=1, keepdims=True)
+    
+    # Every seed could come back as a hit, so over-fetch by the seed count
+    pool = _pool_size(top_k, weights, diversify)
+    n_results = pool + len(seed_ids)
+    seeds = set(seed_ids)
+    
+    if method == "centroid":
+        query = liked.mean(axis=0)
+        if len(disliked):
+            query = query - dislike_weight * disliked.mean(axis=0)
+        results = search_many([query], n_results, gender, min_popularity, mask=mask)[0]
+        matches = [(i, sim) for i, sim in zip(*results) if str(i) not in seeds][:pool]
+        return _select([i for i, _ in matches], [sim for _, sim in matches], top_k, weights, diversify)
+    
+    if method != "rrf":
+        raise ValueError(f"unknown multi-seed method {method}")
+    
+    # Rank lists for every seed come from one backend call, then are fused by reciprocal rank
+    per_seed = search_many(np.vstack([liked, disliked]), max(n_results, top_k * 4), gender, min_popularity, mask=mask)
+    fused = {}
+    best_sim = {}
+    for q, (ids, sims) in enumerate(per_seed):
+        weight = 1.0 if q < len(liked) else -dislike_weight
+        for rank, (i, sim) in enumerate(zip(ids, sims)):
+            if str(i) in seeds:
+                continue
+            fused[i] = fused.get(i, 0.0) + weight / (RRF_K + rank + 1)
+            if weight > 0:
+                best_sim[i] = max(best_sim.get(i, -1.0), sim)
+    
+    # Only candidates surfaced by a liked seed are eligible; the reported score is the best cosine to a liked seed
+    ranked = sorted((i for i in fused if i in best_sim), key=lambda i: fused[i], reverse=True)[:pool]
+    sims = [best_sim[i] for i in ranked]
+    return _select(ranked, sims, top_k, weights, diversify, _rescale([fused[i] for i in ranked], sims))
 
 if __name__ == "__main__":
-    build_index()
+    build_index(full="--full" in sys.argv)
     print("\nTesting a search for ID 1")
     # Warm up globals
     get_model()
     get_collection()
     ids, dists = search_similar(1, top_k=5)
-    for i, d in zip(ids, dists):
+    for i, d in zip(ids or [], dists or []):
         print(f"Matched ID: {i} Distance: {d:.4f}")
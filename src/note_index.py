@@ -0,0 +1,60 @@
+import numpy as np
+
+from lexical_index import normalize_note, tokenize
+
+
+def _note_terms(note):
+    return {term for term in set(tokenize(note)) | {normalize_note(note)} if term}
+
+
+class NoteBitsetIndex:
+    # One packed bitset per note over the index snapshot's row order, so
+    # include/exclude filters become a few bitwise ops producing a mask the
+    # search applies before top-k selection.
+    #
+    # Each note is indexed under its full normalized name and each of its
+    # words, so "rose" matches "Bulgarian Rose" and "tonka bean" matches
+    # "Tonka Bean".
+
+    def __init__(self, row_ids, note_rows):
+        # row_ids: cologne id for each row; note_rows: {term: iterable of rows}
+        self.row_ids = np.asarray(row_ids, dtype=np.int64)
+        self.row_of = {int(cid): row for row, cid in enumerate(self.row_ids)}
+        self.n_rows = len(self.row_ids)
+        self.bitsets = {}
+        for term, rows in note_rows.items():
+            bits = np.zeros(self.n_rows, dtype=bool)
+            bits[list(rows)] = True
+            self.bitsets[term] = np.packbits(bits)
+
+    @classmethod
+    def from_snapshot(cls, row_ids, note_names, offsets, codes):
+        # Notes as stored in the index snapshot: row r has note_names[codes[offsets[r]:offsets[r + 1]]]
+        codes = np.asarray(codes)
+        rows = np.repeat(np.arange(len(row_ids)), np.diff(offsets))
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(note_names) + 1))
+        rows = rows[order]
+        note_rows = {}
+        for code, note in enumerate(note_names):
+            note_row_set = rows[bounds[code]:bounds[code + 1]].tolist()
+            for term in _note_terms(note):
+                note_rows.setdefault(term, set()).update(note_row_set)
+        return cls(row_ids, note_rows)
+
+    def _bitset(self, note):
+        empty = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+        return self.bitsets.get(normalize_note(note), empty)
+
+    def mask(self, include=(), exclude=()):
+        # Boolean mask over rows: every include note present, no exclude note present
+        packed = np.full((self.n_rows + 7) // 8, 0xFF, dtype=np.uint8)
+        for note in include:
+            packed &= self._bitset(note)
+        for note in exclude:
+            packed &= ~self._bitset(note)
+        return np.unpackbits(packed, count=self.n_rows).astype(bool)
+
+    def allows(self, cologne_id, mask):
+        row = self.row_of.get(int(cologne_id))
+        return row is not None and bool(mask[row])
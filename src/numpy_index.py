@@ -0,0 +1,498 @@
+import json
+import os
+import numpy as np
+
+EMBEDDINGS_FILE = "embeddings.npy"
+QUANTIZED_FILE = "embeddings_quantized.npy"
+SCALES_FILE = "scales.npy"
+META_FILE = "meta.json"
+QUANTIZATIONS = ("float16", "int8")
+CHUNK_EMBEDDINGS_FILE = "chunk_embeddings.npy"
+CHUNK_PARENTS_FILE = "chunk_parents.npy"
+CHUNK_META_FILE = "chunks.json"
+CHUNK_AGGREGATIONS = ("max", "mean")
+# Each row's notes, CSR style: row r has note_names[codes[offsets[r]:offsets[r + 1]]]
+NOTE_OFFSETS_FILE = "note_offsets.npy"
+NOTE_CODES_FILE = "note_codes.npy"
+# Bumped when the snapshot layout changes; a snapshot from another version has to be rebuilt
+INDEX_FORMAT_VERSION = 2
+
+# Which stored genders each gender filter accepts. Rows are laid out on disk
+# as Male | Unisex | Female | anything else, so every group is one contiguous
+# slice of the matrix and a filtered search scores only that slice.
+GENDER_GROUPS = {
+    "Male": ("Male", "Unisex"),
+    "Unisex": ("Unisex",),
+    "Female": ("Unisex", "Female"),
+}
+_GENDER_ORDER = {"Male": 0, "Unisex": 1, "Female": 2}
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _save_array(path, array):
+    # Write beside the target and swap it in, so a server with the old file
+    # memory-mapped keeps reading the old inode instead of a truncated file
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def quantization_scales(embeddings, chunk_size=4096):
+    # Per-dimension symmetric int8 scales: the largest magnitude in each column maps to 127
+    peak = np.zeros(embeddings.shape[1], dtype=np.float32)
+    for start in range(0, embeddings.shape[0], chunk_size):
+        peak = np.maximum(peak, np.abs(embeddings[start:start + chunk_size]).max(axis=0))
+    peak[peak == 0] = 1.0
+    return peak / 127.0
+
+
+def quantize_rows(rows, quantization, scales=None):
+    if quantization == "float16":
+        return rows.astype(np.float16)
+    if quantization == "int8":
+        return np.clip(np.rint(rows / scales), -127, 127).astype(np.int8)
+    raise ValueError(f"unknown quantization {quantization}")
+
+
+def approximate_scores(queries, quantized, scales=None, block_size=4096):
+    # Converts one block of quantized rows at a time, so the float32 working
+    # copy never exceeds block_size rows. int8 folds the scales into the query.
+    if scales is not None:
+        queries = queries * scales
+    scores = np.empty((queries.shape[0], quantized.shape[0]), dtype=np.float32)
+    for start in range(0, quantized.shape[0], block_size):
+        block = np.asarray(quantized[start:start + block_size], dtype=np.float32)
+        scores[:, start:start + block.shape[0]] = queries @ block.T
+    return scores
+
+
+def gender_where(gender):
+    if gender in GENDER_GROUPS:
+        return {"gender": {"$in": list(GENDER_GROUPS[gender])}}
+    return None
+
+
+def save_index(path, ids, embeddings, metadatas, chunk_size=4096, quantization=None, notes=None, info=None):
+    # notes: optional list of note names per row; info: extra fields for meta.json (model, source checksum)
+    os.makedirs(path, exist_ok=True)
+
+    order = sorted(range(len(ids)), key=lambda i: _GENDER_ORDER.get(metadatas[i].get("gender"), len(_GENDER_ORDER)))
+    genders = [metadatas[i].get("gender") for i in order]
+
+    partitions = {}
+    for name, accepted in GENDER_GROUPS.items():
+        rows = [r for r, g in enumerate(genders) if g in accepted]
+        partitions[name] = [rows[0], rows[-1] + 1] if rows else [0, 0]
+
+    # Rows are copied across in chunks, so embeddings can be a memmap larger than RAM
+    embeddings_path = os.path.join(path, EMBEDDINGS_FILE)
+    tmp_path = embeddings_path + ".tmp.npy"
+    out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(len(ids), embeddings.shape[1]))
+    for start in range(0, len(order), chunk_size):
+        out[start:start + chunk_size] = normalize_rows(embeddings[order[start:start + chunk_size]])
+    out.flush()
+    del out
+    os.replace(tmp_path, embeddings_path)
+
+    if quantization:
+        normalized = np.load(embeddings_path, mmap_mode="r")
+        scales = quantization_scales(normalized, chunk_size) if quantization == "int8" else None
+        quantized_path = os.path.join(path, QUANTIZED_FILE)
+        out = np.lib.format.open_memmap(
+            quantized_path + ".tmp.npy", mode="w+",
+            dtype=np.int8 if quantization == "int8" else np.float16, shape=normalized.shape
+        )
+        for start in range(0, normalized.shape[0], chunk_size):
+            out[start:start + chunk_size] = quantize_rows(normalized[start:start + chunk_size], quantization, scales)
+        out.flush()
+        del out, normalized
+        os.replace(quantized_path + ".tmp.npy", quantized_path)
+        if scales is not None:
+            _save_array(os.path.join(path, SCALES_FILE), scales)
+
+    note_names = None
+    if notes is not None:
+        vocabulary = {}
+        codes = [vocabulary.setdefault(note, len(vocabulary)) for i in order for note in notes[i]]
+        offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum([len(notes[i]) for i in order], out=offsets[1:])
+        _save_array(os.path.join(path, NOTE_OFFSETS_FILE), offsets)
+        _save_array(os.path.join(path, NOTE_CODES_FILE), np.asarray(codes, dtype=np.int32))
+        note_names = list(vocabulary)
+
+    # meta.json goes last: it names the format version, so a reader never pairs it with older arrays
+    meta_path = os.path.join(path, META_FILE)
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({
+            "version": INDEX_FORMAT_VERSION,
+            **(info or {}),
+            "ids": [str(ids[i]) for i in order],
+            "metadatas": [metadatas[i] for i in order],
+            "partitions": partitions,
+            "quantization": quantization,
+            "note_names": note_names,
+        }, f)
+    os.replace(meta_path + ".tmp", meta_path)
+
+    # Only once meta.json no longer names them: copies from a previous build this snapshot doesn't use
+    stale = [] if quantization else [QUANTIZED_FILE]
+    if quantization != "int8":
+        stale.append(SCALES_FILE)
+    for name in stale:
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+
+
+def index_exists(path):
+    return os.path.exists(os.path.join(path, EMBEDDINGS_FILE)) and os.path.exists(os.path.join(path, META_FILE))
+
+
+def load_index_meta(path):
+    meta_path = os.path.join(path, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def check_index_version(meta):
+    # Snapshots written before versioning have no version field and count as version 1
+    version = meta.get("version", 1)
+    if version != INDEX_FORMAT_VERSION:
+        raise ValueError(f"index snapshot has format version {version}, expected {INDEX_FORMAT_VERSION}; rebuild it")
+
+
+def load_index_notes(path):
+    # (row ids, note names, offsets, codes) with the arrays memory-mapped
+    meta = load_index_meta(path)
+    if meta is None or meta.get("note_names") is None:
+        raise ValueError(f"no note lists in the index snapshot at {path}; rebuild it")
+    check_index_version(meta)
+    offsets = np.load(os.path.join(path, NOTE_OFFSETS_FILE), mmap_mode="r")
+    codes = np.load(os.path.join(path, NOTE_CODES_FILE), mmap_mode="r")
+    return [int(cid) for cid in meta["ids"]], meta["note_names"], offsets, codes
+
+
+def chunk_index_exists(path):
+    return all(os.path.exists(os.path.join(path, f)) for f in (CHUNK_EMBEDDINGS_FILE, CHUNK_PARENTS_FILE, CHUNK_META_FILE))
+
+
+def load_chunk_meta(path):
+    meta_path = os.path.join(path, CHUNK_META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_chunk_layout(path, parents, meta):
+    # Written after chunk_embeddings.npy is in place: the parent row of every chunk, then the build metadata
+    _save_array(os.path.join(path, CHUNK_PARENTS_FILE), parents)
+    meta_path = os.path.join(path, CHUNK_META_FILE)
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(meta_path + ".tmp", meta_path)
+
+
+def _condition_mask(column, condition):
+    if not isinstance(condition, dict):
+        condition = {"$eq": condition}
+    mask = np.ones(len(column), dtype=bool)
+    for op, value in condition.items():
+        if op == "$eq":
+            mask &= column == value
+        elif op == "$ne":
+            mask &= column != value
+        elif op == "$in":
+            mask &= np.isin(column, list(value))
+        elif op == "$nin":
+            mask &= ~np.isin(column, list(value))
+        elif op == "$gt":
+            mask &= column > value
+        elif op == "$gte":
+            mask &= column >= value
+        elif op == "$lt":
+            mask &= column < value
+        elif op == "$lte":
+            mask &= column <= value
+        else:
+            raise ValueError(f"unsupported where operator {op}")
+    return mask
+
+
+class NumpyIndex:
+    # Exact cosine search over a memory-mapped, row-normalized float32 matrix.
+    # Mirrors the subset of the Chroma collection API used by ml_pipeline so
+    # either backend can sit behind get_collection().
+    #
+    # When the snapshot was built with a quantization, every row is scored on
+    # the float16/int8 copy and only a shortlist of rescore_factor * n_results
+    # rows is rescored against the float32 matrix, which stays on disk.
+
+    def __init__(self, path, use_quantized=True, rescore_factor=4):
+        self.path = path
+        with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        check_index_version(meta)
+        self.embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+        self.ids = meta["ids"]
+        self.metadatas = meta["metadatas"]
+        self.partitions = {name: tuple(bounds) for name, bounds in meta.get("partitions", {}).items()}
+        self.id_to_row = {cid: row for row, cid in enumerate(self.ids)}
+        self._columns = {}
+
+        self.quantization = meta.get("quantization") if use_quantized else None
+        self.rescore_factor = rescore_factor
+        self.quantized = None
+        self.scales = None
+        if self.quantization:
+            self.quantized = np.load(os.path.join(path, QUANTIZED_FILE), mmap_mode="r")
+            if self.quantization == "int8":
+                self.scales = np.load(os.path.join(path, SCALES_FILE))
+
+    def count(self):
+        return len(self.ids)
+
+    def get(self, ids, include=None):
+        found_ids = []
+        rows = []
+        for cid in ids:
+            row = self.id_to_row.get(str(cid))
+            if row is not None:
+                found_ids.append(self.ids[row])
+                rows.append(row)
+        return {
+            "ids": found_ids,
+            "embeddings": np.asarray(self.embeddings[rows]) if rows else [],
+            "metadatas": [self.metadatas[r] for r in rows],
+        }
+
+    def _column(self, key):
+        if key not in self._columns:
+            values = [m.get(key) for m in self.metadatas]
+            dtype = float if all(isinstance(v, (int, float)) for v in values) else object
+            self._columns[key] = np.asarray(values, dtype=dtype)
+        return self._columns[key]
+
+    def _resolve_where(self, where):
+        # Returns (start, end, mask) where mask is None or a boolean array over rows[start:end]
+        start, end = 0, len(self.ids)
+        if not where:
+            return start, end, None
+
+        clauses = where["$and"] if "$and" in where else [{k: v} for k, v in where.items()]
+        remaining = []
+        for clause in clauses:
+            gender_cond = clause.get("gender")
+            if isinstance(gender_cond, dict) and set(gender_cond) == {"$in"}:
+                accepted = set(gender_cond["$in"])
+                partition = next((p for p, g in GENDER_GROUPS.items() if set(g) == accepted), None)
+                if partition in self.partitions and (start, end) == (0, len(self.ids)):
+                    start, end = self.partitions[partition]
+                    continue
+            remaining.append(clause)
+
+        mask = None
+        for clause in remaining:
+            for key, condition in clause.items():
+                clause_mask = _condition_mask(self._column(key)[start:end], condition)
+                mask = clause_mask if mask is None else mask & clause_mask
+        return start, end, mask
+
+    def _top_k(self, scores, n_results):
+        n = min(n_results, scores.shape[0])
+        if n <= 0:
+            return np.empty(0, dtype=np.int64)
+        if n < scores.shape[0]:
+            candidates = np.argpartition(-scores, n - 1)[:n]
+        else:
+            candidates = np.arange(scores.shape[0])
+        return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+    def _scores(self, queries, start, end):
+        # (n_queries, end - start) similarity of each query to rows[start:end]
+        if self.quantized is None:
+            return queries @ self.embeddings[start:end].T
+        return approximate_scores(queries, self.quantized[start:end], self.scales)
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None, row_mask=None):
+        # row_mask: optional boolean array over all rows, ANDed with the where filter
+        queries = normalize_rows(np.atleast_2d(query_embeddings))
+        start, end, mask = self._resolve_where(where)
+        if row_mask is not None:
+            mask = row_mask[start:end] if mask is None else mask & row_mask[start:end]
+
+        scores = self._scores(queries, start, end)
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+            n_results = min(n_results, int(mask.sum()))
+
+        all_ids, all_distances, all_metadatas = [], [], []
+        for q in range(scores.shape[0]):
+            if self.quantized is None:
+                top = self._top_k(scores[q], n_results)
+                sims = scores[q, top]
+            else:
+                shortlist = self._top_k(scores[q], n_results * self.rescore_factor)
+                # Sorted so the float32 rows are read from the memmap in file order
+                shortlist = np.sort(shortlist[np.isfinite(scores[q, shortlist])])
+                exact = np.asarray(self.embeddings[shortlist + start]) @ queries[q]
+                best = self._top_k(exact, n_results)
+                top, sims = shortlist[best], exact[best]
+            rows = top + start
+            all_ids.append([self.ids[r] for r in rows])
+            # Match Chroma's cosine distance convention: distance = 1 - similarity
+            all_distances.append([float(1.0 - sim) for sim in sims])
+            all_metadatas.append([self.metadatas[r] for r in rows])
+
+        return {"ids": all_ids, "distances": all_distances, "metadatas": all_metadatas}
+
+
+class ChunkedIndex(NumpyIndex):
+    # Multi-vector variant of NumpyIndex: each cologne (parent row) owns a
+    # contiguous run of child vectors, its whole-document embedding followed by
+    # one per review chunk. chunk_parents holds the parent row of every child
+    # and is sorted, so rows[start:end] own chunks[offsets[start]:offsets[end]]
+    # and gender partitions stay contiguous slices. A parent's score is the max
+    # of its chunk similarities, or the mean of its top_m.
+    #
+    # get() still returns the whole-document vectors, so seed lookups and the
+    # result format are the same as NumpyIndex.
+
+    def __init__(self, path, aggregation="max", top_m=3, block_elements=1 << 24):
+        super().__init__(path, use_quantized=False)
+        if aggregation not in CHUNK_AGGREGATIONS:
+            raise ValueError(f"unknown chunk aggregation {aggregation}")
+        self.aggregation = aggregation
+        self.top_m = top_m
+        # Caps the (queries x chunks) working matrix when many queries arrive at once
+        self.block_elements = block_elements
+        if load_chunk_meta(path).get("ids") != self.ids:
+            raise ValueError("chunk vectors were built for a different snapshot, rebuild them")
+        self.chunk_embeddings = np.load(os.path.join(path, CHUNK_EMBEDDINGS_FILE), mmap_mode="r")
+        self.chunk_parents = np.load(os.path.join(path, CHUNK_PARENTS_FILE))
+
+        counts = np.bincount(self.chunk_parents, minlength=len(self.ids))
+        self.chunk_offsets = np.zeros(len(self.ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.chunk_offsets[1:])
+        # Position of each chunk within its parent's run, for scattering into a padded block
+        self.chunk_rank = np.arange(len(self.chunk_parents)) - self.chunk_offsets[self.chunk_parents]
+        self.max_chunks = int(counts.max()) if len(counts) else 0
+
+    def chunk_count(self):
+        return len(self.chunk_parents)
+
+    def _scores(self, queries, start, end):
+        first, last = self.chunk_offsets[start], self.chunk_offsets[end]
+        scores = np.empty((queries.shape[0], end - start), dtype=np.float32)
+        if end == start:
+            return scores
+        chunks = self.chunk_embeddings[first:last]
+        segments = self.chunk_offsets[start:end] - first
+        block = max(1, self.block_elements // max(last - first, (end - start) * self.max_chunks))
+        for q in range(0, queries.shape[0], block):
+            sims = queries[q:q + block] @ chunks.T
+            if self.aggregation == "max":
+                # Every parent owns at least its document vector, so no segment is empty
+                scores[q:q + block] = np.maximum.reduceat(sims, segments, axis=1)
+            else:
+                scores[q:q + block] = self._top_m_mean(sims, start, end, first)
+        return scores
+
+    def _top_m_mean(self, sims, start, end, first):
+        # Scatter chunk scores into a (queries, parents, max_chunks) block padded
+        # with -inf, then partition each parent's run to find its top_m
+        m = min(self.top_m, self.max_chunks)
+        parents = self.chunk_parents[first:first + sims.shape[1]] - start
+        padded = np.full((sims.shape[0], end - start, self.max_chunks), -np.inf, dtype=np.float32)
+        padded[:, parents, self.chunk_rank[first:first + sims.shape[1]]] = sims
+        if m < self.max_chunks:
+            padded = -np.partition(-padded, m - 1, axis=2)[:, :, :m]
+        counts = np.minimum(np.diff(self.chunk_offsets[start:end + 1]), m)
+        return np.where(np.isfinite(padded), padded, 0.0).sum(axis=2) / counts
+
+
+def _neighbor_files(path, partition):
+    return (
+        os.path.join(path, f"neighbors_{partition.lower()}_rows.npy"),
+        os.path.join(path, f"neighbors_{partition.lower()}_sims.npy"),
+    )
+
+
+def build_neighbor_table(path, n_neighbors=50, block_size=512):
+    # All-pairs top-N neighbors for every row, per gender partition, computed
+    # one block of seeds at a time so peak memory is block_size x partition size
+    index = NumpyIndex(path)
+    embeddings = index.embeddings
+    n_rows = embeddings.shape[0]
+    bounds = {"All": (0, n_rows)}
+    bounds.update(index.partitions)
+
+    for partition, (start, end) in bounds.items():
+        rows_out = np.full((n_rows, n_neighbors), -1, dtype=np.int32)
+        sims_out = np.zeros((n_rows, n_neighbors), dtype=np.float16)
+        # Left memory-mapped; the OS pages the partition in as blocks are scored
+        candidates = embeddings[start:end]
+        k = min(n_neighbors, max(end - start - 1, 0))
+
+        for b in range(0, n_rows, block_size):
+            block_end = min(b + block_size, n_rows)
+            scores = np.asarray(embeddings[b:block_end]) @ candidates.T
+
+            # A seed is never its own neighbor
+            seeds = np.arange(b, block_end)
+            in_partition = (seeds >= start) & (seeds < end)
+            scores[np.nonzero(in_partition)[0], seeds[in_partition] - start] = -np.inf
+
+            if k == 0:
+                continue
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+            valid = np.isfinite(top_scores)
+            rows_out[b:block_end, :k] = np.where(valid, top + start, -1)
+            sims_out[b:block_end, :k] = np.where(valid, top_scores, 0)
+
+        rows_file, sims_file = _neighbor_files(path, partition)
+        _save_array(rows_file, rows_out)
+        _save_array(sims_file, sims_out)
+
+
+class NeighborTable:
+    # Precomputed neighbors written by build_neighbor_table, memory-mapped
+
+    def __init__(self, path):
+        with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.ids = meta["ids"]
+        self.id_to_row = {cid: row for row, cid in enumerate(self.ids)}
+        self.tables = {}
+        for partition in ["All"] + list(GENDER_GROUPS):
+            rows_file, sims_file = _neighbor_files(path, partition)
+            if os.path.exists(rows_file) and os.path.exists(sims_file):
+                self.tables[partition] = (np.load(rows_file, mmap_mode="r"), np.load(sims_file, mmap_mode="r"))
+        self.size = min((rows.shape[1] for rows, _ in self.tables.values()), default=0)
+
+    def lookup(self, cologne_id, top_k, gender="All"):
+        # Returns (ids, similarities), or None when the table can't answer the request
+        partition = gender if gender in GENDER_GROUPS else "All"
+        row = self.id_to_row.get(str(cologne_id))
+        if partition not in self.tables or row is None or top_k > self.size:
+            return None
+
+        rows, sims = self.tables[partition]
+        neighbor_rows = rows[row, :top_k]
+        neighbor_rows = neighbor_rows[neighbor_rows >= 0]
+        return (
+            [int(self.ids[r]) for r in neighbor_rows],
+            [float(s) for s in sims[row, :len(neighbor_rows)]],
+        )
@@ -0,0 +1,137 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import database
+from page_parser import parse_details_html
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Gzipped HTML stored as objects/<first two hex chars>/<sha256>.html.gz
+PAGE_CACHE_DIR = os.environ.get("PAGE_CACHE_DIR", os.path.join(BASE_DIR, "data", "page_cache"))
+# A cached page younger than this is reused instead of fetching the url again
+PAGE_CACHE_MAX_AGE = float(os.environ.get("PAGE_CACHE_MAX_AGE", str(30 * 86400)))
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", str(os.cpu_count() or 1)))
+# Re-parsed rows written per transaction
+SAVE_BATCH_SIZE = 1000
+
+
+def _object_path(sha256):
+    return os.path.join(PAGE_CACHE_DIR, "objects", sha256[:2], sha256 + ".html.gz")
+
+
+def store_page(url, html, fetched_at=None):
+    # Content-addressed: a refetch that returns the same HTML only adds a fetch row
+    data = html.encode("utf-8")
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = _object_path(sha256)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, "wb", compresslevel=6) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    conn = sqlite3.connect(database.DB_PATH)
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO page_fetches (url, fetched_at, sha256) VALUES (?, ?, ?)",
+            (url, time.time() if fetched_at is None else fetched_at, sha256)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return sha256
+
+
+def read_object(sha256):
+    with gzip.open(_object_path(sha256), "rb") as f:
+        return f.read().decode("utf-8")
+
+
+def latest_fetch(url):
+    # (fetched_at, sha256) of the newest cached copy of url, or None
+    conn = sqlite3.connect(database.DB_PATH)
+    try:
+        return conn.execute(
+            "SELECT fetched_at, sha256 FROM page_fetches WHERE url = ? ORDER BY fetched_at DESC LIMIT 1", (url,)
+        ).fetchone()
+    finally:
+        conn.close()
+
+
+def cached_page(url, max_age=PAGE_CACHE_MAX_AGE):
+    # The cached HTML for url if it was fetched within max_age seconds, else None (time to refetch)
+    latest = latest_fetch(url)
+    if latest is None or time.time() - latest[0] > max_age or not os.path.exists(_object_path(latest[1])):
+        return None
+    return read_object(latest[1])
+
+
+def cached_record(url, max_age=PAGE_CACHE_MAX_AGE):
+    # The parsed cached copy of url, if it is fresh and parsed to a fragrance. A
+    # challenge, consent or blank page is cached like any other fetch but never
+    # served back, so retries of it go to the network.
+    html = cached_page(url, max_age)
+    if html is None:
+        return None
+    data = parse_details_html(html, url)
+    return data if data.get("name") != "Unknown" else None
+
+
+def latest_fetches():
+    # url -> sha256 of its newest fetch, for every cached url
+    conn = sqlite3.connect(database.DB_PATH)
+    try:
+        return conn.execute('''
+        SELECT f.url, f.sha256 FROM page_fetches f
+        JOIN (SELECT url, MAX(fetched_at) AS fetched_at FROM page_fetches GROUP BY url) latest
+        ON f.url = latest.url AND f.fetched_at = latest.fetched_at
+        ''').fetchall()
+    finally:
+        conn.close()
+
+
+def _parse_cached(entry):
+    url, sha256 = entry
+    try:
+        # With patch_notes' fallback, so notes it recovered from a cached page survive a re-parse
+        return parse_details_html(read_object(sha256), url, note_text_fallback=True)
+    except Exception as e:
+        print(f"couldn't parse cached {url}: {e}")
+        return None
+
+
+def reparse_cache(workers=PARSE_WORKERS, chunksize=32):
+    # Offline parse stage: re-extracts every cached page with the current
+    # parser, spread over worker processes, and overwrites the stored fields
+    database.init_db()
+    entries = latest_fetches()
+    print(f"re-parsing {len(entries)} cached pages with {workers} workers")
+    start = time.perf_counter()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parsed = list(pool.map(_parse_cached, entries, chunksize=chunksize))
+    else:
+        parsed = [_parse_cached(entry) for entry in entries]
+    parse_seconds = time.perf_counter() - start
+
+    records = [data for data in parsed if data and data.get("name") != "Unknown"]
+    for offset in range(0, len(records), SAVE_BATCH_SIZE):
+        database.save_cologne_batch(records[offset:offset + SAVE_BATCH_SIZE], replace=True)
+    elapsed = time.perf_counter() - start
+    print(
+        f"parsed {len(entries)} pages in {parse_seconds:.1f}s ({len(entries) / max(parse_seconds, 1e-9):.0f} pages/s), "
+        f"saved {len(records)} in {elapsed:.1f}s total; {len(entries) - len(records)} had no fragrance data"
+    )
+    return len(records)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "reparse":
+        reparse_cache()
+    else:
+        print("Please specify a command. Example: python page_cache.py reparse")
@@ -0,0 +1,87 @@
+import lxml.html
+
+# Parsed straight into an lxml tree and queried with XPath; building a
+# BeautifulSoup tree on top costs far more than the parse itself
+
+
+def _with_class(tag, cls):
+    return f".//{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {cls} ')]"
+
+
+def _first(root, tag, cls):
+    found = root.xpath(_with_class(tag, cls))
+    return found[0] if found else None
+
+
+def parse_details_html(html, url, note_text_fallback=False):
+    # Everything the crawler keeps from a fragrance detail page. Fields the
+    # page doesn't have keep their defaults, so a name of "Unknown" means the
+    # page wasn't a usable detail page. note_text_fallback fills notes from
+    # parse_note_text's broader extraction when no list item holds any.
+    data = {"url": url, "brand": "Unknown", "name": "Unknown", "notes": [], "gender": "Unisex", "reviews": {"positive": 0, "neutral": 0, "negative": 0, "texts": []}}
+    if not html or not html.strip():
+        return data
+    root = lxml.html.document_fromstring(html)
+
+    name_elem = _first(root, 'span', 'h1_fragname')
+    if name_elem is not None:
+        data['name'] = name_elem.text_content().strip()
+
+    if _first(root, 'i', 'fa-genderless') is not None:
+        data['gender'] = 'Unisex'
+    elif _first(root, 'i', 'fa-mars') is not None:
+        data['gender'] = 'Male'
+    elif _first(root, 'i', 'fa-venus') is not None:
+        data['gender'] = 'Female'
+
+    brand_elem = _first(root, 'span', 'h1_house')
+    if brand_elem is not None:
+        data['brand'] = brand_elem.text_content().strip()
+
+    notes_container = _first(root, 'ul', 'fragrancenotes')
+    if notes_container is not None:
+        # Notes are grouped into nested lists (top/heart/base) on most pages, flat on some
+        inner_uls = notes_container.findall('.//ul')
+        items = [li for ul in inner_uls for li in ul.iterfind('.//li')] if inner_uls else notes_container.iterfind('.//li')
+        for li in items:
+            data['notes'].extend(x.strip() for x in li.text_content().strip().split(','))
+    data['notes'] = [n for n in data['notes'] if n]
+    if note_text_fallback and not data['notes'] and notes_container is not None:
+        data['notes'] = _note_text(notes_container)
+
+    pos_reviews, neu_reviews, neg_reviews = 0, 0, 0
+    for link in root.iter('a'):
+        href = link.get('href', '')
+        text = link.text_content()
+        text_parts = text.strip().split()
+        if not text_parts or not text_parts[0].isdigit():
+            continue
+        if 'reviews/positive/' in href and "Positive" in text:
+            pos_reviews = int(text_parts[0])
+        elif 'reviews/neutral/' in href and "Neutral" in text:
+            neu_reviews = int(text_parts[0])
+        elif 'reviews/negative/' in href and "Negative" in text:
+            neg_reviews = int(text_parts[0])
+
+    review_texts = []
+    for div in root.xpath(_with_class('div', 'fragreview')):
+        text = ' '.join(t.strip() for t in div.itertext() if t.strip())
+        if text:
+            review_texts.append(text)
+
+    data['reviews'] = {"positive": pos_reviews, "neutral": neu_reviews, "negative": neg_reviews, "texts": review_texts[:3]}
+    return data
+
+
+def parse_note_text(html):
+    # Every comma-separated piece of text under ul.fragrancenotes, whichever
+    # element holds it. Broader and noisier than the li items parse_details_html
+    # keeps, so it is only a fallback for pages stored without any notes.
+    if not html or not html.strip():
+        return []
+    container = _first(lxml.html.document_fromstring(html), 'ul', 'fragrancenotes')
+    return _note_text(container) if container is not None else []
+
+
+def _note_text(container):
+    return [x.strip() for x in ','.join(container.itertext()).split(',') if x.strip()]
@@ -2,43 +2,51 @@ import sqlite3
 import asyncio
 import os
 import random
-from bs4 import BeautifulSoup
 import nodriver as uc
+import database
+import page_cache
+from page_parser import parse_details_html
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DB_PATH = os.path.join(BASE_DIR, "data", "colognes_basenotes.db")
+# Pages are missing notes because the crawl's copy had none, so only reuse copies this fresh
+PATCH_CACHE_MAX_AGE = 86400
+
+def extract_notes(html, url):
+    # The crawl's li-based notes, or failing that every comma-separated text under
+    # the notes list: these pages are here because the li-based parse found nothing
+    return parse_details_html(html, url, note_text_fallback=True)['notes']
 
 async def scrape_missing_notes(page, url):
     notes = []
     try:
-        # Crucial: set a strict timeout so a single bad URL redirect loop doesn't hang the worker
-        await asyncio.wait_for(page.get(url), timeout=15.0)
-        
-        # Jitter to avoid bot detection triggering
-        await asyncio.sleep(random.uniform(5, 8))
-        
-        # Try to dismiss the consent popup
-        try:
-            btns = await page.find_elements('.fc-button')
-            if btns:
-                for btn in btns:
-                    text_val = await btn.get_text()
-                    if text_val == 'Consent':
-                        await btn.click()
-                        await asyncio.sleep(2)
-                        break
-        except:
-            pass
+        html = page_cache.cached_page(url, max_age=PATCH_CACHE_MAX_AGE)
+        # A cached challenge or consent page is fetched again, as the crawl does
+        if html is None or parse_details_html(html, url)['name'] == 'Unknown':
+            # Crucial: set a strict timeout so a single bad URL redirect loop doesn't hang the worker
+            await asyncio.wait_for(page.get(url), timeout=15.0)
             
-        html = await page.get_content()
-        soup = BeautifulSoup(html, 'html.parser')
-        
-        notes_container = soup.find('ul', class_='fragrancenotes')
-        if notes_container:
-            text = notes_container.get_text(separator=',')
-            extracted = [x.strip() for x in text.split(',') if x.strip()]
-            notes.extend(extracted)
+            # Jitter to avoid bot detection triggering
+            await asyncio.sleep(random.uniform(5, 8))
+            
+            # Try to dismiss the consent popup
+            try:
+                btns = await page.find_elements('.fc-button')
+                if btns:
+                    for btn in btns:
+                        text_val = await btn.get_text()
+                        if text_val == 'Consent':
+                            await btn.click()
+                            await asyncio.sleep(2)
+                            break
+            except:
+                pass
+                
+            html = await page.get_content()
+            page_cache.store_page(url, html)
+        notes.extend(extract_notes(html, url))
         return notes, True # Success
+    except asyncio.TimeoutError:
         print(f"  -> Timeout loading page.")
         return [], False
     except Exception as e:
@@ -46,6 +54,7 @@ async def scrape_missing_notes(page, url):
         return [], False
 
 async def patch_missing_colognes():
+    database.init_db()
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     
@@ -85,15 +94,7 @@ async def patch_missing_colognes():
             notes, success = await scrape_missing_notes(page, url)
             
             if notes:
-                for note in notes:
-                    cursor.execute("INSERT OR IGNORE INTO notes (name) VALUES (?)", (note,))
-                    cursor.execute("SELECT id FROM notes WHERE name = ?", (note,))
-                    res = cursor.fetchone()
-                    if res:
-                        note_id = res[0]
-                        cursor.execute("INSERT OR IGNORE INTO cologne_notes (cologne_id, note_id) VALUES (?, ?)", (c_id, note_id))
-                
-                conn.commit()
+                database.add_cologne_notes({c_id: notes})
                 print(f"  -> Added {len(notes)} notes: {', '.join(notes)}")
                 success_count += 1
             elif success:
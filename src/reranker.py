@@ -0,0 +1,100 @@
+import numpy as np
+
+
+class PopularityReranker:
+    # Per-cologne popularity and review sentiment held in arrays aligned with a
+    # sorted id array, so a whole candidate pool is looked up with one
+    # searchsorted and re-scored in one vectorized pass:
+    #
+    #   score = similarity + popularity_weight * log_popularity + review_weight * sentiment
+    #
+    # log_popularity is log1p(total reviews) scaled to [0, 1] by the most
+    # reviewed cologne. sentiment is the positive share of positive + negative
+    # reviews, smoothed toward the catalog-wide share by `prior` pseudo-reviews
+    # so a fragrance with two glowing reviews doesn't outrank one with two thousand.
+
+    def __init__(self, cologne_ids, positive, neutral, negative, prior=10.0):
+        order = np.argsort(np.asarray(cologne_ids, dtype=np.int64), kind="stable")
+        self.cologne_ids = np.asarray(cologne_ids, dtype=np.int64)[order]
+        positive = np.asarray(positive, dtype=np.float32)[order]
+        neutral = np.asarray(neutral, dtype=np.float32)[order]
+        negative = np.asarray(negative, dtype=np.float32)[order]
+
+        total = positive + neutral + negative
+        max_total = float(total.max()) if len(total) else 0.0
+        self.log_popularity = np.log1p(total) / (np.log1p(max_total) or 1.0)
+
+        rated = positive + negative
+        global_ratio = float(positive.sum() / rated.sum()) if rated.sum() else 0.5
+        self.sentiment = (positive + prior * global_ratio) / (rated + prior)
+
+    @classmethod
+    def from_db(cls, conn, prior=10.0):
+        rows = conn.execute(
+            "SELECT id, positive_reviews, neutral_reviews, negative_reviews FROM colognes"
+        ).fetchall()
+        columns = list(zip(*rows)) if rows else [(), (), (), ()]
+        return cls(*[[value or 0 for value in column] for column in columns], prior=prior)
+
+    def __len__(self):
+        return len(self.cologne_ids)
+
+    def features(self, ids):
+        # (log_popularity, sentiment) per id; ids the table doesn't know score neutral
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self.cologne_ids):
+            return np.zeros(len(ids), dtype=np.float32), np.full(len(ids), 0.5, dtype=np.float32)
+        rows = np.minimum(np.searchsorted(self.cologne_ids, ids), len(self.cologne_ids) - 1)
+        known = self.cologne_ids[rows] == ids
+        return np.where(known, self.log_popularity[rows], 0.0), np.where(known, self.sentiment[rows], 0.5)
+
+    def scores(self, ids, sims, popularity_weight=0.0, review_weight=0.0):
+        log_popularity, sentiment = self.features(ids)
+        return np.asarray(sims, dtype=np.float32) + popularity_weight * log_popularity + review_weight * sentiment
+
+    def rerank(self, ids, sims, top_k, popularity_weight=0.0, review_weight=0.0, relevance=None):
+        # Reorders the pool by blended score; the similarity reported for each hit is unchanged.
+        # relevance, when given, is the base score in place of sims (e.g. fused rank scores)
+        if not len(ids):
+            return [], []
+        scores = self.scores(ids, sims if relevance is None else relevance, popularity_weight, review_weight)
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return [int(ids[i]) for i in order], [float(sims[i]) for i in order]
+
+
+def mmr_select(relevance, embeddings, top_k, diversity=0.0, brands=None, max_per_brand=0):
+    # Greedy maximal marginal relevance over a candidate pool: each pick maximizes
+    # (1 - diversity) * relevance - diversity * (max cosine to anything already
+    # picked), optionally skipping brands that already have max_per_brand picks.
+    # Relevance is min-max scaled first so `diversity` means the same thing for
+    # cosine similarities and fused rank scores. Returns indices into the pool.
+    relevance = np.asarray(relevance, dtype=np.float32)
+    n = len(relevance)
+    if n == 0:
+        return []
+    spread = float(relevance.max() - relevance.min())
+    relevance = (relevance - relevance.min()) / spread if spread else np.ones(n, dtype=np.float32)
+
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+    if brands is not None and max_per_brand:
+        _, brand_codes = np.unique(np.asarray(brands, dtype=object).astype(str), return_inverse=True)
+        brand_counts = np.zeros(brand_codes.max() + 1, dtype=np.int32)
+
+    available = np.ones(n, dtype=bool)
+    redundancy = np.zeros(n, dtype=np.float32)
+    selected = []
+    while len(selected) < top_k and available.any():
+        scores = np.where(available, (1.0 - diversity) * relevance - diversity * redundancy, -np.inf)
+        pick = int(np.argmax(scores))
+        selected.append(pick)
+        available[pick] = False
+        # One matrix-vector product per pick keeps the pool's similarity to the selection current
+        np.maximum(redundancy, embeddings @ embeddings[pick], out=redundancy)
+        if brands is not None and max_per_brand:
+            code = brand_codes[pick]
+            brand_counts[code] += 1
+            if brand_counts[code] >= max_per_brand:
+                available[brand_codes == code] = False
+    return selected
@@ -0,0 +1,206 @@
+import asyncio
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.request
+from contextlib import closing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import basenotes_crawler
+import database
+import page_cache
+
+MIN_INTERVAL = 0.05
+CHALLENGE_PAGE = "<html><head><title>Just a moment...</title></head><body></body></html>"
+
+
+def detail_page(name):
+    return (
+        f'<html><span class="h1_fragname">{name}</span><span class="h1_house">Fixture House</span>'
+        '<i class="fa-mars"></i><ul class="fragrancenotes"><li><ul><li>Rose, Oud</li><li>Musk</li></ul></li></ul>'
+        '<a href="/x/reviews/positive/">4 Positive</a><div class="fragreview">Lovely rose</div></html>'
+    )
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    # /fragrances/<name>/ serves a detail page. "flaky" serves a challenge page
+    # on its first request only, "blocked" always does.
+    requests = []
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            self.requests.append((self.path, time.monotonic()))
+            seen = sum(1 for path, _ in self.requests if path == self.path)
+        name = self.path.strip("/").split("/")[-1]
+        blocked = name == "blocked" or (name == "flaky" and seen == 1)
+        body = (CHALLENGE_PAGE if blocked else detail_page(name)).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTab:
+    # The subset of a nodriver tab the crawler uses, fetching over plain HTTP
+    def __init__(self):
+        self.html = ""
+        self.closed = False
+
+    async def get(self, url):
+        loop = asyncio.get_running_loop()
+        self.html = await loop.run_in_executor(None, lambda: urllib.request.urlopen(url, timeout=5).read().decode("utf-8"))
+
+    async def sleep(self, seconds):
+        pass
+
+    async def get_content(self):
+        return self.html
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeBrowser:
+    def __init__(self, broken=False):
+        self.broken = broken
+        self.tabs = []
+
+    async def get(self, url, new_tab=False):
+        if self.broken:
+            raise ConnectionError("tab refused to open")
+        tab = FakeTab()
+        self.tabs.append(tab)
+        return tab
+
+
+class CrawlerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved = (database.DB_PATH, page_cache.PAGE_CACHE_DIR)
+        database.DB_PATH = os.path.join(self.tmp, "colognes.db")
+        page_cache.PAGE_CACHE_DIR = os.path.join(self.tmp, "page_cache")
+        database.init_db()
+        FixtureHandler.requests = []
+
+    def tearDown(self):
+        database.DB_PATH, page_cache.PAGE_CACHE_DIR = self.saved
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def url(self, name):
+        return f"{self.base_url}/fragrances/{name}/"
+
+    def crawl(self, browser=None, tabs=3, max_attempts=3, backoff=0.01):
+        return asyncio.run(asyncio.wait_for(
+            basenotes_crawler.crawl_pending(browser or FakeBrowser(), tabs, max_attempts, backoff, MIN_INTERVAL),
+            timeout=30
+        ))
+
+    def states(self):
+        with closing(sqlite3.connect(database.DB_PATH)) as conn:
+            return {url: (status, attempts) for url, status, attempts in conn.execute(
+                "SELECT url, status, attempts FROM crawl_state"
+            )}
+
+    def test_crawls_queue_into_database(self):
+        urls = [self.url(f"cologne-{i}") for i in range(8)]
+        database.seed_crawl_state(urls)
+
+        metrics = self.crawl()
+
+        self.assertEqual(metrics.done, 8)
+        self.assertEqual(self.states(), {url: ("done", 1) for url in urls})
+        with closing(sqlite3.connect(database.DB_PATH)) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM colognes").fetchone()[0], 8)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM cologne_notes").fetchone()[0], 24)
+
+    def test_rate_limits_requests_to_host(self):
+        database.seed_crawl_state([self.url(f"cologne-{i}") for i in range(6)])
+
+        self.crawl(tabs=4)
+
+        times = sorted(t for _, t in FixtureHandler.requests)
+        self.assertEqual(len(times), 6)
+        # Slots are spaced by at least MIN_INTERVAL; allow for timer granularity
+        self.assertGreaterEqual(min(b - a for a, b in zip(times, times[1:])), MIN_INTERVAL * 0.9)
+
+    def test_retries_with_backoff_then_gives_up(self):
+        database.seed_crawl_state([self.url("flaky"), self.url("blocked")])
+
+        metrics = self.crawl(max_attempts=2)
+
+        states = self.states()
+        # The challenge page fetched first is cached but not reused, so the retry refetches
+        self.assertEqual(states[self.url("flaky")], ("done", 2))
+        self.assertEqual(states[self.url("blocked")], ("failed", 2))
+        self.assertEqual((metrics.done, metrics.failed), (1, 3))
+        self.assertEqual(sum(1 for path, _ in FixtureHandler.requests if path == "/fragrances/flaky/"), 2)
+
+    def test_resumes_pending_urls_only(self):
+        urls = [self.url(f"cologne-{i}") for i in range(4)]
+        database.seed_crawl_state(urls)
+        database.mark_crawl_done(urls[0])
+        database.save_cologne_data("Saved Earlier", "Fixture House", urls[1], ["Rose"])
+        # Seeding again (as a restarted crawl does) marks urls already in colognes as done
+        database.seed_crawl_state(urls)
+
+        self.crawl()
+
+        fetched = {path for path, _ in FixtureHandler.requests}
+        self.assertEqual(fetched, {"/fragrances/cologne-2/", "/fragrances/cologne-3/"})
+        self.assertTrue(all(status == "done" for status, _ in self.states().values()))
+
+    def test_failed_save_is_retried_not_marked_done(self):
+        urls = [self.url("cologne-0"), self.url("cologne-1")]
+        database.seed_crawl_state(urls)
+        save_batch = database.save_cologne_batch
+
+        def locked(records, replace=False):
+            raise sqlite3.OperationalError("database is locked")
+
+        database.save_cologne_batch = locked
+        try:
+            metrics = self.crawl(max_attempts=1)
+        finally:
+            database.save_cologne_batch = save_batch
+
+        self.assertEqual((metrics.done, metrics.failed), (0, 2))
+        self.assertEqual(self.states(), {url: ("failed", 1) for url in urls})
+        with closing(sqlite3.connect(database.DB_PATH)) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM colognes").fetchone()[0], 0)
+
+    def test_tab_errors_fail_urls_instead_of_hanging(self):
+        urls = [self.url(f"cologne-{i}") for i in range(3)]
+        database.seed_crawl_state(urls)
+
+        metrics = self.crawl(browser=FakeBrowser(broken=True), tabs=2, max_attempts=1)
+
+        self.assertEqual(metrics.failed, 3)
+        self.assertEqual(self.states(), {url: ("failed", 1) for url in urls})
+        self.assertEqual(FixtureHandler.requests, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import sys
+import threading
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from ml_pipeline import BatchingEncoder
+
+
+class RecordingModel:
+    # Encodes a text as its length; fail makes every forward pass raise
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    def encode(self, texts, batch_size=32):
+        self.calls.append(list(texts))
+        if self.fail:
+            raise RuntimeError("encoder blew up")
+        return np.asarray([[len(t)] for t in texts], dtype=np.float32)
+
+
+class BatchingEncoderTest(unittest.TestCase):
+    def encode_concurrently(self, encoder, texts):
+        # (results, errors) per text, each from its own thread
+        results, errors = {}, {}
+
+        def run(text):
+            try:
+                results[text] = encoder.encode(text)
+            except Exception as e:
+                errors[text] = e
+
+        threads = [threading.Thread(target=run, args=(text,)) for text in texts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+            self.assertFalse(thread.is_alive(), "encode() never returned")
+        return results, errors
+
+    def test_concurrent_encodes_share_one_forward_pass(self):
+        model = RecordingModel()
+        encoder = BatchingEncoder(model, max_batch=4, max_wait=1.0)
+        results, errors = self.encode_concurrently(encoder, ["a", "bb", "ccc", "dddd"])
+
+        self.assertEqual(errors, {})
+        self.assertEqual(len(model.calls), 1)
+        self.assertEqual(sorted(model.calls[0]), ["a", "bb", "ccc", "dddd"])
+        self.assertEqual({text: float(v[0]) for text, v in results.items()}, {"a": 1, "bb": 2, "ccc": 3, "dddd": 4})
+
+    def test_encoder_error_reaches_every_waiting_caller(self):
+        model = RecordingModel(fail=True)
+        encoder = BatchingEncoder(model, max_batch=3, max_wait=1.0)
+        results, errors = self.encode_concurrently(encoder, ["a", "bb", "ccc"])
+
+        self.assertEqual(results, {})
+        self.assertEqual(sorted(errors), ["a", "bb", "ccc"])
+        self.assertTrue(all(isinstance(e, RuntimeError) for e in errors.values()))
+        # The worker survives the failure
+        model.fail = False
+        self.assertEqual(float(encoder.submit("ok").result(timeout=5)[0]), 2)
+
+    def test_cancelled_caller_does_not_stop_the_worker(self):
+        encoder = BatchingEncoder(RecordingModel(), max_batch=2, max_wait=1.0)
+        abandoned = encoder.submit("gone")
+        self.assertTrue(abandoned.cancel())
+        self.assertEqual(float(encoder.submit("kept").result(timeout=5)[0]), 4)
+        self.assertEqual(float(encoder.submit("later").result(timeout=5)[0]), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,204 @@
+import contextlib
+import hashlib
+import importlib.util
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+from contextlib import closing
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import database
+import ml_pipeline
+from numpy_index import EMBEDDINGS_FILE, load_index_meta, load_index_notes
+
+N_COLOGNES = 12
+# Module state a build test points at its own database, index and encoder, restored afterwards
+PIPELINE_STATE = (
+    "CHROMA_DB_PATH", "NUMPY_INDEX_PATH", "MANIFEST_PATH", "INDEX_QUANTIZATION", "BUILD_CHUNK_SIZE", "BUILD_WORKERS",
+    "CHUNKED_REVIEWS", "ENCODER_BACKEND", "CHECK_INDEX_SOURCE", "_model"
+)
+
+
+def record(i, **fields):
+    return {
+        "name": f"Cologne {i}", "brand": f"House {i % 3}", "url": f"https://example.test/{i}/",
+        "notes": ["Rose", f"Note {i % 4}"], "gender": ["Male", "Female", "Unisex"][i % 3],
+        "reviews": {"positive": i, "neutral": 1, "negative": 2, "texts": [f"review of {i}", "smells like rain"]},
+        **fields
+    }
+
+
+class StubEncoder:
+    # Stands in for the sentence-transformers model: each text maps to a fixed
+    # pseudo-random vector, and every text it's asked to encode is recorded
+    def __init__(self):
+        self.encoded = []
+        self.pools = 0
+
+    def encode(self, texts, batch_size=32):
+        self.encoded.extend(texts)
+        return np.asarray([
+            np.random.default_rng(int(hashlib.sha1(t.encode("utf-8")).hexdigest()[:8], 16)).standard_normal(8)
+            for t in texts
+        ], dtype=np.float32)
+
+    def start_multi_process_pool(self, target_devices):
+        self.pools += 1
+        return {"processes": list(target_devices)}
+
+    def stop_multi_process_pool(self, pool):
+        pass
+
+    def encode_multi_process(self, texts, pool, batch_size=32, chunk_size=None):
+        return self.encode(texts, batch_size)
+
+
+@unittest.skipUnless(importlib.util.find_spec("chromadb"), "chromadb is not installed")
+class BuildIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved_db_path = database.DB_PATH
+        self.saved = {name: getattr(ml_pipeline, name) for name in PIPELINE_STATE}
+        database.DB_PATH = os.path.join(self.tmp, "colognes.db")
+        database.init_db()
+        database._read_local.__dict__.pop("conn", None)
+        database.save_cologne_batch([record(i) for i in range(N_COLOGNES)])
+
+        ml_pipeline.CHROMA_DB_PATH = os.path.join(self.tmp, "chroma_db")
+        ml_pipeline.NUMPY_INDEX_PATH = os.path.join(self.tmp, "numpy_index")
+        ml_pipeline.MANIFEST_PATH = os.path.join(self.tmp, "index_manifest.json")
+        ml_pipeline.INDEX_QUANTIZATION = None
+        ml_pipeline.BUILD_CHUNK_SIZE = 5
+        ml_pipeline.BUILD_WORKERS = 1
+        ml_pipeline.CHUNKED_REVIEWS = False
+        ml_pipeline.ENCODER_BACKEND = "torch"
+        ml_pipeline.CHECK_INDEX_SOURCE = True
+        ml_pipeline._model = self.encoder = StubEncoder()
+
+    def tearDown(self):
+        conn = database._read_local.__dict__.pop("conn", None)
+        if conn is not None:
+            conn.close()
+        database.DB_PATH = self.saved_db_path
+        for name, value in self.saved.items():
+            setattr(ml_pipeline, name, value)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def build(self, full=False):
+        # Texts encoded by one build_index call
+        self.encoder.encoded = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            ml_pipeline.build_index(full=full)
+        return self.encoder.encoded
+
+    def execute(self, sql, *params):
+        with closing(sqlite3.connect(database.DB_PATH)) as conn:
+            conn.execute(sql, params)
+            conn.commit()
+
+    def snapshot(self):
+        # Everything a build writes that serving reads, minus the build time
+        path = ml_pipeline.NUMPY_INDEX_PATH
+        meta = load_index_meta(path)
+        meta.pop("built_at")
+        _, names, offsets, codes = load_index_notes(path)
+        import chromadb
+        collection = chromadb.PersistentClient(path=ml_pipeline.CHROMA_DB_PATH).get_collection(name="colognes")
+        found = collection.get(include=["embeddings", "metadatas", "documents"])
+        order = np.argsort(found["ids"])
+        return {
+            "meta": meta,
+            "embeddings": np.load(os.path.join(path, EMBEDDINGS_FILE)),
+            "notes": [[names[c] for c in codes[offsets[r]:offsets[r + 1]]] for r in range(len(offsets) - 1)],
+            "chroma_ids": [found["ids"][i] for i in order],
+            "chroma_embeddings": np.asarray(found["embeddings"])[order],
+            "chroma_metadatas": [found["metadatas"][i] for i in order],
+            "chroma_documents": [found["documents"][i] for i in order],
+        }
+
+    def assertSameSnapshot(self, first, second):
+        for key in ("meta", "notes", "chroma_ids", "chroma_metadatas", "chroma_documents"):
+            self.assertEqual(first[key], second[key], key)
+        for key in ("embeddings", "chroma_embeddings"):
+            np.testing.assert_allclose(first[key], second[key], atol=1e-6, err_msg=key)
+
+    def test_rebuild_without_changes_encodes_nothing(self):
+        self.assertEqual(len(self.build()), N_COLOGNES)
+        before = self.snapshot()
+        self.assertEqual(self.build(), [])
+        self.assertSameSnapshot(self.snapshot(), before)
+
+    def test_changed_row_is_the_only_one_reencoded(self):
+        self.build()
+        self.execute("UPDATE colognes SET review_texts = ? WHERE url = ?", '["changed my mind"]', record(4)["url"])
+        encoded = self.build()
+        self.assertEqual(len(encoded), 1)
+        self.assertIn("changed my mind", encoded[0])
+
+    def test_incremental_build_matches_a_full_rebuild(self):
+        self.build()
+        self.execute("UPDATE colognes SET review_texts = ? WHERE url = ?", '["changed my mind"]', record(1)["url"])
+        # Metadata-only: the review counts feed popularity and the positive share, not the document
+        self.execute("UPDATE colognes SET positive_reviews = 90 WHERE url = ?", record(2)["url"])
+        self.execute("DELETE FROM cologne_notes WHERE cologne_id = (SELECT id FROM colognes WHERE url = ?)", record(3)["url"])
+        database.save_cologne_batch([record(N_COLOGNES)])
+        self.assertEqual(len(self.build()), 2)
+        incremental = self.snapshot()
+        self.assertEqual(len(incremental["meta"]["ids"]), N_COLOGNES)
+
+        self.assertEqual(len(self.build(full=True)), N_COLOGNES)
+        self.assertSameSnapshot(incremental, self.snapshot())
+
+    def test_chunk_size_does_not_change_the_snapshot(self):
+        self.build()
+        chunked = self.snapshot()
+        ml_pipeline.BUILD_CHUNK_SIZE = 1
+        self.build(full=True)
+        self.assertSameSnapshot(self.snapshot(), chunked)
+
+    def test_worker_pool_builds_the_same_snapshot(self):
+        self.build()
+        single = self.snapshot()
+        ml_pipeline.BUILD_WORKERS = 2
+        self.assertEqual(len(self.build(full=True)), N_COLOGNES)
+        self.assertEqual(self.encoder.pools, 1)
+        self.assertSameSnapshot(self.snapshot(), single)
+        # Nothing to encode, so no pool is started
+        self.build()
+        self.assertEqual(self.encoder.pools, 1)
+
+    def test_switching_encoder_backend_forces_a_full_rebuild(self):
+        self.build()
+        ml_pipeline.ENCODER_BACKEND = "onnx"
+        # Reusing the old vectors would leave the index half torch and half ONNX
+        self.assertEqual(len(self.build()), N_COLOGNES)
+        self.assertEqual(load_index_meta(ml_pipeline.NUMPY_INDEX_PATH)["encoder_backend"], "onnx")
+        self.assertEqual(self.build(), [])
+
+    def test_changed_database_row_fails_the_source_check(self):
+        self.build()
+        checksum = ml_pipeline.check_index_source()
+        self.assertEqual(checksum, load_index_meta(ml_pipeline.NUMPY_INDEX_PATH)["source_checksum"])
+        self.execute("UPDATE colognes SET brand = 'Another House' WHERE url = ?", record(5)["url"])
+        with self.assertRaises(RuntimeError):
+            ml_pipeline.check_index_source()
+        ml_pipeline.CHECK_INDEX_SOURCE = False
+        self.assertEqual(ml_pipeline.check_index_source(), checksum)
+
+    def test_note_row_order_does_not_change_the_checksum(self):
+        self.build()
+        # Same notes under renumbered ids, so each cologne's note rows come back in the opposite order
+        self.execute("UPDATE notes SET id = -id")
+        self.execute("UPDATE cologne_notes SET note_id = -note_id")
+        ml_pipeline.check_index_source()
+        self.assertEqual(self.build(), [])
+
+if __name__ == "__main__":
+    unittest.main()
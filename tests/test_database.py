@@ -0,0 +1,154 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+from contextlib import closing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import database
+from catalog import CatalogStore
+
+
+def record(i, notes, **fields):
+    return {
+        "name": f"Cologne {i}", "brand": f"House {i % 3}", "url": f"https://example.test/{i}/", "notes": notes,
+        "gender": "Male", "reviews": {"positive": i, "neutral": 0, "negative": 1, "texts": [f"review of {i}"]},
+        **fields
+    }
+
+
+class DatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved_path = database.DB_PATH
+        database.DB_PATH = os.path.join(self.tmp, "colognes.db")
+        database.init_db()
+        # Read connections are kept per thread, so drop one opened on another database
+        database._read_local.__dict__.pop("conn", None)
+
+    def tearDown(self):
+        conn = database._read_local.__dict__.pop("conn", None)
+        if conn is not None:
+            conn.close()
+        database.DB_PATH = self.saved_path
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def query(self, sql, *params):
+        with closing(sqlite3.connect(database.DB_PATH)) as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def notes_of(self, url):
+        return sorted(name for (name,) in self.query('''
+        SELECT n.name FROM colognes c
+        JOIN cologne_notes cn ON cn.cologne_id = c.id
+        JOIN notes n ON n.id = cn.note_id
+        WHERE c.url = ?
+        ''', url))
+
+
+class SaveCologneBatchTest(DatabaseTestCase):
+    def test_writes_colognes_and_shared_notes(self):
+        saved = database.save_cologne_batch([record(i, ["Rose", f"Note {i % 2}"]) for i in range(10)])
+
+        self.assertEqual(saved, 10)
+        self.assertEqual(self.query("SELECT COUNT(*) FROM colognes")[0][0], 10)
+        self.assertEqual(self.query("SELECT COUNT(*) FROM notes")[0][0], 3)
+        self.assertEqual(self.notes_of(record(3, [])["url"]), ["Note 1", "Rose"])
+        name, positive, texts = self.query("SELECT name, positive_reviews, review_texts FROM colognes WHERE url = ?", record(4, [])["url"])[0]
+        self.assertEqual((name, positive, texts), ("Cologne 4", 4, '["review of 4"]'))
+
+    def test_recrawl_keeps_the_row_and_adds_notes(self):
+        database.save_cologne_batch([record(1, ["Rose"])])
+        (first_id,), = self.query("SELECT id FROM colognes")
+        database.save_cologne_batch([record(1, ["Oud"], name="Renamed")])
+
+        self.assertEqual(self.query("SELECT id, name FROM colognes"), [(first_id, "Cologne 1")])
+        self.assertEqual(self.notes_of(record(1, [])["url"]), ["Oud", "Rose"])
+
+    def test_replace_overwrites_fields_and_notes_in_place(self):
+        database.save_cologne_batch([record(1, ["Rose"]), record(2, ["Musk"])])
+        (first_id,), = self.query("SELECT id FROM colognes WHERE url = ?", record(1, [])["url"])
+        database.save_cologne_batch([record(1, ["Oud", "Amber"], name="Renamed", gender="Female")], replace=True)
+
+        self.assertEqual(self.query("SELECT id, name, gender FROM colognes WHERE url = ?", record(1, [])["url"]), [(first_id, "Renamed", "Female")])
+        self.assertEqual(self.notes_of(record(1, [])["url"]), ["Amber", "Oud"])
+        self.assertEqual(self.notes_of(record(2, [])["url"]), ["Musk"])
+
+    def test_failed_batch_writes_nothing_and_raises(self):
+        with self.assertRaises(sqlite3.IntegrityError):
+            database.save_cologne_batch([record(1, ["Rose"]), record(2, ["Oud"], name=None)], replace=True)
+
+        self.assertEqual(self.query("SELECT COUNT(*) FROM colognes")[0][0], 0)
+        self.assertEqual(self.query("SELECT COUNT(*) FROM notes")[0][0], 0)
+        # Note ids from the rolled back transaction must not linger in the name cache
+        database.save_cologne_batch([record(3, ["Rose"])])
+        self.assertEqual(self.notes_of(record(3, [])["url"]), ["Rose"])
+
+    def test_save_cologne_data_matches_a_batch_of_one(self):
+        database.save_cologne_data("Single", "House", "https://example.test/single/", ["Iris"], gender="Unisex", pos_reviews=2)
+
+        self.assertEqual(self.query("SELECT name, gender, positive_reviews FROM colognes"), [("Single", "Unisex", 2)])
+        self.assertEqual(self.notes_of("https://example.test/single/"), ["Iris"])
+
+
+class CatalogStoreTest(DatabaseTestCase):
+    def test_details_come_back_in_request_order(self):
+        database.save_cologne_batch([record(i, ["Rose", "Oud"] if i % 2 else ["Musk"]) for i in range(5)])
+        catalog = CatalogStore(database.DB_PATH)
+        self.assertEqual(catalog.load(), 5)
+
+        ids = [cid for (cid,) in self.query("SELECT id FROM colognes ORDER BY id DESC")]
+        details = catalog.get_details(ids[:2] + [999])
+        self.assertEqual([d["id"] for d in details], ids[:2])
+        self.assertEqual(details[0], {
+            "id": ids[0], "name": "Cologne 4", "brand": "House 1", "url": record(4, [])["url"],
+            "gender": "Male", "notes": ["Musk"]
+        })
+        self.assertEqual(details[1]["notes"], ["Rose", "Oud"])
+        # Shared note names are interned, so each exists once
+        self.assertEqual(catalog.memory_report()["distinct_notes"], 3)
+
+    def test_reloads_only_after_the_database_changes(self):
+        database.save_cologne_batch([record(1, ["Rose"])])
+        catalog = CatalogStore(database.DB_PATH)
+        catalog.load()
+        self.assertFalse(catalog.reload_if_changed())
+
+        database.save_cologne_batch([record(2, ["Oud"])])
+        self.assertTrue(catalog.reload_if_changed())
+        self.assertEqual(len(catalog), 2)
+
+    def replace_database(self, records):
+        # Writes a copy of the database with records added, then moves it over
+        # the original the way a deploy swaps in a freshly built file
+        path = database.DB_PATH
+        copy = os.path.join(self.tmp, "replacement.db")
+        with closing(sqlite3.connect(path)) as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            with closing(sqlite3.connect(copy)) as target:
+                conn.backup(target)
+        database.DB_PATH = copy
+        try:
+            database.save_cologne_batch(records)
+        finally:
+            database.DB_PATH = path
+        os.replace(copy, path)
+
+    def test_reload_sees_a_replaced_database_file(self):
+        database.save_cologne_batch([record(1, ["Rose"])])
+        catalog = CatalogStore(database.DB_PATH)
+        catalog.load()
+        # Warm this thread's cached read connection on the old file
+        self.assertEqual(database.get_read_connection().execute("SELECT COUNT(*) FROM colognes").fetchone(), (1,))
+
+        self.replace_database([record(2, ["Oud"]), record(3, ["Musk"])])
+        self.assertTrue(catalog.reload_if_changed())
+        self.assertEqual(len(catalog), 3)
+        self.assertEqual(database.get_read_connection().execute("SELECT COUNT(*) FROM colognes").fetchone(), (3,))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from embedding_cache import EmbeddingCache
+
+
+def fake_encode(text):
+    return np.full(4, len(text), dtype=np.float32)
+
+
+class EmbeddingCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "cache", "embeddings.npz")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_equivalent_queries_share_one_encode(self):
+        cache = EmbeddingCache()
+        calls = []
+        compute = lambda text: calls.append(text) or fake_encode(text)
+        cache.get_or_compute("Rose  and OUD", compute)
+        cache.get_or_compute(" rose and oud ", compute)
+
+        self.assertEqual(calls, ["rose and oud"])
+        self.assertEqual((cache.stats()["hits"], cache.stats()["misses"]), (1, 1))
+
+    def test_batch_lookup_encodes_only_distinct_misses(self):
+        cache = EmbeddingCache()
+        cache.get_or_compute("vetiver", fake_encode)
+        calls = []
+        compute_many = lambda texts: calls.append(list(texts)) or [fake_encode(t) for t in texts]
+        embeddings = cache.get_or_compute_many(["Vetiver", "amber", "AMBER", "musk"], compute_many)
+
+        self.assertEqual(calls, [["amber", "musk"]])
+        np.testing.assert_array_equal([e[0] for e in embeddings], [7, 5, 5, 4])
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = EmbeddingCache(max_size=2)
+        cache.put("a", fake_encode("a"))
+        cache.put("b", fake_encode("b"))
+        cache.get("a")
+        cache.put("c", fake_encode("c"))
+
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertEqual(cache.stats()["size"], 2)
+
+    def test_expired_entries_are_dropped(self):
+        cache = EmbeddingCache(ttl=60)
+        cache.put("old", fake_encode("old"), stored_at=time.time() - 120)
+        cache.put("new", fake_encode("new"))
+
+        self.assertIsNone(cache.get("old"))
+        self.assertIsNotNone(cache.get("new"))
+
+    def test_saved_cache_reloads_for_the_same_model_only(self):
+        cache = EmbeddingCache(ttl=60, path=self.path, model_name="model-a")
+        cache.put("fresh", fake_encode("fresh"))
+        cache.put("stale", fake_encode("stale"), stored_at=time.time() - 120)
+        cache.save()
+
+        reloaded = EmbeddingCache(ttl=60, path=self.path, model_name="model-a")
+        self.assertEqual(reloaded.load(), 1)
+        np.testing.assert_array_equal(reloaded.get("fresh"), fake_encode("fresh"))
+        self.assertEqual(EmbeddingCache(path=self.path, model_name="model-b").load(), 0)
+
+    def test_unreadable_file_starts_empty(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "wb") as f:
+            f.write(b"not an npz file")
+
+        cache = EmbeddingCache(path=self.path)
+        self.assertEqual(cache.load(), 0)
+        self.assertEqual(cache.stats()["size"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
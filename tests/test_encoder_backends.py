@@ -0,0 +1,49 @@
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import ml_pipeline
+
+QUERIES = [
+    "Name: Ideal Fragrance. Brand: Any. Notes: rose, oud. Reviews: I love this fragrance because it is rose, oud.",
+    "fresh citrus for summer days",
+    "smoky leather and tobacco",
+    "Name: Ideal Female Fragrance. Brand: Any. Notes: vanilla. Reviews: I love this female fragrance because it is vanilla.",
+    "clean soapy musk, like laundry drying in the sun",
+]
+
+
+@unittest.skipUnless(
+    importlib.util.find_spec("onnxruntime") and importlib.util.find_spec("sentence_transformers"),
+    "onnxruntime or sentence-transformers is not installed"
+)
+class OnnxParityTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Exported into a scratch directory rather than data/onnx_model
+        cls.tmp = tempfile.mkdtemp()
+        cls.saved_dir = ml_pipeline.ONNX_MODEL_DIR
+        ml_pipeline.ONNX_MODEL_DIR = cls.tmp
+        cls.reference = ml_pipeline.load_encoder("torch").encode(QUERIES, normalize_embeddings=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        ml_pipeline.ONNX_MODEL_DIR = cls.saved_dir
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def test_onnx_backends_match_torch(self):
+        for backend in ("onnx", "onnx-int8"):
+            embeddings = ml_pipeline.load_encoder(backend).encode(QUERIES, normalize_embeddings=True)
+            cosines = np.sum(embeddings * self.reference, axis=1)
+            self.assertGreaterEqual(float(cosines.min()), 0.99, backend)
+
+
+if __name__ == "__main__":
+    unittest.main()
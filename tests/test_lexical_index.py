@@ -0,0 +1,81 @@
+import math
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+from contextlib import closing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import database
+from lexical_index import LexicalIndex, normalize_note, tokenize
+
+COLOGNES = [
+    ("Rose Noir", ["Rose", "Oud"], ["dark rose, very smoky"]),
+    ("Tonka Dream", ["Tonka Bean", "Vanilla"], ["sweet and warm"]),
+    ("Forest", ["Vetiver", "Cedar"], ["green and earthy, a hint of rose"]),
+    ("Agar", ["Agarwood"], []),
+    ("Plain", [], ["nothing to say"]),
+]
+
+
+class TokenizeTest(unittest.TestCase):
+    def test_folds_case_accents_stopwords_and_aliases(self):
+        self.assertEqual(tokenize("I love the Néroli and ORRIS!"), ["neroli", "iris"])
+        self.assertEqual(normalize_note("Tonka Bean"), "tonkabean")
+        self.assertEqual(normalize_note("Oudh"), "oud")
+
+
+class LexicalIndexTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        path = os.path.join(cls.tmp, "colognes.db")
+        saved, database.DB_PATH = database.DB_PATH, path
+        try:
+            database.init_db()
+            database.save_cologne_batch([{
+                "name": name, "brand": "House", "url": f"https://example.test/{i}/", "notes": notes,
+                "reviews": {"positive": 0, "neutral": 0, "negative": 0, "texts": texts}
+            } for i, (name, notes, texts) in enumerate(COLOGNES)])
+        finally:
+            database.DB_PATH = saved
+        with closing(sqlite3.connect(path)) as conn:
+            cls.ids = {name: cid for cid, name in conn.execute("SELECT id, name FROM colognes")}
+            cls.index = LexicalIndex.from_db(conn)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def search(self, query, top_k=50):
+        ids, scores = self.index.search(query, top_k)
+        names = {cid: name for name, cid in self.ids.items()}
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        return [names[cid] for cid in ids]
+
+    def test_notes_outrank_review_mentions(self):
+        self.assertEqual(self.search("rose"), ["Rose Noir", "Forest"])
+
+    def test_aliases_and_adjacent_words_match_notes(self):
+        self.assertEqual(self.search("oudh"), ["Agar", "Rose Noir"])
+        self.assertEqual(self.search("tonka bean"), ["Tonka Dream"])
+
+    def test_only_matching_documents_are_returned(self):
+        self.assertEqual(self.search("tobacco"), [])
+        self.assertEqual(len(self.index), len(COLOGNES))
+        self.assertEqual(len(self.search("rose oud vanilla vetiver", top_k=2)), 2)
+
+    def test_scores_follow_bm25(self):
+        # Two documents, one term each: idf * (k1 + 1) * tf / (tf + k1 * length norm)
+        index = LexicalIndex([1, 2], [{"rose": 1.0}, {"oud": 3.0}], k1=1.2, b=0.75)
+        idf = math.log(1.0 + (2 - 1 + 0.5) / (1 + 0.5))
+        norm = 1.2 * (1.0 - 0.75 + 0.75 * 3.0 / 2.0)
+        self.assertAlmostEqual(float(index.scores("oud")[1]), idf * 3.0 * 2.2 / (3.0 + norm), places=5)
+        self.assertEqual(float(index.scores("oud")[0]), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from note_index import NoteBitsetIndex
+from numpy_index import load_index_notes, save_index
+
+NOTES = [
+    ["Bulgarian Rose", "Oud"],
+    ["Tonka Bean", "Vanilla"],
+    ["Agarwood", "Amber"],
+    [],
+    ["Rose", "Néroli", "Musk"],
+    ["Vetiver"],
+    ["Amber", "Musk"],
+    ["Iris", "Rose"],
+    ["Oudh", "Saffron"],
+]
+
+
+class NoteBitsetIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        # Genders make the snapshot reorder rows, which the masks have to follow
+        genders = ["Female", "Male", "Unisex"]
+        save_index(
+            self.tmp, list(range(1, len(NOTES) + 1)), np.eye(len(NOTES), dtype=np.float32),
+            [{"gender": genders[i % 3]} for i in range(len(NOTES))], notes=NOTES
+        )
+        self.index = NoteBitsetIndex.from_snapshot(*load_index_notes(self.tmp))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def matching(self, include=(), exclude=()):
+        mask = self.index.mask(include, exclude)
+        self.assertEqual(mask.shape, (len(NOTES),))
+        return {int(cid) for cid in self.index.row_ids[mask]}
+
+    def expected(self, keep):
+        return {i + 1 for i, notes in enumerate(NOTES) if keep(notes)}
+
+    def test_masks_match_a_scan_of_the_note_lists(self):
+        self.assertEqual(self.matching(["vetiver"]), {6})
+        self.assertEqual(self.matching(["amber", "musk"]), self.expected(lambda n: "Amber" in n and "Musk" in n))
+        self.assertEqual(self.matching(exclude=["musk"]), self.expected(lambda n: "Musk" not in n))
+        self.assertEqual(self.matching(), self.expected(lambda n: True))
+
+    def test_words_and_aliases_match_full_note_names(self):
+        self.assertEqual(self.matching(["rose"]), {1, 5, 8})
+        self.assertEqual(self.matching(["tonka bean"]), {2})
+        self.assertEqual(self.matching(["neroli"]), {5})
+        # Oudh and Agarwood are both indexed as oud
+        self.assertEqual(self.matching(["oud"]), {1, 3, 9})
+
+    def test_unknown_notes_include_nothing_and_exclude_nothing(self):
+        self.assertEqual(self.matching(["tobacco"]), set())
+        self.assertEqual(self.matching(exclude=["tobacco"]), self.expected(lambda n: True))
+
+    def test_allows_checks_ids_against_a_mask(self):
+        mask = self.index.mask(["rose"])
+        self.assertTrue(self.index.allows(5, mask))
+        self.assertFalse(self.index.allows(6, mask))
+        self.assertFalse(self.index.allows(999, mask))
+
+    def test_snapshot_without_note_lists_is_rejected(self):
+        save_index(self.tmp, [1], np.ones((1, 4), dtype=np.float32), [{"gender": "Male"}])
+        with self.assertRaises(ValueError):
+            load_index_notes(self.tmp)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,219 @@
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from numpy_index import (
+    NumpyIndex, ChunkedIndex, NeighborTable, GENDER_GROUPS, QUANTIZED_FILE, SCALES_FILE, CHUNK_EMBEDDINGS_FILE,
+    build_neighbor_table, gender_where, load_index_meta, normalize_rows, save_chunk_layout, save_index
+)
+
+N_ROWS = 300
+DIM = 32
+TOP_K = 10
+GENDERS = ["Male", "Female", "Unisex", "Unknown"]
+
+
+def recall(expected, found):
+    return len(set(expected) & set(found)) / len(expected)
+
+
+class SnapshotTestCase(unittest.TestCase):
+    # A snapshot of random vectors, with ids 1..N_ROWS deliberately not in
+    # gender order so the on-disk row order differs from the input order
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.ids = [str(i) for i in range(1, N_ROWS + 1)]
+        self.vectors = rng.standard_normal((N_ROWS, DIM)).astype(np.float32)
+        self.metadatas = [{"gender": GENDERS[i % 4], "popularity": float(i % 17)} for i in range(N_ROWS)]
+        save_index(self.tmp, self.ids, self.vectors, self.metadatas)
+        self.queries = rng.standard_normal((20, DIM)).astype(np.float32)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def brute_force(self, query, n_results, allowed=None):
+        # (ids, similarities) over the input vectors, restricted to rows allowed() accepts
+        scores = normalize_rows(self.vectors) @ normalize_rows(query[None])[0]
+        rows = [i for i in np.argsort(-scores) if allowed is None or allowed(i)][:n_results]
+        return [self.ids[i] for i in rows], scores[rows]
+
+
+class NumpyIndexTest(SnapshotTestCase):
+    def test_top_k_matches_brute_force(self):
+        index = NumpyIndex(self.tmp)
+        results = index.query(self.queries, n_results=TOP_K)
+        for q, query in enumerate(self.queries):
+            expected_ids, expected_sims = self.brute_force(query, TOP_K)
+            self.assertEqual(results["ids"][q], expected_ids)
+            np.testing.assert_allclose(1.0 - np.asarray(results["distances"][q]), expected_sims, atol=1e-5)
+
+    def test_gender_partitions_match_filtered_brute_force(self):
+        index = NumpyIndex(self.tmp)
+        for gender, accepted in GENDER_GROUPS.items():
+            results = index.query(self.queries, n_results=TOP_K, where=gender_where(gender))
+            for q, query in enumerate(self.queries):
+                expected, _ = self.brute_force(query, TOP_K, lambda i: self.metadatas[i]["gender"] in accepted)
+                self.assertEqual(results["ids"][q], expected)
+
+    def test_where_and_row_mask_are_combined(self):
+        index = NumpyIndex(self.tmp)
+        # row_mask is over the snapshot's row order: keep even ids only
+        row_mask = np.array([int(cid) % 2 == 0 for cid in index.ids])
+        where = {"$and": [gender_where("Male"), {"popularity": {"$gte": 5.0}}]}
+        results = index.query(self.queries, n_results=TOP_K, where=where, row_mask=row_mask)
+        for q, query in enumerate(self.queries):
+            expected, _ = self.brute_force(query, TOP_K, lambda i: (
+                self.metadatas[i]["gender"] in GENDER_GROUPS["Male"]
+                and self.metadatas[i]["popularity"] >= 5.0
+                and int(self.ids[i]) % 2 == 0
+            ))
+            self.assertEqual(results["ids"][q], expected)
+
+    def test_mask_smaller_than_top_k_returns_every_allowed_row(self):
+        index = NumpyIndex(self.tmp)
+        row_mask = np.isin(index.ids, ["3", "7", "11"])
+        results = index.query(self.queries[:1], n_results=TOP_K, row_mask=row_mask)
+        self.assertEqual(sorted(results["ids"][0]), ["11", "3", "7"])
+        results = index.query(self.queries[:1], n_results=TOP_K, row_mask=np.zeros(N_ROWS, dtype=bool))
+        self.assertEqual(results["ids"][0], [])
+
+    def test_get_returns_normalized_rows_for_known_ids(self):
+        index = NumpyIndex(self.tmp)
+        found = index.get(["5", "999", 12])
+        self.assertEqual(found["ids"], ["5", "12"])
+        np.testing.assert_allclose(found["embeddings"], normalize_rows(self.vectors[[4, 11]]), atol=1e-6)
+        self.assertEqual(found["metadatas"], [self.metadatas[4], self.metadatas[11]])
+
+    def test_rejects_snapshot_from_another_format_version(self):
+        meta = load_index_meta(self.tmp)
+        save_index(self.tmp, self.ids, self.vectors, self.metadatas, info={"version": 1})
+        self.assertNotEqual(load_index_meta(self.tmp)["version"], meta["version"])
+        with self.assertRaises(ValueError):
+            NumpyIndex(self.tmp)
+
+
+class QuantizedSnapshotTest(SnapshotTestCase):
+    def test_rescored_quantized_search_keeps_recall(self):
+        for quantization in ("float16", "int8"):
+            save_index(self.tmp, self.ids, self.vectors, self.metadatas, quantization=quantization)
+            index = NumpyIndex(self.tmp, use_quantized=True)
+            self.assertEqual(index.quantization, quantization)
+            results = index.query(self.queries, n_results=TOP_K, where=gender_where("Female"))
+            recalls = []
+            for q, query in enumerate(self.queries):
+                expected, _ = self.brute_force(query, TOP_K, lambda i: self.metadatas[i]["gender"] in GENDER_GROUPS["Female"])
+                recalls.append(recall(expected, results["ids"][q]))
+                # Reported similarities come from the float32 rescore, not the quantized scores
+                rows = [int(cid) - 1 for cid in results["ids"][q]]
+                exact = normalize_rows(self.vectors[rows]) @ normalize_rows(query[None])[0]
+                np.testing.assert_allclose(1.0 - np.asarray(results["distances"][q]), exact, atol=1e-5)
+            self.assertGreaterEqual(np.mean(recalls), 0.95, quantization)
+
+    def test_unquantized_rebuild_removes_quantized_files(self):
+        save_index(self.tmp, self.ids, self.vectors, self.metadatas, quantization="int8")
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, SCALES_FILE)))
+        save_index(self.tmp, self.ids, self.vectors, self.metadatas, quantization="float16")
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, SCALES_FILE)))
+        save_index(self.tmp, self.ids, self.vectors, self.metadatas)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, QUANTIZED_FILE)))
+        self.assertIsNone(NumpyIndex(self.tmp).quantization)
+
+
+class NeighborTableTest(SnapshotTestCase):
+    def test_lookups_match_live_search(self):
+        build_neighbor_table(self.tmp, n_neighbors=TOP_K, block_size=64)
+        table = NeighborTable(self.tmp)
+        index = NumpyIndex(self.tmp)
+        for gender in ["All"] + list(GENDER_GROUPS):
+            for cid in self.ids[::7]:
+                ids, sims = table.lookup(cid, TOP_K, gender)
+                live = index.query(index.get([cid])["embeddings"], n_results=TOP_K + 1, where=gender_where(gender))
+                live_ids = [i for i in live["ids"][0] if i != cid][:TOP_K]
+                live_sims = [1.0 - d for i, d in zip(live["ids"][0], live["distances"][0]) if i != cid][:TOP_K]
+                self.assertEqual([str(i) for i in ids], live_ids, (gender, cid))
+                # The table stores similarities as float16
+                np.testing.assert_allclose(sims, live_sims, atol=2e-3)
+
+    def test_requests_beyond_the_table_fall_back(self):
+        build_neighbor_table(self.tmp, n_neighbors=TOP_K)
+        table = NeighborTable(self.tmp)
+        self.assertIsNone(table.lookup("1", TOP_K + 1))
+        self.assertIsNone(table.lookup("999", 1))
+
+
+class ChunkedIndexTest(SnapshotTestCase):
+    def setUp(self):
+        super().setUp()
+        # Each row's whole-document vector followed by 0-3 review chunk vectors
+        rng = np.random.default_rng(1)
+        snapshot_ids = load_index_meta(self.tmp)["ids"]
+        self.chunks = {}
+        for cid in snapshot_ids:
+            extra = rng.standard_normal((int(cid) % 4, DIM)).astype(np.float32)
+            self.chunks[cid] = normalize_rows(np.vstack([self.vectors[int(cid) - 1][None], extra]))
+        stacked = np.vstack([self.chunks[cid] for cid in snapshot_ids])
+        parents = np.repeat(np.arange(N_ROWS, dtype=np.int32), [len(self.chunks[cid]) for cid in snapshot_ids])
+        np.save(os.path.join(self.tmp, CHUNK_EMBEDDINGS_FILE), stacked)
+        save_chunk_layout(self.tmp, parents, {"ids": snapshot_ids})
+
+    def expected(self, query, aggregation, top_m=2, allowed=None):
+        query = normalize_rows(query[None])[0]
+        scores = {}
+        for cid, chunks in self.chunks.items():
+            sims = np.sort(chunks @ query)[::-1]
+            scores[cid] = sims[0] if aggregation == "max" else sims[:top_m].mean()
+        ranked = sorted((cid for cid in scores if allowed is None or allowed(cid)), key=lambda cid: -scores[cid])
+        return ranked[:TOP_K]
+
+    def test_max_and_top_m_mean_match_brute_force(self):
+        for aggregation in ("max", "mean"):
+            # A small block forces the scoring to split the queries
+            index = ChunkedIndex(self.tmp, aggregation, top_m=2, block_elements=N_ROWS * 4)
+            results = index.query(self.queries, n_results=TOP_K)
+            for q, query in enumerate(self.queries):
+                self.assertEqual(results["ids"][q], self.expected(query, aggregation), aggregation)
+
+    def test_gender_partition_scores_only_its_rows(self):
+        index = ChunkedIndex(self.tmp, "max")
+        results = index.query(self.queries, n_results=TOP_K, where=gender_where("Unisex"))
+        for q, query in enumerate(self.queries):
+            expected = self.expected(query, "max", allowed=lambda cid: self.metadatas[int(cid) - 1]["gender"] == "Unisex")
+            self.assertEqual(results["ids"][q], expected)
+
+    def test_rejects_chunks_built_for_another_snapshot(self):
+        save_index(self.tmp, self.ids[::-1], self.vectors[::-1], self.metadatas[::-1])
+        with self.assertRaises(ValueError):
+            ChunkedIndex(self.tmp)
+
+
+@unittest.skipUnless(importlib.util.find_spec("chromadb"), "chromadb is not installed")
+class ChromaParityTest(SnapshotTestCase):
+    def test_numpy_matches_chroma_results(self):
+        import chromadb
+        client = chromadb.PersistentClient(path=os.path.join(self.tmp, "chroma"))
+        collection = client.create_collection(name="colognes", metadata={"hnsw:space": "cosine"})
+        collection.add(ids=self.ids, embeddings=self.vectors.tolist(), metadatas=self.metadatas)
+        index = NumpyIndex(self.tmp)
+        for where in (None, gender_where("Male")):
+            exact = index.query(self.queries, n_results=TOP_K, where=where)
+            approx = collection.query(query_embeddings=self.queries.tolist(), n_results=TOP_K, where=where)
+            recalls = [recall(e, a) for e, a in zip(exact["ids"], approx["ids"])]
+            # HNSW is approximate, but at this size it should find almost every exact neighbor
+            self.assertGreaterEqual(np.mean(recalls), 0.95)
+            for e, a, ed, ad in zip(exact["ids"], approx["ids"], exact["distances"], approx["distances"]):
+                shared = dict(zip(a, ad))
+                for cid, distance in zip(e, ed):
+                    if cid in shared:
+                        self.assertAlmostEqual(distance, shared[cid], places=4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+from contextlib import closing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import database
+import page_cache
+
+URL = "https://basenotes.test/fragrances/loose/"
+# Notes outside any list item: the li-based parse finds none, patch_notes' fallback finds four
+LOOSE_NOTES_PAGE = (
+    '<html><span class="h1_fragname">Loose</span><span class="h1_house">Fixture House</span><i class="fa-mars"></i>'
+    '<ul class="fragrancenotes"><span>Rose, Oud</span>Amber,<div>Musk</div></ul></html>'
+)
+
+
+class ReparseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved = (database.DB_PATH, page_cache.PAGE_CACHE_DIR)
+        database.DB_PATH = os.path.join(self.tmp, "colognes.db")
+        page_cache.PAGE_CACHE_DIR = os.path.join(self.tmp, "page_cache")
+        database.init_db()
+
+    def tearDown(self):
+        database.DB_PATH, page_cache.PAGE_CACHE_DIR = self.saved
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def notes(self, url):
+        with closing(sqlite3.connect(database.DB_PATH)) as conn:
+            return sorted(name for (name,) in conn.execute('''
+            SELECT n.name FROM cologne_notes cn
+            JOIN notes n ON cn.note_id = n.id
+            JOIN colognes c ON cn.cologne_id = c.id
+            WHERE c.url = ?
+            ''', (url,)))
+
+    def reparse(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return page_cache.reparse_cache(workers=1)
+
+    def test_reparse_keeps_notes_patch_notes_recovered(self):
+        # What patch_notes leaves behind: the page in the cache and its fallback notes saved
+        page_cache.store_page(URL, LOOSE_NOTES_PAGE)
+        database.save_cologne_batch([{
+            "url": URL, "name": "Loose", "brand": "Fixture House", "gender": "Male",
+            "notes": ["Rose", "Oud", "Amber", "Musk"], "reviews": {"positive": 0, "neutral": 0, "negative": 0, "texts": []}
+        }])
+
+        self.assertEqual(self.reparse(), 1)
+        self.assertEqual(self.notes(URL), ["Amber", "Musk", "Oud", "Rose"])
+
+    def test_reparse_overwrites_stored_fields(self):
+        url = "https://basenotes.test/fragrances/listed/"
+        page_cache.store_page(url, '<span class="h1_fragname">Listed</span><ul class="fragrancenotes"><li>Oud, Amber</li></ul>')
+        database.save_cologne_batch([{
+            "url": url, "name": "Listed", "brand": "Unknown", "gender": "Unisex",
+            "notes": ["Rose"], "reviews": {"positive": 0, "neutral": 0, "negative": 0, "texts": []}
+        }])
+
+        self.reparse()
+        self.assertEqual(self.notes(url), ["Amber", "Oud"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from page_parser import parse_details_html, parse_note_text
+
+URL = "https://basenotes.test/fragrances/fixture/"
+
+DETAIL_PAGE = '''
+<html><body>
+<h1><span class="h1_fragname"> Fixture Eau </span> by <span class="h1_house">Fixture House</span></h1>
+<i class="fa fa-venus"></i>
+<ul class="fragrancenotes">
+  <li>Top<ul><li>Bergamot, Pink Pepper</li></ul></li>
+  <li>Heart<ul><li>Rose</li><li>Iris, </li></ul></li>
+  <li>Base<ul><li>Musk</li></ul></li>
+</ul>
+<a href="/fragrances/fixture/reviews/positive/">12 Positive</a>
+<a href="/fragrances/fixture/reviews/neutral/">3 Neutral</a>
+<a href="/fragrances/fixture/reviews/negative/">1 Negative</a>
+<a href="/fragrances/fixture/reviews/positive/">Positive reviews</a>
+<div class="fragreview"><p>Lovely</p> <p>rose opening</p></div>
+<div class="fragreview other">Too sweet</div>
+<div class="fragreview">Lasts all day</div>
+<div class="fragreview">Fourth review</div>
+</body></html>
+'''
+
+
+class ParseDetailsHtmlTest(unittest.TestCase):
+    def test_extracts_every_field(self):
+        data = parse_details_html(DETAIL_PAGE, URL)
+
+        self.assertEqual(data["url"], URL)
+        self.assertEqual((data["name"], data["brand"], data["gender"]), ("Fixture Eau", "Fixture House", "Female"))
+        self.assertEqual(data["notes"], ["Bergamot", "Pink Pepper", "Rose", "Iris", "Musk"])
+        self.assertEqual(data["reviews"], {
+            "positive": 12, "neutral": 3, "negative": 1,
+            # Only the first three reviews are kept
+            "texts": ["Lovely rose opening", "Too sweet", "Lasts all day"]
+        })
+
+    def test_flat_note_list(self):
+        html = '<span class="h1_fragname">Flat</span><i class="fa-mars"></i><ul class="fragrancenotes"><li>Oud, Amber</li><li>Leather</li></ul>'
+        data = parse_details_html(html, URL)
+
+        self.assertEqual(data["notes"], ["Oud", "Amber", "Leather"])
+        self.assertEqual(data["gender"], "Male")
+
+    def test_pages_without_a_fragrance_keep_defaults(self):
+        for html in ("", "   ", "<html><head><title>Just a moment...</title></head><body></body></html>"):
+            data = parse_details_html(html, URL)
+            self.assertEqual((data["name"], data["brand"], data["gender"], data["notes"]), ("Unknown", "Unknown", "Unisex", []))
+            self.assertEqual(data["reviews"], {"positive": 0, "neutral": 0, "negative": 0, "texts": []})
+
+
+class ParseNoteTextTest(unittest.TestCase):
+    def test_recovers_notes_outside_list_items(self):
+        # The shape patch_notes exists for: the li-based parse finds nothing here
+        html = '<span class="h1_fragname">Loose</span><ul class="fragrancenotes"><span>Rose, Oud</span>Amber,<div>Musk</div></ul>'
+        self.assertEqual(parse_details_html(html, URL)["notes"], [])
+        self.assertEqual(parse_note_text(html), ["Rose", "Oud", "Amber", "Musk"])
+        self.assertEqual(parse_details_html(html, URL, note_text_fallback=True)["notes"], ["Rose", "Oud", "Amber", "Musk"])
+
+    def test_covers_the_list_item_notes_too(self):
+        self.assertEqual(parse_note_text('<ul class="fragrancenotes"><li>Oud, Amber</li><li>Leather</li></ul>'), ["Oud", "Amber", "Leather"])
+
+    def test_fallback_leaves_list_item_notes_alone(self):
+        # Only used when the li-based parse found nothing, so its category labels never leak in
+        self.assertEqual(parse_details_html(DETAIL_PAGE, URL, note_text_fallback=True)["notes"], ["Bergamot", "Pink Pepper", "Rose", "Iris", "Musk"])
+
+    def test_pages_without_a_note_list(self):
+        for html in ("", "<html><body><ul><li>Rose</li></ul></body></html>"):
+            self.assertEqual(parse_note_text(html), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
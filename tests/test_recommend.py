@@ -0,0 +1,323 @@
+import asyncio
+import contextlib
+import io
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import ml_pipeline
+from embedding_cache import EmbeddingCache, normalize_query
+from lexical_index import LexicalIndex, tokenize
+from numpy_index import build_neighbor_table, save_index
+from reranker import PopularityReranker
+
+NOTES = ["Rose", "Oud", "Amber", "Vetiver", "Bergamot", "Vanilla"]
+GENDERS = ["Male", "Female", "Unisex"]
+# Module state a test swaps for its own numpy snapshot, restored afterwards
+PIPELINE_STATE = (
+    "SEARCH_BACKEND", "NUMPY_INDEX_PATH", "CHUNKED_REVIEWS", "_collection", "_neighbor_table", "_note_index",
+    "_lexical_index", "_embedding_cache", "_batching_encoder", "_reranker", "RERANK_POOL_SIZE",
+    "RERANK_POPULARITY_WEIGHT", "RERANK_REVIEW_WEIGHT"
+)
+
+
+class CachedQueriesOnly:
+    # Stands in for the batching encoder; queries are put in the embedding cache instead
+    def encode(self, text):
+        raise AssertionError(f"{text!r} should have come from the embedding cache")
+
+
+class SearchTestCase(unittest.TestCase):
+    # Serves ml_pipeline searches from a snapshot of random vectors: cologne
+    # ids 1..n_colognes, genders cycling through GENDERS, three notes each
+    n_colognes = 30
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved = {name: getattr(ml_pipeline, name) for name in PIPELINE_STATE}
+        rng = np.random.default_rng(0)
+        self.ids = list(range(1, self.n_colognes + 1))
+        self.notes = [[NOTES[(i + k) % len(NOTES)] for k in range(3)] for i in range(self.n_colognes)]
+        self.vectors = rng.standard_normal((self.n_colognes, 16)).astype(np.float32)
+        save_index(
+            self.tmp, self.ids, self.vectors,
+            [{"gender": GENDERS[i % 3], "brand": f"Brand {i % 5}", "popularity": float(i)} for i in range(self.n_colognes)],
+            notes=self.notes
+        )
+        ml_pipeline.SEARCH_BACKEND = "numpy"
+        ml_pipeline.NUMPY_INDEX_PATH = self.tmp
+        ml_pipeline.CHUNKED_REVIEWS = False
+        ml_pipeline._collection = ml_pipeline._neighbor_table = ml_pipeline._note_index = ml_pipeline._lexical_index = None
+        ml_pipeline._embedding_cache = EmbeddingCache()
+        ml_pipeline._batching_encoder = CachedQueriesOnly()
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(ml_pipeline, name, value)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def assertSameResults(self, found, expected):
+        # Same ids in the same order; batched scoring may differ from single queries in the last float bits
+        self.assertEqual([ids for ids, _ in found], [ids for ids, _ in expected])
+        for (_, found_sims), (_, expected_sims) in zip(found, expected):
+            np.testing.assert_allclose(found_sims, expected_sims, atol=1e-5)
+
+
+class SimilarSearchTest(SearchTestCase):
+    def test_neighbor_table_matches_live_search(self):
+        # No table files yet, so these run live
+        live = {(cid, gender): ml_pipeline.search_similar(cid, top_k=5, gender=gender) for cid in self.ids[::4] for gender in ("All", "Male")}
+        build_neighbor_table(self.tmp, n_neighbors=10)
+        ml_pipeline._neighbor_table = None
+        self.assertIsNotNone(ml_pipeline.get_neighbor_table().lookup(1, 5))
+        for (cid, gender), (ids, sims) in live.items():
+            table_ids, table_sims = ml_pipeline.search_similar(cid, top_k=5, gender=gender)
+            self.assertEqual(table_ids, ids)
+            np.testing.assert_allclose(table_sims, sims, atol=2e-3)
+
+    def test_seed_is_never_its_own_match(self):
+        ids, _ = ml_pipeline.search_similar(1, top_k=self.n_colognes)
+        self.assertEqual(sorted(ids), self.ids[1:])
+        self.assertEqual(ml_pipeline.search_similar(999), (None, None))
+
+
+class HybridSearchTest(SearchTestCase):
+    # More colognes than HYBRID_POOL_SIZE, so pool sizing shows in the results
+    n_colognes = 80
+
+    def setUp(self):
+        super().setUp()
+        ml_pipeline._lexical_index = LexicalIndex(self.ids, [{t: 3.0 for n in notes for t in tokenize(n)} for notes in self.notes])
+        self.query = "rose garden"
+        ml_pipeline._embedding_cache.put(normalize_query(self.query), self.vectors[0])
+
+    def test_lexical_hits_are_fused_into_semantic_results(self):
+        semantic, _ = ml_pipeline.search_raw_text(self.query, top_k=10)
+        hybrid, sims = ml_pipeline.search_raw_text(self.query, top_k=10, lexical_query="oud")
+        self.assertNotEqual(hybrid, semantic)
+        self.assertEqual(len(hybrid), 10)
+        oud = {cid for cid, notes in zip(self.ids, self.notes) if "Oud" in notes}
+        # Ranked first by both retrievers, so first after fusion
+        self.assertEqual(hybrid[0], next(cid for cid in semantic if cid in oud))
+        self.assertTrue(all(-1.0 <= sim <= 1.0 for sim in sims))
+
+    def test_top_k_beyond_the_hybrid_pool_is_filled(self):
+        ids, _ = ml_pipeline.search_raw_text(self.query, top_k=70, lexical_query="oud")
+        self.assertEqual(len(ids), 70)
+        self.assertEqual(len(set(ids)), 70)
+
+    def test_batched_queries_match_single_searches(self):
+        other = "warm amber"
+        ml_pipeline._embedding_cache.put(normalize_query(other), self.vectors[5])
+        batched = ml_pipeline.search_raw_text_many([self.query, other, self.query], 10, "Male", lexical_queries=["oud", "vanilla", ""])
+        self.assertSameResults(batched, [
+            ml_pipeline.search_raw_text(self.query, 10, "Male", lexical_query="oud"),
+            ml_pipeline.search_raw_text(other, 10, "Male", lexical_query="vanilla"),
+            ml_pipeline.search_raw_text(self.query, 10, "Male"),
+        ])
+        self.assertNotEqual(batched[0][0], batched[2][0])
+
+    def test_filters_apply_to_lexical_hits(self):
+        ids, _ = ml_pipeline.search_raw_text(self.query, top_k=70, gender="Female", lexical_query="oud", exclude_notes=["Vanilla"])
+        for cid in ids:
+            self.assertNotEqual(GENDERS[(cid - 1) % 3], "Male")
+            self.assertNotIn("Vanilla", self.notes[cid - 1])
+
+
+class MultiSeedSearchTest(SearchTestCase):
+    def test_unindexed_seeds_are_told_apart_from_empty_results(self):
+        self.assertEqual(ml_pipeline.search_multi_seed([999, 1000]), (None, None))
+        self.assertEqual(ml_pipeline.search_multi_seed([1, 2], include_notes=["Tobacco"]), ([], []))
+        for method in ("centroid", "rrf"):
+            ids, _ = ml_pipeline.search_multi_seed([1, 999], top_k=5, method=method)
+            self.assertEqual(len(ids), 5)
+            self.assertNotIn(1, ids)
+
+    def test_note_filters_apply_to_results(self):
+        ids, _ = ml_pipeline.search_multi_seed([1, 2], top_k=10, include_notes=["Rose"], exclude_notes=["Oud"])
+        self.assertTrue(ids)
+        for cid in ids:
+            self.assertIn("Rose", self.notes[cid - 1])
+            self.assertNotIn("Oud", self.notes[cid - 1])
+
+    def test_reranking_starts_from_the_fused_order(self):
+        ml_pipeline.RERANK_POOL_SIZE = 20
+        ml_pipeline._reranker = PopularityReranker(self.ids, self.ids, [0] * self.n_colognes, [1] * self.n_colognes)
+        fused, _ = ml_pipeline.search_multi_seed([1, 2, 3], top_k=8, method="rrf")
+        # Weights too small to move anything, with and without the (no-op) brand cap path
+        for diversify in ({}, {"max_per_brand": self.n_colognes}):
+            ids, _ = ml_pipeline.search_multi_seed([1, 2, 3], top_k=8, method="rrf", popularity_weight=1e-9, **diversify)
+            self.assertEqual(ids, fused, diversify)
+
+    def test_realistic_weights_nudge_the_fused_order(self):
+        ml_pipeline.RERANK_POOL_SIZE = 20
+        # Popularity equals the id, so a pure popularity sort would come back in descending id order
+        ml_pipeline._reranker = PopularityReranker(self.ids, self.ids, [0] * self.n_colognes, [1] * self.n_colognes)
+        fused, _ = ml_pipeline.search_multi_seed([1, 2, 3], top_k=8, method="rrf")
+        ids, _ = ml_pipeline.search_multi_seed([1, 2, 3], top_k=8, method="rrf", popularity_weight=0.05)
+        self.assertEqual(ids[:3], fused[:3])
+        self.assertNotEqual(ids, sorted(ids, reverse=True))
+
+
+class EndpointTest(SearchTestCase):
+    @classmethod
+    def setUpClass(cls):
+        from fastapi.testclient import TestClient
+        import api
+        cls.api = api
+        # Not entered as a context manager, so the startup phases (which load the model) never run
+        cls.client = TestClient(api.app)
+
+    def setUp(self):
+        super().setUp()
+        self.api.startup["ready"] = True
+
+    def tearDown(self):
+        self.api.startup["ready"] = False
+        super().tearDown()
+
+    def test_unindexed_seeds_return_404(self):
+        response = self.client.post("/recommend/similar", json={"liked_ids": [999]})
+        self.assertEqual(response.status_code, 404)
+
+    def test_filters_matching_nothing_return_empty_list(self):
+        response = self.client.post("/recommend/similar", json={"liked_ids": [1, 2], "include_notes": ["Tobacco"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+
+    def test_top_k_outside_bounds_is_rejected(self):
+        for top_k in (0, -3, self.api.MAX_TOP_K + 1):
+            self.assertEqual(self.client.get(f"/recommend/similar/1?top_k={top_k}").status_code, 422)
+            for path, body in (
+                ("/recommend/similar", {"liked_ids": [1]}),
+                ("/recommend/quiz", {"preferences": "rose"}),
+                ("/recommend/batch", {"cologne_ids": [1]}),
+            ):
+                self.assertEqual(self.client.post(path, json={**body, "top_k": top_k}).status_code, 422, (path, top_k))
+        self.assertEqual(self.client.post("/recommend/similar", json={"liked_ids": [1], "top_k": self.api.MAX_TOP_K}).status_code, 200)
+
+    def test_batch_matches_single_requests(self):
+        # Every id hydrates, so results compare on ids and match percentages
+        with mock.patch.object(self.api.catalog, "get_details", lambda ids: [{"id": i, "name": f"Cologne {i}"} for i in ids]):
+            build_neighbor_table(self.tmp, n_neighbors=20)
+            preferences = ["rose", "smoky oud"]
+            for k, text in enumerate(preferences):
+                ml_pipeline._embedding_cache.put(normalize_query(self.api.build_quiz_query(text, "Female")), self.vectors[k + 3])
+            ml_pipeline.RERANK_POOL_SIZE = 15
+            ml_pipeline._reranker = PopularityReranker(self.ids, self.ids, [0] * self.n_colognes, self.ids[::-1])
+
+            # min_popularity takes the seeds off the neighbor table onto live search;
+            # server-default re-rank weights apply to both endpoints alike
+            for min_popularity, weights in itertools.product((0.0, 5.0), ((0.0, 0.0), (1.0, 0.5))):
+                ml_pipeline.RERANK_POPULARITY_WEIGHT, ml_pipeline.RERANK_REVIEW_WEIGHT = weights
+                body = {"top_k": 5, "gender": "Female", "min_popularity": min_popularity}
+                batch = self.client.post("/recommend/batch", json={**body, "preferences": preferences, "cologne_ids": [1, 7, 999]})
+                self.assertEqual(batch.status_code, 200)
+                batch = batch.json()
+
+                for entry, text in zip(batch["quiz"], preferences):
+                    single = self.client.post("/recommend/quiz", json={**body, "preferences": text}).json()
+                    self.assertTrue(single)
+                    self.assertEqual(entry["results"], single, (text, min_popularity, weights))
+                for entry, cologne_id in zip(batch["similar"], [1, 7]):
+                    single = self.client.get(f"/recommend/similar/{cologne_id}", params=body).json()
+                    self.assertTrue(single)
+                    self.assertEqual(entry["results"], single, (cologne_id, min_popularity, weights))
+                # An unindexed seed comes back empty instead of failing the batch
+                self.assertEqual(batch["similar"][2], {"cologne_id": 999, "results": []})
+
+
+class InferenceWorkersTest(unittest.TestCase):
+    @unittest.skipUnless(hasattr(os, "sched_getaffinity"), "no CPU affinity on this platform")
+    def test_core_count_is_capped_by_cpu_affinity(self):
+        import api
+        # A container pinned to one CPU on an eight-core host, with no CPU quota
+        cpuinfo = "".join(f"processor\t: {i}\nphysical id\t: 0\ncore id\t\t: {i}\n\n" for i in range(8))
+
+        def host_open(path, *args, **kwargs):
+            if path == "/proc/cpuinfo":
+                return io.StringIO(cpuinfo)
+            raise FileNotFoundError(path)
+
+        with mock.patch("builtins.open", host_open):
+            with mock.patch.object(api.os, "sched_getaffinity", return_value=set(range(8))):
+                self.assertEqual(api._physical_cores(), 8)
+            with mock.patch.object(api.os, "sched_getaffinity", return_value={0}):
+                self.assertEqual(api._physical_cores(), 1)
+
+
+class StartupTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from fastapi.testclient import TestClient
+        import api
+        cls.api = api
+        cls.client = TestClient(api.app)
+
+    def setUp(self):
+        self.saved_phases = self.api.STARTUP_PHASES
+        self.saved_startup = dict(self.api.startup)
+
+    def tearDown(self):
+        self.api.STARTUP_PHASES = self.saved_phases
+        self.api.startup.clear()
+        self.api.startup.update(self.saved_startup)
+
+    def start(self, phases):
+        # Runs load_components over these (name, loader, required) phases
+        self.api.STARTUP_PHASES = phases
+        self.api.startup.update({"ready": False, "phases": {}})
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(self.api.load_components())
+        return self.client.get("/ready")
+
+    @staticmethod
+    def fail():
+        raise RuntimeError("not built")
+
+    def test_failed_required_phase_keeps_the_api_unready(self):
+        response = self.start([("catalog", lambda: None, True), ("index", self.fail, True), ("lexical_index", lambda: None, False)])
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["phases"]["index"]["error"], "not built")
+        self.assertEqual(self.client.post("/recommend/quiz", json={"preferences": "rose"}).status_code, 503)
+
+    def test_failed_optional_phase_is_reported_but_ready(self):
+        response = self.start([("catalog", lambda: None, True), ("lexical_index", self.fail, False)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["phases"]["lexical_index"], {"seconds": mock.ANY, "error": "not built", "required": False})
+        self.assertIn("seconds", response.json()["phases"]["catalog"])
+
+    def test_chroma_deploy_without_a_snapshot_becomes_ready(self):
+        saved = {name: getattr(ml_pipeline, name) for name in ("SEARCH_BACKEND", "NUMPY_INDEX_PATH", "_note_index")}
+        tmp = tempfile.mkdtemp()
+        try:
+            ml_pipeline.SEARCH_BACKEND = "chroma"
+            ml_pipeline.NUMPY_INDEX_PATH = tmp
+            ml_pipeline._note_index = None
+            snapshot_phases = [phase for phase in self.saved_phases if phase[0] in ("index_source", "note_index")]
+            response = self.start(snapshot_phases)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.json()["phases"]["note_index"]["required"])
+            # Only note filters need the snapshot
+            response = self.client.get("/recommend/similar/1?include_notes=Rose")
+            self.assertEqual(response.status_code, 503)
+            self.assertIn("snapshot", response.json()["detail"])
+
+            ml_pipeline.SEARCH_BACKEND = "numpy"
+            self.assertEqual(self.start(snapshot_phases).status_code, 503)
+        finally:
+            for name, value in saved.items():
+                setattr(ml_pipeline, name, value)
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
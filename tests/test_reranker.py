@@ -0,0 +1,77 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from reranker import PopularityReranker, mmr_select
+
+
+class PopularityRerankerTest(unittest.TestCase):
+    def setUp(self):
+        # Ids out of order on purpose; 30 is the most reviewed, 10 has two glowing reviews
+        self.reranker = PopularityReranker(
+            cologne_ids=[30, 10, 20],
+            positive=[800, 2, 50],
+            neutral=[100, 0, 0],
+            negative=[100, 0, 50],
+        )
+
+    def test_zero_weights_keep_similarity_order(self):
+        ids, sims = self.reranker.rerank([10, 20, 30], [0.9, 0.8, 0.7], top_k=3)
+        self.assertEqual(ids, [10, 20, 30])
+        self.assertEqual(sims, [0.9, 0.8, 0.7])
+
+    def test_popularity_weight_promotes_reviewed_colognes(self):
+        ids, sims = self.reranker.rerank([10, 20, 30], [0.9, 0.8, 0.7], top_k=2, popularity_weight=0.5)
+        self.assertEqual(ids, [30, 20])
+        # Reported similarities are the original ones, not the blended score
+        self.assertEqual(sims, [0.7, 0.8])
+
+    def test_sentiment_is_smoothed_toward_the_catalog_share(self):
+        popularity, sentiment = self.reranker.features([10, 20, 30])
+        self.assertAlmostEqual(float(popularity[2]), 1.0, places=6)
+        self.assertTrue(popularity[0] < popularity[1] < popularity[2])
+        # Two positive reviews shouldn't beat 800 of 900 rated positive
+        self.assertLess(sentiment[0], sentiment[2])
+        self.assertGreater(sentiment[0], sentiment[1])
+
+    def test_unknown_ids_score_neutral(self):
+        popularity, sentiment = self.reranker.features([999, 5])
+        np.testing.assert_array_equal(popularity, [0.0, 0.0])
+        np.testing.assert_array_equal(sentiment, [0.5, 0.5])
+        popularity, sentiment = PopularityReranker([], [], [], []).features([1])
+        self.assertEqual((float(popularity[0]), float(sentiment[0])), (0.0, 0.5))
+
+
+class MmrSelectTest(unittest.TestCase):
+    def setUp(self):
+        # Candidates 0-2 are near duplicates; 3 and 4 point elsewhere
+        self.embeddings = np.array([
+            [1.0, 0.0, 0.0],
+            [0.99, 0.1, 0.0],
+            [0.98, 0.0, 0.1],
+            [0.0, 1.0, 0.0],
+            [0.0, 0.0, 1.0],
+        ], dtype=np.float32)
+        self.relevance = [0.9, 0.89, 0.88, 0.7, 0.6]
+
+    def test_no_diversity_is_relevance_order(self):
+        self.assertEqual(mmr_select(self.relevance, self.embeddings, 4), [0, 1, 2, 3])
+
+    def test_diversity_skips_near_duplicates(self):
+        self.assertEqual(mmr_select(self.relevance, self.embeddings, 3, diversity=0.5), [0, 3, 4])
+
+    def test_brand_cap_limits_picks_per_brand(self):
+        brands = ["A", "A", "B", "A", "B"]
+        self.assertEqual(mmr_select(self.relevance, self.embeddings, 5, brands=brands, max_per_brand=1), [0, 2])
+
+    def test_small_or_empty_pools(self):
+        self.assertEqual(mmr_select([], np.empty((0, 3)), 5), [])
+        self.assertEqual(sorted(mmr_select(self.relevance, self.embeddings, 10, diversity=0.3)), [0, 1, 2, 3, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()